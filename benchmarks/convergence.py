@@ -0,0 +1,114 @@
+import sys
+import json
+import math
+import time
+import logging
+import pathlib
+import argparse
+import tempfile
+import statistics
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+import modules.app_autoscale as app_autoscale
+import modules.scheduler as scheduler
+import modules.settings as settings
+from benchmarks.scaleit_server import ScaleItStandIn, step_load, ramp_load
+
+
+# Each scenario starts at 3 replicas with 2 replicas worth of load, the load then rises to `peak`.
+SCENARIOS = {
+    'spike': dict(peak=12, spike_at=1.0, stand_in=dict(load_curve=step_load(2, 12, at=1.0), replicas=3, startup_delay_seconds=0.5)),
+    'ramp': dict(peak=12, spike_at=1.0, stand_in=dict(load_curve=ramp_load(2, 12, at=1.0, duration=2.0), replicas=3, startup_delay_seconds=0.5)),
+    'spike_5xx': dict(peak=12, spike_at=1.0, stand_in=dict(load_curve=step_load(2, 12, at=1.0), replicas=3, startup_delay_seconds=0.5, error_rate=0.2, seed=1)),
+    'spike_slow_api': dict(peak=12, spike_at=1.0, stand_in=dict(load_curve=step_load(2, 12, at=1.0), replicas=3, startup_delay_seconds=0.5, latency_seconds=0.05)),
+}
+# Seconds instead of minutes, so a scenario finishes in a few seconds of wall time.
+BENCHMARK_SETTINGS = {
+    'autoscale_engine_runs_every': 0.1,
+    'cool_down_time_seconds': 1,
+    'min_replicas': 1,
+    'max_replicas': 50,
+    'retry_after_seconds': 0.05,
+    'retry_exponentially': False,
+    'app_connection_timeout': 2,
+}
+
+
+def benchmark_settings(stand_in, lock_dir, overrides=None):
+    configs = settings.settings(sys_config=parent_dir + '/etc/system_settings.cfg', user_config=parent_dir + '/etc/user_settings.cfg')
+    configs.update(BENCHMARK_SETTINGS)
+    configs.update(overrides or {})
+    configs['app_status_host'] = stand_in.host
+    configs['app_status_port'] = stand_in.port
+    configs['app_status_secure'] = False
+    configs['cooldown_lock_file'] = f'{lock_dir}/cooldown.lock'
+    log = logging.getLogger('benchmark')
+    log.setLevel(logging.ERROR)
+    configs['log'] = log
+    return configs
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+def run_scenario(scenario, duration_seconds=10.0, overrides=None):
+    with tempfile.TemporaryDirectory() as lock_dir, ScaleItStandIn(**scenario['stand_in']) as stand_in:
+        configs = benchmark_settings(stand_in, lock_dir, overrides)
+        autoscale_engine_runs_every = configs.get('autoscale_engine_runs_every')
+        target = configs.get('target_avg_cpu_utilization_for_scale_out')
+        samples = []
+        tick_latencies = []
+        missed_ticks = 0
+        # Same loop as main.main.
+        tick_scheduler = scheduler.TickScheduler(autoscale_engine_runs_every)
+        while stand_in.elapsed() < duration_seconds:
+            started = time.monotonic()
+            app_autoscale.autoscale_tick(settings=configs, dry_run=False)
+            tick_latencies.append(time.monotonic() - started)
+            samples.append((stand_in.elapsed(), stand_in.cpu(), stand_in.replicas()))
+            missed_ticks += tick_scheduler.advance()
+            time.sleep(tick_scheduler.remaining())
+        calls = dict(stand_in.calls)
+    spike_at = scenario['spike_at']
+    required_replicas = math.ceil(scenario['peak'] / (scenario['stand_in'].get('replica_capacity', 1.0) * target))
+    time_to_converge = None
+    for elapsed, cpu, replicas in reversed(samples):
+        if elapsed < spike_at or cpu > target:
+            break
+        time_to_converge = elapsed - spike_at
+    return {
+        'time_to_converge_seconds': None if time_to_converge is None else round(time_to_converge, 3),
+        'overshoot_replicas': max(0, max(replicas for _, _, replicas in samples) - required_replicas),
+        'final_replicas': samples[-1][2],
+        'required_replicas': required_replicas,
+        'status_calls': calls['status'],
+        'update_calls': calls['replicas'],
+        'injected_errors': calls['errors'],
+        'ticks': len(tick_latencies),
+        'missed_ticks': missed_ticks,
+        'tick_p50_ms': round(statistics.median(tick_latencies) * 1000, 2),
+        'tick_p99_ms': round(_percentile(tick_latencies, 99) * 1000, 2),
+        'tick_max_ms': round(max(tick_latencies) * 1000, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end convergence benchmark against a local ScaleIt stand-in.')
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', help=f'Any of {list(SCENARIOS)}, all by default.')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run each scenario.')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    args = parser.parse_args()
+    unknown_scenarios = set(args.scenarios) - set(SCENARIOS)
+    if unknown_scenarios:
+        parser.error(f'Unknown scenarios {sorted(unknown_scenarios)}')
+    results = {name: run_scenario(SCENARIOS[name], duration_seconds=args.duration) for name in args.scenarios or SCENARIOS}
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    columns = list(next(iter(results.values())))
+    print('\t'.join(['scenario'] + columns))
+    for name, result in results.items():
+        print('\t'.join([name] + [str(result[column]) for column in columns]))
+
+
+if __name__ == '__main__':
+    main()
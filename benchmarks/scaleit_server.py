@@ -0,0 +1,142 @@
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def constant_load(load):
+    return lambda elapsed: load
+
+def step_load(base, peak, at):
+    # Load (in replicas worth of work) jumps from base to peak after `at` seconds.
+    return lambda elapsed: peak if elapsed >= at else base
+
+def ramp_load(base, peak, at, duration):
+    def load(elapsed):
+        if elapsed < at:
+            return base
+        return base + (peak - base) * min((elapsed - at) / duration, 1.0)
+    return load
+
+
+class ScaleItStandIn:
+    # Simulates one app behind the ScaleIt /app/status and /app/replicas API. The load curve returns the
+    # total work at a given second, a ready replica handles `replica_capacity` of it at 100% cpu and a new
+    # replica only takes load after `startup_delay_seconds`.
+    def __init__(self, load_curve, replicas=1, replica_capacity=1.0, startup_delay_seconds=0.0,
+                 error_rate=0.0, latency_seconds=0.0, host='127.0.0.1', port=0, seed=None):
+        self.load_curve = load_curve
+        self.replica_capacity = replica_capacity
+        self.startup_delay_seconds = startup_delay_seconds
+        self.error_rate = error_rate
+        self.latency_seconds = latency_seconds
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.ready_at = [self.started] * replicas
+        self.calls = {'status': 0, 'replicas': 0, 'errors': 0}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self.thread = None
+
+    def start(self):
+        self.started = time.monotonic()
+        self.ready_at = [self.started] * len(self.ready_at)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='scaleit-stand-in', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def replicas(self):
+        with self.lock:
+            return len(self.ready_at)
+
+    def ready_replicas(self):
+        now = time.monotonic()
+        with self.lock:
+            return sum(1 for ready_at in self.ready_at if ready_at <= now)
+
+    def cpu(self):
+        ready_replicas = self.ready_replicas()
+        if not ready_replicas:
+            return 1.0
+        load = self.load_curve(self.elapsed())
+        return round(min(load / (ready_replicas * self.replica_capacity), 1.0), 4)
+
+    def set_replicas(self, replicas):
+        now = time.monotonic()
+        with self.lock:
+            if replicas > len(self.ready_at):
+                self.ready_at.extend([now + self.startup_delay_seconds] * (replicas - len(self.ready_at)))
+            else:
+                # Replicas that are still starting are removed first.
+                self.ready_at = sorted(self.ready_at)[:replicas]
+
+    def _inject_failure(self):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        if self.error_rate and self.random.random() < self.error_rate:
+            with self.lock:
+                self.calls['errors'] += 1
+            return True
+        return False
+
+    def _count(self, endpoint):
+        with self.lock:
+            self.calls[endpoint] += 1
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Keep-alive, so the pooled client reuses its connections.
+
+            def do_GET(self):
+                if self.path != '/app/status':
+                    return self._reply(404)
+                stand_in._count('status')
+                if stand_in._inject_failure():
+                    return self._reply(503)
+                self._reply(200, { "cpu": { "highPriority": stand_in.cpu() }, "replicas": stand_in.replicas() })
+
+            def do_PUT(self):
+                # The body is always read, otherwise it would be parsed as the next request on this connection.
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path != '/app/replicas':
+                    return self._reply(404)
+                stand_in._count('replicas')
+                if stand_in._inject_failure():
+                    return self._reply(503)
+                try:
+                    replicas = int(json.loads(body)['replicas'])
+                except (ValueError, KeyError, TypeError):
+                    return self._reply(400)
+                stand_in.set_replicas(replicas)
+                self._reply(204)
+
+            def _reply(self, status_code, data=None):
+                body = json.dumps(data).encode() if data is not None else b''
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                return
+
+        return Handler
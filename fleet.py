@@ -0,0 +1,36 @@
+import asyncio
+
+# Local imports
+import modules.fleet as fleet
+import modules.scale_state as scale_state
+import modules.metrics as metrics
+import modules.ingest as ingest
+import modules.sample_feed as sample_feed
+import modules.settings as settings
+from modules.logger import get_logger
+
+
+config_watcher = settings.ConfigWatcher(sys_config='etc/system_settings.cfg', user_config='etc/user_settings.cfg')
+configs = config_watcher.config.as_settings()
+settings.write_effective_config(configs['config'])
+fleet_apps_file = configs.get('fleet_apps_file')
+log =  get_logger(logger_name=__name__, settings=configs)
+configs['log'] = log
+
+
+
+def main():
+    metrics.serve_metrics(metrics.get_metrics(configs), configs.get('metrics_host'), configs.get('metrics_port'), log,
+                          sample_feed=sample_feed.get_feed(configs))
+    if configs.get('push_ingestion'):
+        ingest.start_listeners(ingest.get_inbox(configs), configs, log)
+    apps = fleet.load_apps(fleet_apps_file, configs)
+    scale_state.clear_cooldown_on_signal(scale_state.get_store(configs), log)
+    try:
+        asyncio.run(fleet.run_fleet(apps, configs, dry_run=False, config_watcher=config_watcher))
+    except KeyboardInterrupt:
+        log.warning('User you have pressed ctrl-c button.')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,109 @@
+import argparse
+from collections import deque
+import numpy as np
+import requests
 import matplotlib.pyplot as plt
+from matplotlib.animation import FuncAnimation
 
 # Local imports
-import modules.scaleit_client as scaleit_client
 from modules.logger import get_logger
 import modules.settings as settings
 
 
 configs =  settings.settings(sys_config='etc/system_settings.cfg', user_config='etc/user_settings.cfg')
 graph_kpi_period = configs.get('graph_kpi_period')
+graph_window_samples = configs.get('graph_window_samples')
 log =  get_logger(logger_name=__name__, settings=configs)
 configs['log'] = log
 
 
-try:
-    t = 0
-    while True:
-        t += 1
-        current_cpu_utilization, current_replica_count = scaleit_client.find_current_cpu_stats(settings=configs)
-        if current_cpu_utilization:
-            plt.scatter(t, current_cpu_utilization)
-            plt.pause(graph_kpi_period)
-    plt.show()
-except KeyboardInterrupt:
-    log.warning('User you have pressed ctrl-c button.')
-except Exception as e:
-    log.error(f'Error - {e}')
-finally:
-    log.info('Graph END')
+class Dashboard:
+    # Shows the last graph_window_samples ticks of one app, read from the running auto-scaler's /samples feed
+    # (no calls to the status API of its own). Only new samples are fetched, they go into a fixed-size ring,
+    # and every redraw updates the same line artists with blitting, so memory and redraw time stay constant.
+    def __init__(self, feed_url, app_name, window):
+        self.feed_url = feed_url
+        self.app_name = app_name
+        self.window = window
+        self.samples = deque(maxlen=window)
+        self.seq = 0
+        self.session = requests.Session()
+        self.x = np.arange(-window + 1, 1)
+        self.fig, self.cpu_axes = plt.subplots(figsize=(12, 6))
+        self.replicas_axes = self.cpu_axes.twinx()
+        self.cpu_axes.set_xlim(-window + 1, 0)
+        self.cpu_axes.set_ylim(0, 1.1)
+        self.replicas_axes.set_ylim(0, 10)
+        self.cpu_axes.set_xlabel('Ticks ago')
+        self.cpu_axes.set_ylabel('Avg CPU')
+        self.replicas_axes.set_ylabel('Replicas')
+        self.cpu_axes.set_title(f'Auto-scaler: {app_name}')
+        empty = np.full(window, np.nan)
+        self.cpu_line, = self.cpu_axes.plot(self.x, empty, color='tab:blue', label='Avg CPU')
+        self.scale_out_line, = self.cpu_axes.plot(self.x, empty, color='tab:red', linestyle='--', label='Scale-out target')
+        self.scale_in_line, = self.cpu_axes.plot(self.x, empty, color='tab:green', linestyle='--', label='Scale-in target')
+        self.cooldown_line, = self.cpu_axes.plot(self.x, empty, color='tab:gray', linewidth=6, alpha=0.5, label='Cooldown / converging')
+        self.replicas_line, = self.replicas_axes.step(self.x, empty, where='post', color='black', label='Replicas')
+        self.desired_line, = self.replicas_axes.step(self.x, empty, where='post', color='tab:orange', linestyle=':', label='Desired replicas')
+        self.artists = (self.cpu_line, self.scale_out_line, self.scale_in_line, self.cooldown_line, self.replicas_line, self.desired_line)
+        self.cpu_axes.legend(handles=self.artists, loc='upper left', fontsize='small')
+
+    def fetch(self):
+        response = self.session.get(self.feed_url, params={'app': self.app_name, 'since': self.seq}, timeout=graph_kpi_period)
+        response.raise_for_status()
+        feed = response.json()
+        if feed['seq'] < self.seq:
+            # The auto-scaler was restarted, start over.
+            self.samples.clear()
+        self.seq = feed['seq']
+        self.samples.extend(feed['samples'])
+
+    def update(self, frame):
+        try:
+            self.fetch()
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            log.error(f'Unable to read samples from {self.feed_url}, error - {e}')
+            return self.artists
+        if not self.samples:
+            return self.artists
+        # Right-aligned in a window-sized buffer, the newest tick is at x=0.
+        values = np.full((self.window, 5), np.nan)
+        values[-len(self.samples):] = [sample[2:7] for sample in self.samples]
+        cooling_down = np.zeros(self.window, dtype=bool)
+        cooling_down[-len(self.samples):] = [sample[7] in ('cooldown', 'converging') for sample in self.samples]
+        cpu, replicas, desired, scale_out_target, scale_in_target = values.T
+        self.cpu_line.set_ydata(cpu)
+        self.scale_out_line.set_ydata(scale_out_target)
+        self.scale_in_line.set_ydata(scale_in_target)
+        self.cooldown_line.set_ydata(np.where(cooling_down, 1.05, np.nan))
+        self.replicas_line.set_ydata(replicas)
+        self.desired_line.set_ydata(desired)
+        highest_replicas = np.nanmax(np.concatenate((replicas, desired)))
+        if highest_replicas > self.replicas_axes.get_ylim()[1] * 0.95:
+            # A new axis range is the one change that needs a full redraw instead of a blit.
+            self.replicas_axes.set_ylim(0, highest_replicas * 1.25)
+            self.fig.canvas.draw_idle()
+        return self.artists
+
+
+def main():
+    metrics_url = f'http://{configs.get("metrics_host")}:{configs.get("metrics_port")}/samples'
+    parser = argparse.ArgumentParser(description='Live dashboard of a running auto-scaler.')
+    parser.add_argument('--app', default='default', help='app_name to show in fleet mode.')
+    parser.add_argument('--url', default=metrics_url, help='Sample feed of the auto-scaler (see metrics_host and metrics_port).')
+    args = parser.parse_args()
+    if not configs.get('metrics_port'):
+        log.error('metrics_port is 0, the auto-scaler is not serving the sample feed the dashboard reads.')
+    dashboard = Dashboard(args.url, args.app, graph_window_samples)
+    animation = FuncAnimation(dashboard.fig, dashboard.update, interval=graph_kpi_period * 1000, blit=True, cache_frame_data=False)
+    try:
+        plt.show()
+    except KeyboardInterrupt:
+        log.warning('User you have pressed ctrl-c button.')
+    finally:
+        log.info('Graph END')
+    return animation
+
+
+if __name__ == '__main__':
+    main()
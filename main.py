@@ -2,31 +2,78 @@ import time
 
 # Local imports
 import modules.app_autoscale as app_autoscale
-import modules.scaleit_client as scaleit_client
+import modules.scale_state as scale_state
+import modules.metrics as metrics
+import modules.ingest as ingest
+import modules.sample_feed as sample_feed
+import modules.shard as shard
+import modules.scheduler as scheduler
 import modules.settings as settings
 from modules.logger import get_logger
 
 
-configs =  settings.settings(sys_config='etc/system_settings.cfg', user_config='etc/user_settings.cfg')
-autoscale_engine_runs_every = configs.get('autoscale_engine_runs_every')
+config_watcher = settings.ConfigWatcher(sys_config='etc/system_settings.cfg', user_config='etc/user_settings.cfg')
+configs = config_watcher.config.as_settings()
+settings.write_effective_config(configs['config'])
 log =  get_logger(logger_name=__name__, settings=configs)
 configs['log'] = log
                              
 
 
+def _wait_for_next_tick(configs_in_use, tick_scheduler):
+    inbox = configs_in_use.get('sample_inbox')
+    if inbox is None:
+        time.sleep(tick_scheduler.remaining())
+        return
+    # A pushed sample outside the targets gets a decision right away, the regular tick still runs on schedule.
+    app_name = configs_in_use.get('app_name') or scale_state.DEFAULT_APP_NAME
+    while True:
+        remaining = tick_scheduler.remaining()
+        if remaining <= 0:
+            return
+        if ingest.wait_for_triggers(inbox, {app_name: configs_in_use}, remaining):
+            log.info('Pushed sample crossed a target, running an early check.')
+            app_autoscale.autoscale_tick(settings=configs_in_use, dry_run=False, scheduled=False)
+
 def main():
+    configs_in_use = configs
+    scale_state.clear_cooldown_on_signal(scale_state.get_store(configs_in_use), log)
+    metrics.serve_metrics(metrics.get_metrics(configs_in_use), configs_in_use.get('metrics_host'), configs_in_use.get('metrics_port'), log,
+                          sample_feed=sample_feed.get_feed(configs_in_use))
+    if configs_in_use.get('push_ingestion'):
+        ingest.start_listeners(ingest.get_inbox(configs_in_use), configs_in_use, log)
+    app_name = configs_in_use.get('app_name') or scale_state.DEFAULT_APP_NAME
+    autoscale_engine_runs_every = configs_in_use.get('autoscale_engine_runs_every')
+    # Ticks are due at fixed deadlines on the monotonic clock, the first one after this app's jitter offset.
+    tick_scheduler = scheduler.TickScheduler(autoscale_engine_runs_every, scheduler.phase_offset(app_name, autoscale_engine_runs_every, configs_in_use.get('tick_jitter_fraction')))
     try:
+        time.sleep(tick_scheduler.remaining())
         while True:
-            current_cpu_utilization, current_replica_count = scaleit_client.find_current_cpu_stats(settings=configs)
-            if current_cpu_utilization and current_replica_count:
-                app_autoscale.scale_app_replicas(current_replica_count=current_replica_count,
-                                                 current_cpu_utilization=current_cpu_utilization, dry_run=False,
-                                                 settings=configs)
+            # With shard_dir set, only the worker holding the app's lease scales it, the others stand by to take over.
+            controlling = bool(shard.claim_apps([configs_in_use], configs_in_use))
+            if controlling:
+                app_autoscale.autoscale_tick(settings=configs_in_use, dry_run=False)
             else:
-                log.warning('Auto Scaler execution skipped, check stats API return values.')
-            log.info(f'Next check will be after {autoscale_engine_runs_every} seconds.')
+                log.info('Another worker controls this app, standing by.')
+            # Config changes are swapped in between two ticks, the live state (cooldown, windows, session) is kept.
+            config = config_watcher.poll(log)
+            if config is not None:
+                configs_in_use = config.as_settings(configs_in_use)
+                settings.write_effective_config(config)
+                get_logger(logger_name=__name__, settings=configs_in_use)
+            missed = tick_scheduler.advance(configs_in_use.get('autoscale_engine_runs_every'))
+            if missed:
+                log.warning(f'Tick overran its interval of {tick_scheduler.interval} seconds, skipping {missed} missed tick(s).')
+                scaler_metrics = metrics.get_metrics(configs_in_use)
+                scaler_metrics.tick_overruns.inc((metrics.app_label(configs_in_use),))
+                scaler_metrics.missed_tick_deadlines.inc((metrics.app_label(configs_in_use),), missed)
+                app_autoscale.skip_forecast(configs_in_use, missed)
+            log.info(f'Next check will be after {round(tick_scheduler.remaining(), 2)} seconds.')
             log.info('_____________________________________________________________________________\n\n')
-            time.sleep(autoscale_engine_runs_every)
+            if controlling:
+                _wait_for_next_tick(configs_in_use, tick_scheduler)
+            else:
+                time.sleep(tick_scheduler.remaining())
     except KeyboardInterrupt:
         log.warning('User you have pressed ctrl-c button.')
 
@@ -0,0 +1,86 @@
+import time
+import threading
+
+
+SENT = 'sent'
+FAILED = 'failed'
+COALESCED = 'coalesced'
+QUEUED = 'queued'
+CONVERGING = 'converging'
+CONVERGED = 'converged'
+TIMED_OUT = 'timed-out'
+
+
+class Actuator:
+    # Per-app stage between a decision and the replicas API. At most one update is in flight, a target that
+    # arrives meanwhile replaces any older queued one and is sent when the running update is done. A target
+    # equal to the one still being converged to is not sent again. After an acknowledged update the app is
+    # "converging" until the reported replicas reach the target (and, for a scale-out, settle_seconds more
+    # while the new replicas start up), or until the convergence timeout.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = False
+        self.queued = None
+        self.pending_target = None
+        self.pending_since = None
+        self.settle_seconds = 0
+        self.reached_at = None
+
+    def submit(self, target, send, settle_seconds=0):
+        with self.lock:
+            if target == self.pending_target:
+                return COALESCED
+            if self.in_flight:
+                self.queued = (target, send, settle_seconds)
+                return QUEUED
+            self.in_flight = True
+        status = None
+        try:
+            while True:
+                done = send(target)
+                with self.lock:
+                    if done:
+                        self.pending_target = target
+                        self.pending_since = time.monotonic()
+                        self.settle_seconds = settle_seconds
+                        self.reached_at = None
+                    if status is None:
+                        status = SENT if done else FAILED
+                    queued, self.queued = self.queued, None
+                    if queued is None or queued[0] == self.pending_target:
+                        return status
+                target, send, settle_seconds = queued
+        finally:
+            with self.lock:
+                self.in_flight = False
+
+    def check(self, current_replicas, converge_timeout_seconds):
+        # Compares a status reading with the pending target, None when nothing is pending.
+        with self.lock:
+            if self.pending_target is None:
+                return None
+            now = time.monotonic()
+            if current_replicas == self.pending_target:
+                if self.reached_at is None:
+                    self.reached_at = now
+                if now - self.reached_at < self.settle_seconds:
+                    return CONVERGING
+                self.pending_target = None
+                return CONVERGED
+            self.reached_at = None
+            if now - self.pending_since >= converge_timeout_seconds:
+                self.pending_target = None
+                return TIMED_OUT
+            return CONVERGING
+
+    def converging_for(self):
+        with self.lock:
+            return time.monotonic() - self.pending_since if self.pending_since is not None else 0
+
+
+def get_actuator(settings):
+    actuator = settings.get('actuator')
+    if actuator is None:
+        actuator = Actuator()
+        settings['actuator'] = actuator
+    return actuator
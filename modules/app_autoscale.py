@@ -2,10 +2,19 @@ import sys
 import math
 import time
 import pathlib
+import numpy as np
 
 # Local imports
 sys.path.insert(0, str(pathlib.Path(__file__).parent))
 import scaleit_client
+import scale_state
+import metrics
+import ingest
+import actuator
+import sample_feed
+import history
+from metric_window import MetricWindow, validate_aggregate
+from forecast import HoltWintersForecaster
 
 
 def _find_desired_replicas_count(current_replica_count, current_cpu_utilization, settings):
@@ -13,107 +22,467 @@ def _find_desired_replicas_count(current_replica_count, current_cpu_utilization,
     desired_replicas_count = math.ceil(current_replica_count * (current_cpu_utilization / target_avg_cpu_utilization_for_scale_out))
     return desired_replicas_count
 
-def _need_to_cooldown(cooldown_lock_file, settings):
+def _find_policy_replicas_counts(current_replica_count, policy_values, settings):
+    # Desired replicas per scaling policy metric, each from its own value and scale-out target. A metric that
+    # could not be read (None) asks for nothing.
+    replicas_counts = {}
+    for policy in settings.get('scaling_policies') or ():
+        value = policy_values.get(policy['name'])
+        replicas_counts[policy['name']] = None if value is None else math.ceil(current_replica_count * (value / policy['scale_out_target']))
+    return replicas_counts
+
+def cool_down_time_seconds_for(action, settings):
+    # The scale-out or scale-in cooldown, -1 (or no action to take) means cool_down_time_seconds.
+    if action is not None:
+        cool_down_time_seconds = settings.get(f'{action.replace("-", "_")}_cool_down_time_seconds')
+        if cool_down_time_seconds is not None and cool_down_time_seconds >= 0:
+            return cool_down_time_seconds
+    return settings.get('cool_down_time_seconds')
+
+def is_emergency_scale_out(action, current_cpu_utilization, settings):
+    emergency_scale_out_utilization = settings.get('emergency_scale_out_utilization')
+    return action == 'scale-out' and bool(emergency_scale_out_utilization) and current_cpu_utilization >= emergency_scale_out_utilization
+
+def _pending_action(desired_replicas_count, current_replica_count, settings):
+    # The direction a decision would take, before flapping protection; it picks the cooldown that applies.
+    limited_replicas_count = min(max(desired_replicas_count, settings.get('min_replicas')), settings.get('max_replicas'))
+    if limited_replicas_count > current_replica_count:
+        return 'scale-out'
+    if limited_replicas_count < current_replica_count:
+        return 'scale-in'
+    return None
+
+def _need_to_cooldown(settings, action=None, current_cpu_utilization=None):
     log = settings.get('log')
-    cool_down_time_seconds = settings.get('cool_down_time_seconds')
-    log.debug(f'Reading cooldown {cooldown_lock_file} lock file.')
-    try:
-        with open(cooldown_lock_file) as fh:
-            last_cooldown_time = fh.read().strip()
-            last_cooldown_time = float(last_cooldown_time)
-            seconds_from_last_scaler_action = time.time() - last_cooldown_time
-            seconds_from_last_scaler_action = math.floor(seconds_from_last_scaler_action)
-            if seconds_from_last_scaler_action < cool_down_time_seconds:
-                log.info(f'Need to cooldown, auto-scaler will ignore any scale-out/in. Last scale action executed {seconds_from_last_scaler_action} secs before (cooldown: {cool_down_time_seconds} secs)')
-                return True
-            else:
-                log.debug(f'No need to cooldown, last scale action executed {seconds_from_last_scaler_action} secs before (cooldown: {cool_down_time_seconds} secs)')
-    except Exception as e:
-        log.debug(f'Unable to read {cooldown_lock_file} cooldown lock file, will scale anyway, error - {e}')
+    cool_down_time_seconds = cool_down_time_seconds_for(action, settings)
+    seconds_from_last_scaler_action = scale_state.get_store(settings).seconds_since_last_action(settings.get('app_name'))
+    if seconds_from_last_scaler_action is None:
+        log.debug('No scale action recorded yet, no need to cooldown.')
+        return False
+    seconds_from_last_scaler_action = math.floor(seconds_from_last_scaler_action)
+    if seconds_from_last_scaler_action < cool_down_time_seconds:
+        if current_cpu_utilization is not None and is_emergency_scale_out(action, current_cpu_utilization, settings):
+            log.warning('Avg CPU %s is at or above the emergency utilization %s, scaling out during the cooldown. Last scale action executed %s secs before (cooldown: %s secs)', current_cpu_utilization, settings.get('emergency_scale_out_utilization'), seconds_from_last_scaler_action, cool_down_time_seconds)
+            metrics.get_metrics(settings).emergency_scale_outs.inc((metrics.app_label(settings),))
+            return False
+        log.info('Need to cooldown, auto-scaler will ignore any %s. Last scale action executed %s secs before (cooldown: %s secs)', action or 'scale-out/in', seconds_from_last_scaler_action, cool_down_time_seconds)
+        return True
+    log.debug('No need to cooldown, last scale action executed %s secs before (cooldown: %s secs)', seconds_from_last_scaler_action, cool_down_time_seconds)
     return False
 
-def _verify_desired_replicas_count(desired_replicas_count, settings):
+def _max_scale_step(current_replica_count, settings):
+    # Largest change of one scale action, None without a limit. The percentage is of the current replicas.
+    max_scale_steps = []
+    if settings.get('max_scale_step'):
+        max_scale_steps.append(settings.get('max_scale_step'))
+    if settings.get('max_scale_step_percent'):
+        max_scale_steps.append(max(math.ceil(current_replica_count * settings.get('max_scale_step_percent') / 100), 1))
+    return min(max_scale_steps) if max_scale_steps else None
+
+def _verify_desired_replicas_count(desired_replicas_count, settings, current_replica_count=None):
     log = settings.get('log')
     max_replicas = settings.get('max_replicas')
     min_replicas = settings.get('min_replicas')
-    log.info(f'Desired replicas {desired_replicas_count} must be between min: {min_replicas}, max: {max_replicas}')
+    max_scale_step = _max_scale_step(current_replica_count, settings) if current_replica_count is not None else None
+    if max_scale_step and abs(desired_replicas_count - current_replica_count) > max_scale_step:
+        # A bigger jump is made in steps, the min/max limits still win over the step size.
+        staged_replicas_count = current_replica_count + max_scale_step if desired_replicas_count > current_replica_count else current_replica_count - max_scale_step
+        log.info('Desired replicas %s is more than %s replicas away, scaling to %s in this step.', desired_replicas_count, max_scale_step, staged_replicas_count)
+        metrics.get_metrics(settings).step_limited_actions.inc((metrics.app_label(settings),))
+        desired_replicas_count = staged_replicas_count
+    log.info('Desired replicas %s must be between min: %s, max: %s', desired_replicas_count, min_replicas, max_replicas)
     return min(max(desired_replicas_count, min_replicas), max_replicas)
     
-def _record_scale_action_time(cooldown_lock_file, settings):
-    log = settings.get('log')
-    try:
-        with open(cooldown_lock_file, 'w') as fh:
-            fh.write(str(time.time()))
-    except Exception as e:
-        log.debug(f'Unable to record scale time in cooldown lock file {cooldown_lock_file}, error - {e}')
+def _record_scale_action_time(action, replicas, settings):
+    scale_state.get_store(settings).record_scale_action(settings.get('app_name'), action, replicas)
     return     
     
-def scale_app_replicas(current_replica_count, current_cpu_utilization, settings, dry_run):
+def _refreshed_window(windows, key, direction, settings):
+    window = windows.get(key)
+    metric_ewma_alpha = settings.get('metric_ewma_alpha')
+    metric_window = settings.get(f'{direction}_metric_window')
+    metric_aggregate = settings.get(f'{direction}_metric_aggregate')
+    # Windows survive a config reload, they only start over when their size, weight or aggregate has changed.
+    if window is None or window.size != metric_window or window.ewma_alpha != metric_ewma_alpha or window.aggregate_name != metric_aggregate:
+        validate_aggregate(metric_aggregate)
+        window = MetricWindow(metric_window, metric_ewma_alpha, metric_aggregate)
+        windows[key] = window
+    return window
+
+def _metric_windows(settings):
+    windows = settings.get('metric_windows')
+    if windows is None:
+        windows = {}
+        settings['metric_windows'] = windows
+    for direction in ('scale_out', 'scale_in'):
+        _refreshed_window(windows, direction, direction, settings)
+    return windows
+
+def _aggregate_cpu_utilization(current_replica_count, current_cpu_utilization, settings):
+    # The windows hold the total load (cpu * replicas), so samples taken before a scale action stay
+    # comparable; the aggregate is spread back over the current replicas.
+    windows = _metric_windows(settings)
+    current_cpu_utilization_total = current_cpu_utilization * current_replica_count
+    aggregated = []
+    for direction in ('scale_out', 'scale_in'):
+        windows[direction].add(current_cpu_utilization_total)
+        aggregate = settings.get(f'{direction}_metric_aggregate')
+        if aggregate == 'last':
+            aggregated.append(current_cpu_utilization)
+        else:
+            aggregated.append(windows[direction].aggregate(aggregate) / current_replica_count)
+    return aggregated
+
+def _aggregate_policy_values(current_replica_count, policy_values, settings):
+    # Policy metrics go through a pair of windows each, with the same sizes and aggregates as cpu, so a single
+    # noisy reading of a metric does not scale out on its own. Scale-in goes by the higher of the two aggregates.
+    windows = _metric_windows(settings)
+    scale_out_policy_values, scale_in_policy_values = {}, {}
+    for name, value in policy_values.items():
+        if value is None:
+            scale_out_policy_values[name] = scale_in_policy_values[name] = None
+            continue
+        aggregated = []
+        for direction in ('scale_out', 'scale_in'):
+            window = _refreshed_window(windows, (direction, name), direction, settings)
+            window.add(value * current_replica_count)
+            aggregate = settings.get(f'{direction}_metric_aggregate')
+            aggregated.append(value if aggregate == 'last' else window.aggregate(aggregate) / current_replica_count)
+        scale_out_policy_values[name] = aggregated[0]
+        scale_in_policy_values[name] = max(aggregated)
+    return scale_out_policy_values, scale_in_policy_values
+
+def _forecaster(settings):
+    forecaster = settings.get('forecaster')
+    autoscale_engine_runs_every = settings.get('autoscale_engine_runs_every')
+    season_length = round(settings.get('forecast_season_seconds') / autoscale_engine_runs_every)
+    parameters = (settings.get('forecast_alpha'), settings.get('forecast_beta'), settings.get('forecast_gamma'), season_length)
+    # Like the metric windows, the forecaster only starts over after a config reload that changed its parameters.
+    if forecaster is None or (forecaster.alpha, forecaster.beta, forecaster.gamma, forecaster.season_length) != parameters:
+        forecaster = HoltWintersForecaster(*parameters)
+        settings['forecaster'] = forecaster
+    return forecaster
+
+def skip_forecast(settings, steps=1):
+    # The forecaster's seasonal slot is its step count, so every scheduled tick has to be one step: a tick without
+    # a reading, or a deadline an overrun missed, still moves it on.
+    if settings.get('predictive_scaling'):
+        forecaster = _forecaster(settings)
+        for _ in range(steps):
+            forecaster.skip()
+
+def _find_predicted_replicas_count(current_replica_count, current_cpu_utilization, settings, scheduled=True):
+    # Replicas the forecast load needs one start-up delay (predictive_horizon_seconds) ahead. Only scheduled ticks
+    # update the forecaster, an early tick for a pushed sample would put an extra step into the interval.
+    forecaster = _forecaster(settings)
+    if scheduled:
+        forecaster.update(current_cpu_utilization * current_replica_count)
+    if forecaster.count < settings.get('forecast_warmup_samples'):
+        return None
+    autoscale_engine_runs_every = settings.get('autoscale_engine_runs_every')
+    predictive_horizon_seconds = settings.get('predictive_horizon_seconds')
+    target_avg_cpu_utilization_for_scale_out = settings.get('target_avg_cpu_utilization_for_scale_out')
+    forecast_load = forecaster.forecast(max(math.ceil(predictive_horizon_seconds / autoscale_engine_runs_every), 1))
+    return math.ceil(max(forecast_load, 0) / target_avg_cpu_utilization_for_scale_out)
+
+def _observe_phase(phase, started, settings):
+    metrics.get_metrics(settings).phase_duration.observe((metrics.app_label(settings), phase), time.perf_counter() - started)
+
+def _record_sample(current_cpu_utilization, current_replica_count, desired_replicas_count, state, settings, action=None):
+    sample_feed.get_feed(settings).add(metrics.app_label(settings), current_cpu_utilization, current_replica_count, desired_replicas_count,
+                                       settings.get('target_avg_cpu_utilization_for_scale_out'), settings.get('target_avg_cpu_utilization_for_scale_in'), state)
+    history_store = history.get_history(settings)
+    if history_store is not None:
+        history_store.append(metrics.app_label(settings), current_cpu_utilization, current_replica_count, desired_replicas_count, action, state)
+
+def _find_smoothed_desired_replicas_count(current_replica_count, current_cpu_utilization, settings, scheduled=True):
+    # The desired count of a tick after the metric windows and the forecast, with the scale-out and scale-in
+    # readings it was found from.
+    log = settings.get('log')
+    scale_out_cpu_utilization, scale_in_cpu_utilization = _aggregate_cpu_utilization(current_replica_count, current_cpu_utilization, settings)
+    if scale_out_cpu_utilization != current_cpu_utilization or scale_in_cpu_utilization != current_cpu_utilization:
+        log.debug('Avg CPU: %s, Scale-out CPU (%s): %s, Scale-in CPU (%s): %s', current_cpu_utilization, settings.get('scale_out_metric_aggregate'), round(scale_out_cpu_utilization, 4), settings.get('scale_in_metric_aggregate'), round(scale_in_cpu_utilization, 4))
+    desired_replicas_count = _find_desired_replicas_count(current_replica_count, scale_out_cpu_utilization, settings)
+    if settings.get('predictive_scaling'):
+        # The reactive count stays the floor, the forecast can only ask for more.
+        predicted_replicas_count = _find_predicted_replicas_count(current_replica_count, current_cpu_utilization, settings, scheduled)
+        if predicted_replicas_count is not None and predicted_replicas_count > desired_replicas_count:
+            log.info('Forecast needs %s replicas in %s secs, reactive desired replicas: %s', predicted_replicas_count, settings.get('predictive_horizon_seconds'), desired_replicas_count)
+            desired_replicas_count = predicted_replicas_count
+    return desired_replicas_count, scale_out_cpu_utilization, scale_in_cpu_utilization
+
+def scale_app_replicas(current_replica_count, current_cpu_utilization, settings, dry_run, policy_values=None, scheduled=True):
+    started = time.perf_counter()
     log = settings.get('log')
-    cooldown_lock_file = settings.get('cooldown_lock_file')
     max_replicas = settings.get('max_replicas')
     min_replicas = settings.get('min_replicas')
-    desired_replicas_count = _find_desired_replicas_count(current_replica_count, current_cpu_utilization, settings)
-    log.info(f'Desired replicas: {desired_replicas_count}, Current replicas: {current_replica_count}, Min replicas: {min_replicas}, Max replicas: {max_replicas}')
-    need_to_cooldown = _need_to_cooldown(cooldown_lock_file=cooldown_lock_file, settings=settings)
+    desired_replicas_count, scale_out_cpu_utilization, scale_in_cpu_utilization = _find_smoothed_desired_replicas_count(current_replica_count, current_cpu_utilization, settings, scheduled)
+    scaler_metrics = metrics.get_metrics(settings)
+    scale_in_policy_values = None
+    if policy_values is not None and settings.get('scaling_policies'):
+        scale_out_policy_values, scale_in_policy_values = _aggregate_policy_values(current_replica_count, policy_values, settings)
+        policy_replicas_counts = {'cpu': desired_replicas_count, **_find_policy_replicas_counts(current_replica_count, scale_out_policy_values, settings)}
+        log.info('Desired replicas per metric: %s', policy_replicas_counts)
+        for name, replicas_count in policy_replicas_counts.items():
+            if replicas_count is not None:
+                scaler_metrics.metric_desired_replicas.set((metrics.app_label(settings), name), replicas_count)
+        # Scale-out follows the metric that needs the most replicas.
+        desired_replicas_count = max(replicas_count for replicas_count in policy_replicas_counts.values() if replicas_count is not None)
+    log.info('Desired replicas: %s, Current replicas: %s, Min replicas: %s, Max replicas: %s', desired_replicas_count, current_replica_count, min_replicas, max_replicas)
+    scaler_metrics.desired_replicas.set((metrics.app_label(settings),), desired_replicas_count)
+    need_to_cooldown = _need_to_cooldown(settings, _pending_action(desired_replicas_count, current_replica_count, settings), current_cpu_utilization)
     if need_to_cooldown:
         log.debug('No need to run auto-scaler.')
+        scaler_metrics.cooldown_skips.inc((metrics.app_label(settings),))
+        _observe_phase('decide', started, settings)
+        _record_sample(current_cpu_utilization, current_replica_count, desired_replicas_count, 'cooldown', settings)
         return current_replica_count
     log.debug('Auto-scaler is checking...')
-    limit_verified_desired_replicas_count = _verify_desired_replicas_count(desired_replicas_count, settings)
-    if limit_verified_desired_replicas_count > current_replica_count:
-        log.info(f'Scale-out is required by delta: +{limit_verified_desired_replicas_count-current_replica_count} ({current_replica_count}->{limit_verified_desired_replicas_count})')
+    target_replicas_count = _find_target_replicas_count(desired_replicas_count, current_replica_count, scale_out_cpu_utilization, settings, scale_in_cpu_utilization, scale_in_policy_values)
+    _observe_phase('decide', started, settings)
+    state = 'scale-out' if target_replicas_count > current_replica_count else 'scale-in' if target_replicas_count < current_replica_count else 'steady'
+    # The action is the replica update sent, none in dry-run mode.
+    _record_sample(current_cpu_utilization, current_replica_count, desired_replicas_count, state, settings, action=None if dry_run or state == 'steady' else state)
+    if target_replicas_count > current_replica_count:
+        log.info('Scale-out is required by delta: +%s (%s->%s)', target_replicas_count-current_replica_count, current_replica_count, target_replicas_count)
         if not dry_run:
-            _scale_out_replicas(limit_verified_desired_replicas_count, current_replica_count, settings)
-            return limit_verified_desired_replicas_count
-    elif limit_verified_desired_replicas_count < current_replica_count:
-        flapping_limit_verified_desired_replicas_count = _verify_scale_in_activity(limit_verified_desired_replicas_count, current_replica_count, current_cpu_utilization, settings)
-        if flapping_limit_verified_desired_replicas_count:
-            log.info(f'Scale-in is required by delta: {flapping_limit_verified_desired_replicas_count - current_replica_count} ({current_replica_count}->{flapping_limit_verified_desired_replicas_count})')
-            if not dry_run:
-                _scale_in_replicas(flapping_limit_verified_desired_replicas_count, current_replica_count, settings)
-                return flapping_limit_verified_desired_replicas_count 
+            _scale_out_replicas(target_replicas_count, current_replica_count, settings)
+            return target_replicas_count
+    elif target_replicas_count < current_replica_count:
+        log.info('Scale-in is required by delta: %s (%s->%s)', target_replicas_count - current_replica_count, current_replica_count, target_replicas_count)
+        if not dry_run:
+            _scale_in_replicas(target_replicas_count, current_replica_count, settings)
+            return target_replicas_count
     else:
         autoscale_engine_runs_every = settings.get('autoscale_engine_runs_every')
-        log.debug(f'No scale-out/scale-in, Will re-evaluate after {autoscale_engine_runs_every} secs.')
+        log.debug('No scale-out/scale-in, Will re-evaluate after %s secs.', autoscale_engine_runs_every)
     return current_replica_count
+
+def _find_target_replicas_count(desired_replicas_count, current_replica_count, current_cpu_utilization, settings, scale_in_cpu_utilization=None, policy_values=None):
+    limit_verified_desired_replicas_count = _verify_desired_replicas_count(desired_replicas_count, settings, current_replica_count)
+    if limit_verified_desired_replicas_count < current_replica_count:
+        if scale_in_cpu_utilization is not None and scale_in_cpu_utilization != current_cpu_utilization:
+            # Scale-in needs both windows to agree, the higher of the two readings decides how far.
+            current_cpu_utilization = max(current_cpu_utilization, scale_in_cpu_utilization)
+            desired_replicas_count = max(limit_verified_desired_replicas_count, _find_desired_replicas_count(current_replica_count, scale_in_cpu_utilization, settings))
+            limit_verified_desired_replicas_count = _verify_desired_replicas_count(desired_replicas_count, settings, current_replica_count)
+            if limit_verified_desired_replicas_count >= current_replica_count:
+                return current_replica_count
+        flapping_limit_verified_desired_replicas_count = _verify_scale_in_activity(limit_verified_desired_replicas_count, current_replica_count, current_cpu_utilization, settings)
+        if flapping_limit_verified_desired_replicas_count and policy_values is not None and settings.get('scaling_policies'):
+            flapping_limit_verified_desired_replicas_count = _verify_policies_scale_in(flapping_limit_verified_desired_replicas_count, current_replica_count, policy_values, settings)
+        if flapping_limit_verified_desired_replicas_count:
+            return flapping_limit_verified_desired_replicas_count
+        return current_replica_count
+    return limit_verified_desired_replicas_count
+
+def decide_replicas(current_replica_count, current_cpu_utilization, settings, scale_in_cpu_utilization=None, policy_values=None):
+    # Pure scaling decision (no cooldown, no API calls), shared by the control loop and the simulator.
+    desired_replicas_count = _find_desired_replicas_count(current_replica_count, current_cpu_utilization, settings)
+    if policy_values is not None:
+        desired_replicas_count = max([desired_replicas_count] + [replicas_count for replicas_count in _find_policy_replicas_counts(current_replica_count, policy_values, settings).values() if replicas_count is not None])
+    return _find_target_replicas_count(desired_replicas_count, current_replica_count, current_cpu_utilization, settings, scale_in_cpu_utilization, policy_values)
+
+def decide_tick_replicas(current_replica_count, current_cpu_utilization, settings):
+    # decide_replicas behind the metric windows and the forecast of settings, as a scheduled tick of the control
+    # loop decides; the simulator replays a trace through it.
+    desired_replicas_count, scale_out_cpu_utilization, scale_in_cpu_utilization = _find_smoothed_desired_replicas_count(current_replica_count, current_cpu_utilization, settings)
+    return _find_target_replicas_count(desired_replicas_count, current_replica_count, scale_out_cpu_utilization, settings, scale_in_cpu_utilization)
     
+def _update_replicas(action, desired_replicas_count, settings, settle_seconds=0):
+    log = settings.get('log')
+    def send(replicas):
+        started = time.perf_counter()
+        done = scaleit_client.update_app_replicas(replicas=replicas, settings=settings)
+        _observe_phase('update_replicas', started, settings)
+        if done:
+            _record_scale_action_time(action=action, replicas=replicas, settings=settings)
+            metrics.get_metrics(settings).scale_actions.inc((metrics.app_label(settings), action))
+        return done
+    status = actuator.get_actuator(settings).submit(desired_replicas_count, send, settle_seconds)
+    if status in (actuator.COALESCED, actuator.QUEUED):
+        log.info('Update to %s replicas %s, an update to the same or an older target is still pending.', desired_replicas_count, status)
+        metrics.get_metrics(settings).coalesced_updates.inc((metrics.app_label(settings),))
+    return status
+
 def _scale_out_replicas(desired_replicas_count, current_replica_count, settings):
     log = settings.get('log')
-    cooldown_lock_file = settings.get('cooldown_lock_file')
-    log.info(f'Scaling-out by delta: +{desired_replicas_count - current_replica_count} ({current_replica_count}->{desired_replicas_count})')
-    done = scaleit_client.update_app_replicas(replicas=desired_replicas_count, settings=settings)
-    if done:
-        _record_scale_action_time(cooldown_lock_file=cooldown_lock_file, settings=settings)
+    log.info('Scaling-out by delta: +%s (%s->%s)', desired_replicas_count - current_replica_count, current_replica_count, desired_replicas_count)
+    # New replicas need their start-up time before the readings mean anything again.
+    _update_replicas('scale-out', desired_replicas_count, settings, settle_seconds=settings.get('replica_startup_seconds'))
     return 
     
 def _scale_in_replicas(desired_replicas_count, current_replica_count, settings):
     log = settings.get('log')
-    cooldown_lock_file = settings.get('cooldown_lock_file')
-    log.info(f'Scaling-in by delta: {desired_replicas_count - current_replica_count} ({current_replica_count}->{desired_replicas_count})')
-    done = scaleit_client.update_app_replicas(replicas=desired_replicas_count, settings=settings)
-    if done:
-        _record_scale_action_time(cooldown_lock_file=cooldown_lock_file, settings=settings)
+    log.info('Scaling-in by delta: %s (%s->%s)', desired_replicas_count - current_replica_count, current_replica_count, desired_replicas_count)
+    _update_replicas('scale-in', desired_replicas_count, settings)
     return 
     
+def _scale_in_can_flap(current_cpu_utilization_total, replicas_count, target_avg_cpu_utilization_for_scale_out):
+    if not replicas_count:
+        return current_cpu_utilization_total > 0
+    return round(current_cpu_utilization_total / replicas_count, 2) >= target_avg_cpu_utilization_for_scale_out
+
+def _flap_threshold(target_avg_cpu_utilization_for_scale_out):
+    # The projected cpu is compared rounded to 2 decimals, so it reaches the target once it reaches the smallest
+    # 2-decimal value at or above the target (0.60 for a target of 0.5922), less the half cent rounding adds.
+    return math.ceil(target_avg_cpu_utilization_for_scale_out * 100 - 1e-9) / 100 - 0.005
+
+def _lowest_flap_safe_bound(current_cpu_utilization_total, target_avg_cpu_utilization_for_scale_out):
+    # Below total / threshold replicas the projected cpu rounds to the target or above, so every replica count
+    # up to one less than that is known to flap. The exact check only runs from there on.
+    threshold = _flap_threshold(target_avg_cpu_utilization_for_scale_out)
+    if threshold <= 0:
+        return 0
+    return math.floor(current_cpu_utilization_total / threshold) - 1
+
+def flap_safe_scale_in_count(desired_replicas_count, current_replica_count, current_cpu_utilization, target_avg_cpu_utilization_for_scale_out):
+    # Smallest replica count >= desired_replicas_count that keeps the projected avg cpu below the scale-out
+    # target, or None when no scale-in is safe. Same result as walking up one replica at a time.
+    current_cpu_utilization_total = current_cpu_utilization * current_replica_count
+    replicas_count = max(desired_replicas_count, _lowest_flap_safe_bound(current_cpu_utilization_total, target_avg_cpu_utilization_for_scale_out))
+    while replicas_count < current_replica_count and _scale_in_can_flap(current_cpu_utilization_total, replicas_count, target_avg_cpu_utilization_for_scale_out):
+        replicas_count += 1
+    if replicas_count < current_replica_count:
+        return replicas_count
+    return None
+
 def _verify_scale_in_activity(desired_replicas_count, current_replica_count, current_cpu_utilization, settings):
     log = settings.get('log')
     log.info('Checking if scale-in can potentially cause flapping...')
     target_avg_cpu_utilization_for_scale_out = settings.get('target_avg_cpu_utilization_for_scale_out')
     target_avg_cpu_utilization_for_scale_in = settings.get('target_avg_cpu_utilization_for_scale_in')
-    current_cpu_utilization_total = current_cpu_utilization * current_replica_count
-    while desired_replicas_count < current_replica_count:
-        effective_cpu_utilization_after_scale_in = current_cpu_utilization_total / desired_replicas_count
-        effective_cpu_utilization_after_scale_in = round(effective_cpu_utilization_after_scale_in, 2)
-        log.debug(f'Effective Avg CPU after Scale-in: {effective_cpu_utilization_after_scale_in} (CPU: {target_avg_cpu_utilization_for_scale_in}-{target_avg_cpu_utilization_for_scale_out}), Purposed desired replicas: {desired_replicas_count}')
-        if effective_cpu_utilization_after_scale_in >= target_avg_cpu_utilization_for_scale_out:
-            log.debug(f'Scaling-in to {desired_replicas_count} can make Avg CPU: {effective_cpu_utilization_after_scale_in} (>= {target_avg_cpu_utilization_for_scale_out})')
-            log.debug(f'Scaling-in to {desired_replicas_count} is ignored by the auto-scaler to avoid flapping.')
-            desired_replicas_count = desired_replicas_count + 1
-            log.debug(f'Re-calculating effective CPU after scale-in with replicas: {desired_replicas_count} (+1) ({desired_replicas_count -1}->{desired_replicas_count})')
+    verified_desired_replicas_count = flap_safe_scale_in_count(desired_replicas_count, current_replica_count, current_cpu_utilization, target_avg_cpu_utilization_for_scale_out)
+    if verified_desired_replicas_count is None or verified_desired_replicas_count > desired_replicas_count:
+        metrics.get_metrics(settings).flap_avoided_scale_ins.inc((metrics.app_label(settings),))
+    if verified_desired_replicas_count is None:
+        autoscale_engine_runs_every = settings.get('autoscale_engine_runs_every')
+        log.info('No scale-in to avoid flapping, Will re-evaluate after %s secs.', autoscale_engine_runs_every)
+        return None
+    if verified_desired_replicas_count > desired_replicas_count:
+        flapping_replicas_counts = desired_replicas_count if verified_desired_replicas_count - 1 == desired_replicas_count else f'{desired_replicas_count}-{verified_desired_replicas_count - 1}'
+        log.debug('Scaling-in to %s can make Avg CPU >= %s, ignored by the auto-scaler to avoid flapping.', flapping_replicas_counts, target_avg_cpu_utilization_for_scale_out)
+    effective_cpu_utilization_after_scale_in = round(current_cpu_utilization * current_replica_count / verified_desired_replicas_count, 2) if verified_desired_replicas_count else 0.0
+    log.info('Effective Avg CPU after Scale-in: %s (CPU: %s-%s), Verified desired replicas: %s', effective_cpu_utilization_after_scale_in, target_avg_cpu_utilization_for_scale_in, target_avg_cpu_utilization_for_scale_out, verified_desired_replicas_count)
+    return verified_desired_replicas_count
+
+def _verify_policies_scale_in(desired_replicas_count, current_replica_count, policy_values, settings):
+    # Every policy metric has to agree with a scale-in: it was read, it is at or below its scale-in target, and
+    # it stays below its scale-out target after the scale-in. The most cautious metric decides how far.
+    log = settings.get('log')
+    verified_desired_replicas_count = desired_replicas_count
+    for policy in settings.get('scaling_policies'):
+        name = policy['name']
+        value = policy_values.get(name)
+        if value is None or value > policy['scale_in_target']:
+            log.info('No scale-in, metric %s (%s) is not at or below its scale-in target %s.', name, value, policy['scale_in_target'])
+            return None
+        verified_desired_replicas_count = flap_safe_scale_in_count(verified_desired_replicas_count, current_replica_count, value, policy['scale_out_target'])
+        if verified_desired_replicas_count is None:
+            log.info('No scale-in to avoid flapping, metric %s (%s) would reach its scale-out target %s.', name, value, policy['scale_out_target'])
+            metrics.get_metrics(settings).flap_avoided_scale_ins.inc((metrics.app_label(settings),))
+            return None
+    if verified_desired_replicas_count > desired_replicas_count:
+        log.info('Scale-in limited to %s replicas by the policy metrics.', verified_desired_replicas_count)
+    return verified_desired_replicas_count
+
+def _round_batch(values):
+    # np.round scales by 100 first, which can tip a value sitting on a .xx5 tie the other way than round().
+    # Those few values are rounded with round() so the batch matches the scalar path exactly.
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    near_tie = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    for n in near_tie:
+        rounded[n] = round(float(values[n]), 2)
+    return rounded
+
+def decide_replicas_batch(current_replica_counts, current_cpu_utilizations, min_replicas, max_replicas, target_avg_cpu_utilization_for_scale_out):
+    # Vectorized decide_replicas for many apps (or many parameter combinations) at once, every argument
+    # is an array or a scalar broadcast to the others. Returns the target replica count per element.
+    values = [np.asarray(value, dtype=float) for value in (current_replica_counts, current_cpu_utilizations, min_replicas, max_replicas, target_avg_cpu_utilization_for_scale_out)]
+    if len({value.shape for value in values}) > 1:
+        values = np.broadcast_arrays(*values)
+    current, cpu, min_replicas, max_replicas, target = values
+    limit_verified = np.minimum(np.maximum(np.ceil(current * (cpu / target)), min_replicas), max_replicas)
+    target_replicas = limit_verified.copy()
+    scale_in = np.flatnonzero(limit_verified < current)
+    if len(scale_in):
+        total = cpu[scale_in] * current[scale_in]
+        scale_in_target = target[scale_in]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            threshold = np.ceil(scale_in_target * 100 - 1e-9) / 100 - 0.005
+            bound = np.where(threshold > 0, np.floor(total / threshold) - 1, 0)
+            replicas = np.maximum(limit_verified[scale_in], bound)
+            pending = np.arange(len(scale_in))
+            while len(pending):
+                candidates = replicas[pending]
+                projected = _round_batch(total[pending] / candidates)
+                can_flap = np.where(candidates > 0, projected >= scale_in_target[pending], total[pending] > 0)
+                pending = pending[(candidates < current[scale_in][pending]) & can_flap]
+                replicas[pending] += 1
+        # No safe scale-in (or a scale-in to 0, as in the scalar path) keeps the current count.
+        target_replicas[scale_in] = np.where((replicas < current[scale_in]) & (replicas > 0), replicas, current[scale_in])
+    return target_replicas.astype(int)
+
+def _converging(current_replica_count, settings):
+    # Checks the reading against the last acknowledged update, a reading taken while replicas are still on their
+    # way to the target says little about the load and is not decided on.
+    log = settings.get('log')
+    app_actuator = actuator.get_actuator(settings)
+    scaler_metrics = metrics.get_metrics(settings)
+    labels = (metrics.app_label(settings),)
+    pending_target = app_actuator.pending_target
+    state = app_actuator.check(current_replica_count, settings.get('actuation_converge_timeout_seconds'))
+    if state == actuator.CONVERGING:
+        log.info('Replicas converging to %s (now %s, for %s secs), not re-deciding.', pending_target, current_replica_count, round(app_actuator.converging_for(), 1))
+        scaler_metrics.converging_ticks.inc(labels)
+        return True
+    if state == actuator.CONVERGED:
+        log.debug('Replicas reached the target %s.', current_replica_count)
+        scaler_metrics.convergence_duration.observe(labels, app_actuator.converging_for())
+    elif state == actuator.TIMED_OUT:
+        log.warning('Replicas did not reach the target %s within %s secs (now %s), deciding again.', pending_target, settings.get('actuation_converge_timeout_seconds'), current_replica_count)
+        scaler_metrics.convergence_timeouts.inc(labels)
+    return False
+
+def autoscale_tick(settings, dry_run=False, scheduled=True):
+    # scheduled is False for an early tick run for a pushed sample between two scheduled ones.
+    log = settings.get('log')
+    scaler_metrics = metrics.get_metrics(settings)
+    labels = (metrics.app_label(settings),)
+    started = time.perf_counter()
+    # API calls and retry waits of this tick must be done by the deadline, a degraded API can not stall the loop.
+    settings['tick_deadline'] = time.monotonic() + (settings.get('api_tick_budget_seconds') or settings.get('autoscale_engine_runs_every'))
+    try:
+        # A fresh pushed sample saves the poll, apps that have gone quiet are polled as before. Pushed samples only
+        # carry CPU, apps with scaling policies always read all their metrics from the status API.
+        pushed_sample = None if settings.get('scaling_policies') else ingest.fresh_sample(settings)
+        policy_values = None
+        if pushed_sample is not None:
+            current_cpu_utilization, current_replica_count = pushed_sample
+            log.debug('Using pushed sample, Avg CPU: %s, Replicas: %s', current_cpu_utilization, current_replica_count)
+        elif settings.get('scaling_policies'):
+            current_cpu_utilization, current_replica_count, policy_values = scaleit_client.find_current_stats(settings=settings)
         else:
-            log.info(f'Effective Avg CPU after Scale-in: {effective_cpu_utilization_after_scale_in} (CPU: {target_avg_cpu_utilization_for_scale_in}-{target_avg_cpu_utilization_for_scale_out}), Verified desired replicas: {desired_replicas_count}')
-            return desired_replicas_count
-    autoscale_engine_runs_every = settings.get('autoscale_engine_runs_every')
-    log.info(f'No scale-in to avoid flapping, Will re-evaluate after {autoscale_engine_runs_every} secs.')
-    return None
+            current_cpu_utilization, current_replica_count = scaleit_client.find_current_cpu_stats(settings=settings)
+        _observe_phase('read_metrics', started, settings)
+        if current_cpu_utilization and current_replica_count:
+            scaler_metrics.current_replicas.set(labels, current_replica_count)
+            if _converging(current_replica_count, settings):
+                if scheduled and settings.get('predictive_scaling'):
+                    # Not decided on, but the load still belongs in the forecast.
+                    _forecaster(settings).update(current_cpu_utilization * current_replica_count)
+                _record_sample(current_cpu_utilization, current_replica_count, actuator.get_actuator(settings).pending_target, 'converging', settings)
+                return current_replica_count
+            return scale_app_replicas(current_replica_count=current_replica_count,
+                                      current_cpu_utilization=current_cpu_utilization, dry_run=dry_run,
+                                      settings=settings, policy_values=policy_values, scheduled=scheduled)
+        log.warning('Auto Scaler execution skipped, check stats API return values.')
+        scaler_metrics.skipped_ticks.inc(labels)
+        if scheduled:
+            skip_forecast(settings)
+        return None
+    finally:
+        settings.pop('tick_deadline', None)
+        scaler_metrics.tick_duration.observe(labels, time.perf_counter() - started)
+        scaler_metrics.last_tick.set(labels, time.time())
@@ -0,0 +1,108 @@
+import sys
+import time
+import pathlib
+import threading
+from collections import deque
+
+# Local imports
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+import metrics
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    # Closed: calls go through and their outcomes fill a window of the last window_size calls. Once at least
+    # min_calls are in the window and the failure rate reaches failure_rate, the breaker opens and every call
+    # fails fast for open_seconds. Then it is half-open: one trial call goes through, success closes it again,
+    # failure opens it for another open_seconds.
+    def __init__(self, failure_rate=0.5, window_size=10, min_calls=5, open_seconds=30, on_change=None):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.outcomes = deque(maxlen=window_size)
+        self.failures = 0
+        self.state = CLOSED
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def allow(self):
+        with self.lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    return False
+                self._change(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self.trial_in_flight:
+                    return False
+                self.trial_in_flight = True
+            return True
+
+    def record(self, success):
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.trial_in_flight = False
+                if success:
+                    self.outcomes.clear()
+                    self.failures = 0
+                    self._change(CLOSED)
+                else:
+                    self._open()
+                return
+            if len(self.outcomes) == self.outcomes.maxlen:
+                self.failures -= not self.outcomes[0]
+            self.outcomes.append(success)
+            self.failures += not success
+            if self.state == CLOSED and len(self.outcomes) >= self.min_calls and self.failures / len(self.outcomes) >= self.failure_rate:
+                self._open()
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._change(OPEN)
+
+    def _change(self, state):
+        if state != self.state:
+            self.state = state
+            if self.on_change:
+                self.on_change(self, state)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'calls': len(self.outcomes),
+                'failure_rate': round(self.failures / len(self.outcomes), 3) if self.outcomes else 0.0,
+                'open_for_seconds': round(max(self.open_seconds - (time.monotonic() - self.opened_at), 0), 3) if self.state == OPEN else 0,
+            }
+
+
+def get_breaker(settings, url):
+    # One breaker per endpoint URL, shared by every app that calls it.
+    breakers = settings.get('circuit_breakers')
+    if breakers is None:
+        breakers = {}
+        settings['circuit_breakers'] = breakers
+    breaker = breakers.get(url)
+    params = (settings.get('circuit_breaker_failure_rate'), settings.get('circuit_breaker_window'),
+              settings.get('circuit_breaker_min_calls'), settings.get('circuit_breaker_open_seconds'))
+    # Breakers survive a config reload, they only start over closed when one of their settings has changed.
+    if breaker is None or (breaker.failure_rate, breaker.outcomes.maxlen, breaker.min_calls, breaker.open_seconds) != params:
+        log = settings.get('log')
+        breaker_state = metrics.get_metrics(settings).circuit_breaker_state
+        def on_change(breaker, state):
+            log.warning('Circuit breaker for %s is %s', url, state)
+            breaker_state.set((url,), STATE_VALUES[state])
+        failure_rate, window_size, min_calls, open_seconds = params
+        breaker = CircuitBreaker(failure_rate=failure_rate, window_size=window_size, min_calls=min_calls, open_seconds=open_seconds, on_change=on_change)
+        breaker_state.set((url,), STATE_VALUES[CLOSED])
+        breakers[url] = breaker
+    return breaker
+
+def breaker_states(settings):
+    return {url: breaker.snapshot() for url, breaker in (settings.get('circuit_breakers') or {}).items()}
@@ -0,0 +1,165 @@
+import sys
+import json
+import time
+import asyncio
+import threading
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Local imports
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+import app_autoscale
+import scaleit_client
+import scale_state
+import metrics
+import ingest
+import sample_feed
+import history
+import shard
+import scheduler
+from logger import get_logger, get_app_logger
+from settings import write_effective_config
+
+
+# Settings of the fleet as a whole, an app definition can not override them.
+FLEET_WIDE_SETTINGS = ('cooldown_lock_file', 'fleet_max_in_flight_requests', 'fleet_max_threads', 'history_dir')
+
+
+def _app_settings(app_definition, settings, session, store, scaler_metrics):
+    app_name = app_definition.get('app_name')
+    app_settings = dict(settings)
+    app_settings.update(app_definition)
+    app_settings['app_definition'] = app_definition
+    if settings.get('config') is not None:
+        # Validates the per-app overrides, and is what a config reload is merged with.
+        app_settings['config'] = settings['config'].merged(app_definition)
+    # Cooldown state is kept per app_name in one store shared by the whole fleet.
+    app_settings['scale_state'] = store
+    app_settings['metrics'] = scaler_metrics
+    app_settings['log'] = get_app_logger(settings.get('log'), app_name)
+    app_settings['scaleit_client'] = scaleit_client.ScaleItClient(app_settings, session=session)
+    return app_settings
+
+def load_apps(apps_file, settings):
+    with open(apps_file) as fh:
+        app_definitions = json.load(fh)
+    return build_apps(app_definitions, settings)
+
+def build_apps(app_definitions, settings):
+    apps = []
+    # One pooled session for the whole fleet, connections to a shared API host are reused across apps.
+    session = scaleit_client.make_session(settings, pool_connections=max(len(app_definitions), 1),
+                                          pool_maxsize=settings.get('fleet_max_in_flight_requests'))
+    store = scale_state.get_store(settings)
+    scaler_metrics = metrics.get_metrics(settings)
+    # Copied into every app's settings, so apps calling the same endpoint URL share its circuit breaker,
+    # every app's samples go to the one dashboard feed and history store, and all API calls of the fleet
+    # share the fleet_max_in_flight_requests slots.
+    settings.setdefault('circuit_breakers', {})
+    settings.setdefault('request_slots', threading.BoundedSemaphore(settings.get('fleet_max_in_flight_requests')))
+    sample_feed.get_feed(settings)
+    history.get_history(settings)
+    seen_app_names = set()
+    for app_definition in app_definitions:
+        app_name = app_definition.get('app_name')
+        if not app_name:
+            raise ValueError(f'Fleet app definition without app_name: {app_definition}')
+        if app_name in seen_app_names:
+            raise ValueError(f'Fleet app {app_name} is defined more than once.')
+        fleet_wide_settings = sorted(set(app_definition) & set(FLEET_WIDE_SETTINGS))
+        if fleet_wide_settings:
+            raise ValueError(f'Fleet app {app_name} overrides {fleet_wide_settings}, these can only be set for the whole fleet.')
+        seen_app_names.add(app_name)
+        apps.append(_app_settings(app_definition, settings, session, store, scaler_metrics))
+    return apps
+
+def reload_apps(apps, settings):
+    # Swaps the new config (in settings) in for every app, keeping each app's live state (cooldown, windows, pooled session).
+    log = settings.get('log')
+    reloaded_apps = []
+    for app_settings in apps:
+        try:
+            app_config = settings['config'].merged(app_settings['app_definition'])
+        except ValueError as e:
+            log.error(f'Keeping the current configuration of app {app_settings.get("app_name")}, error - {e}')
+            reloaded_apps.append(app_settings)
+            continue
+        reloaded_apps.append(app_config.as_settings(app_settings))
+    return reloaded_apps
+
+def _tick_app(app_settings, dry_run, scheduled=True):
+    try:
+        return app_autoscale.autoscale_tick(settings=app_settings, dry_run=dry_run, scheduled=scheduled)
+    except Exception as e:
+        # One broken app must never take the rest of the fleet down with it.
+        app_settings.get('log').error(f'Auto Scaler tick failed, error - {e}')
+        return None
+
+async def run_fleet_tick(apps, executor, settings, dry_run=False, phased=False, scheduled=True):
+    log = settings.get('log')
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    async def tick(app_settings):
+        if phased:
+            # Every app starts at its own stable offset into the round (tick_jitter_fraction of the interval).
+            interval = app_settings.get('autoscale_engine_runs_every')
+            offset = scheduler.phase_offset(app_settings.get('app_name'), interval, app_settings.get('tick_jitter_fraction'))
+            await asyncio.sleep(max(started + offset - time.monotonic(), 0))
+        return await loop.run_in_executor(executor, _tick_app, app_settings, dry_run, scheduled)
+    # Every app ticks on its own executor thread, the HTTP calls themselves are capped by the request slots.
+    results = await asyncio.gather(*[tick(app_settings) for app_settings in apps])
+    skipped = sum(1 for result in results if result is None)
+    log.info(f'Fleet tick finished for {len(apps)} apps in {round(time.monotonic() - started, 2)} secs, skipped: {skipped}')
+    return {app_settings.get('app_name'): result for app_settings, result in zip(apps, results)}
+
+async def _wait_for_next_tick(apps, executor, settings, tick_scheduler, dry_run):
+    inbox = settings.get('sample_inbox')
+    if inbox is None:
+        await asyncio.sleep(tick_scheduler.remaining())
+        return
+    # Apps whose pushed sample crossed a target are ticked right away, the fleet tick still runs on schedule.
+    loop = asyncio.get_running_loop()
+    apps_by_name = {app_settings.get('app_name'): app_settings for app_settings in apps}
+    while True:
+        remaining = tick_scheduler.remaining()
+        if remaining <= 0:
+            return
+        # Waits in short slices, so shutting the loop down never has to wait for a whole interval.
+        triggered = await loop.run_in_executor(None, ingest.wait_for_triggers, inbox, apps_by_name, min(remaining, 1))
+        if triggered:
+            await run_fleet_tick([apps_by_name[app_name] for app_name in triggered], executor, settings, dry_run=dry_run, scheduled=False)
+
+async def run_fleet(apps, settings, dry_run=False, config_watcher=None):
+    log = settings.get('log')
+    fleet_max_in_flight_requests = settings.get('fleet_max_in_flight_requests')
+    fleet_threads = min(max(len(apps), 1), settings.get('fleet_max_threads'))
+    log.info(f'Fleet mode started for {len(apps)} apps, threads: {fleet_threads}, max in-flight requests: {fleet_max_in_flight_requests}')
+    # Fleet rounds are due at fixed deadlines on the monotonic clock, a round that overruns skips the deadlines it missed.
+    tick_scheduler = scheduler.TickScheduler(settings.get('autoscale_engine_runs_every'))
+    # Every app tick runs on a thread of its own, blocking on its API calls and retry sleeps. Up to fleet_max_threads
+    # apps tick at the same time, a round of more apps than that takes longer than its slowest app.
+    with ThreadPoolExecutor(max_workers=fleet_threads, thread_name_prefix='fleet') as executor:
+        while True:
+            # In sharded mode only the apps this worker holds the lease of, re-balanced before every tick.
+            owned_app_names = {app_settings.get('app_name') for app_settings in shard.claim_apps(apps, settings)}
+            owned_apps = [app_settings for app_settings in apps if app_settings.get('app_name') in owned_app_names]
+            await run_fleet_tick(owned_apps, executor, settings, dry_run=dry_run, phased=True)
+            config = config_watcher.poll(log) if config_watcher else None
+            if config is not None:
+                settings = config.as_settings(settings)
+                write_effective_config(config)
+                # The app loggers wrap the fleet logger, so its new level and outputs apply to every app.
+                get_logger(logger_name=log.name, settings=settings)
+                apps = reload_apps(apps, settings)
+                owned_apps = [app_settings for app_settings in apps if app_settings.get('app_name') in owned_app_names]
+            missed = tick_scheduler.advance(settings.get('autoscale_engine_runs_every'))
+            if missed:
+                log.warning(f'Fleet tick overran its interval of {tick_scheduler.interval} seconds, skipping {missed} missed tick(s).')
+                scaler_metrics = metrics.get_metrics(settings)
+                scaler_metrics.tick_overruns.inc(('fleet',))
+                scaler_metrics.missed_tick_deadlines.inc(('fleet',), missed)
+                for app_settings in owned_apps:
+                    app_autoscale.skip_forecast(app_settings, missed)
+            log.info(f'Next fleet check will be after {round(tick_scheduler.remaining(), 2)} seconds.')
+            log.info('_____________________________________________________________________________\n\n')
+            await _wait_for_next_tick(owned_apps, executor, settings, tick_scheduler, dry_run)
@@ -0,0 +1,42 @@
+from array import array
+
+
+class HoltWintersForecaster:
+    # Additive Holt-Winters, or plain Holt (level + trend) when season_length is 0. Every update is O(1)
+    # and the only state is the level, the trend and one seasonal slot per sample of a season.
+    def __init__(self, alpha=0.5, beta=0.1, gamma=0.1, season_length=0):
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.season_length = season_length
+        self.seasonals = array('d', bytes(8 * season_length))
+        self.position = 0
+        self.level = None
+        self.trend = 0.0
+        self.count = 0
+
+    def update(self, value):
+        self.count += 1
+        seasonal = self.seasonals[self.position] if self.season_length else 0.0
+        if self.level is None:
+            self.level = value - seasonal
+        else:
+            last_level = self.level
+            self.level = self.alpha * (value - seasonal) + (1 - self.alpha) * (self.level + self.trend)
+            self.trend = self.beta * (self.level - last_level) + (1 - self.beta) * self.trend
+        if self.season_length:
+            self.seasonals[self.position] = self.gamma * (value - self.level) + (1 - self.gamma) * seasonal
+            self.position = (self.position + 1) % self.season_length
+
+    def skip(self):
+        # A step without a sample: the level follows its trend and the season moves on to its next slot.
+        if self.level is not None:
+            self.level += self.trend
+        if self.season_length:
+            self.position = (self.position + 1) % self.season_length
+
+    def forecast(self, steps):
+        if self.level is None:
+            return None
+        seasonal = self.seasonals[(self.position + steps - 1) % self.season_length] if self.season_length else 0.0
+        return self.level + steps * self.trend + seasonal
@@ -0,0 +1,243 @@
+import os
+import csv
+import mmap
+import time
+import struct
+import threading
+import numpy as np
+from urllib.parse import quote
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+MAGIC = b'ASH1'
+HEADER = struct.Struct('<4sHH8x')
+RECORD = struct.Struct('<dfiiBB2x')
+# The same layout as RECORD, for reading a whole file (or a slice of it) at once.
+RECORD_DTYPE = np.dtype([('time', '<f8'), ('cpu', '<f4'), ('replicas', '<i4'), ('desired', '<i4'), ('action', 'u1'), ('reason', 'u1'), ('_', 'V2')])
+ACTIONS = (None, 'scale-out', 'scale-in')
+REASONS = ('steady', 'cooldown', 'converging', 'scale-out', 'scale-in')
+_ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+_REASON_CODES = {reason: code for code, reason in enumerate(REASONS)}
+ROLLUP_FIELDS = ('time', 'samples', 'cpu_mean', 'cpu_max', 'replicas_min', 'replicas_max', 'desired_max', 'scale_outs', 'scale_ins')
+
+
+def read_records(history_file, start=None, end=None):
+    # Records with start <= time < end as a structured array. The file is memory-mapped and the range is found
+    # by binary search on the (sorted) timestamps, so only the pages of the range itself are read.
+    with open(history_file, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        count = (size - HEADER.size) // RECORD.size if size >= HEADER.size else 0
+        if count <= 0:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            magic, _, record_size = HEADER.unpack_from(mapped)
+            if magic != MAGIC or record_size != RECORD.size:
+                raise ValueError(f'{history_file} is not an auto-scaler history file.')
+            records = np.frombuffer(mapped, dtype=RECORD_DTYPE, count=count, offset=HEADER.size)
+            first = 0 if start is None else np.searchsorted(records['time'], start, side='left')
+            last = count if end is None else np.searchsorted(records['time'], end, side='left')
+            selected = records[first:last].copy()
+            del records # The mmap can only be closed once no array refers to it.
+            return selected
+
+def rollup(records, step_seconds):
+    # Downsamples records into step_seconds buckets aligned to the epoch, empty buckets are left out.
+    if not len(records):
+        return {name: np.empty(0) for name in ROLLUP_FIELDS}
+    buckets = np.floor(records['time'] / step_seconds)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    samples = np.diff(np.append(starts, len(records)))
+    cpu = records['cpu'].astype(float)
+    return {
+        'time': buckets[starts] * step_seconds,
+        'samples': samples,
+        'cpu_mean': np.add.reduceat(cpu, starts) / samples,
+        'cpu_max': np.maximum.reduceat(cpu, starts),
+        'replicas_min': np.minimum.reduceat(records['replicas'], starts),
+        'replicas_max': np.maximum.reduceat(records['replicas'], starts),
+        'desired_max': np.maximum.reduceat(records['desired'], starts),
+        'scale_outs': np.add.reduceat(records['action'] == _ACTION_CODES['scale-out'], starts),
+        'scale_ins': np.add.reduceat(records['action'] == _ACTION_CODES['scale-in'], starts),
+    }
+
+def export_csv(records, csv_file):
+    # A trace simulate.py can replay, with the decisions as extra columns.
+    with open(csv_file, 'w', newline='') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(['timestamp', 'cpu', 'replicas', 'desired', 'action', 'reason'])
+        for record in records:
+            writer.writerow([repr(float(record['time'])), round(float(record['cpu']), 6), int(record['replicas']), int(record['desired']),
+                             ACTIONS[record['action']] or '', REASONS[record['reason']]])
+
+
+class _AppHistory:
+    # The open file of one app. Appends are a single unbuffered write of one fixed-width record, under an flock
+    # on <file>.flock that every process writing or compacting the file takes.
+    def __init__(self, history_file):
+        self.history_file = history_file
+        self.lock = threading.Lock()
+        self.fd = None
+        self.lock_fd = None
+        self.last_time = -np.inf
+        self.size = 0
+
+    def open(self):
+        fd = os.open(self.history_file, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        size = os.fstat(fd).st_size
+        if size < HEADER.size:
+            os.ftruncate(fd, 0)
+            os.write(fd, HEADER.pack(MAGIC, 1, RECORD.size))
+            size = HEADER.size
+        # A record torn by a crash is cut off, the file always holds whole records.
+        whole_size = size - (size - HEADER.size) % RECORD.size
+        if whole_size != size:
+            os.ftruncate(fd, whole_size)
+        self.fd = fd
+        self._read_last_time(whole_size)
+
+    def _read_last_time(self, size):
+        if size > HEADER.size:
+            self.last_time = RECORD.unpack(os.pread(self.fd, RECORD.size, size - RECORD.size))[0]
+        self.size = size
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def locked(self):
+        if self.lock_fd is None:
+            self.lock_fd = os.open(f'{self.history_file}.flock', os.O_RDWR | os.O_CREAT, 0o644)
+        return _FileLock(self.lock_fd)
+
+    def sync(self):
+        # Called under the flock. Another process (the next owner of the app in sharded mode) may have compacted
+        # the file, or appended to it, since this one last wrote.
+        stat = os.fstat(self.fd) if self.fd is not None else None
+        if stat is None or stat.st_nlink == 0:
+            self.close()
+            self.open()
+        elif stat.st_size != self.size:
+            self._read_last_time(stat.st_size)
+
+
+class _FileLock:
+    def __init__(self, fd):
+        self.fd = fd
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+class HistoryStore:
+    # An append-only file of fixed-width records (time, cpu, replicas, desired, action, reason) per app under
+    # history_dir. Timestamps never go backwards in a file (a wall clock step back repeats the last one), so a
+    # time range is found by binary search. Compaction rewrites a file without the records older than
+    # retention_seconds, atomically like the scale state file; start() runs it once per compact_every_seconds
+    # on a background thread, never on the control loop.
+    def __init__(self, history_dir, retention_seconds=0, compact_every_seconds=3600, log=None):
+        self.history_dir = history_dir
+        self.retention_seconds = retention_seconds
+        self.compact_every_seconds = compact_every_seconds
+        self.log = log
+        self.lock = threading.Lock()
+        self.apps = {}
+        self.stopped = threading.Event()
+        self.compactor = None
+        os.makedirs(history_dir, exist_ok=True)
+
+    def history_file(self, app_name):
+        return os.path.join(self.history_dir, quote(app_name, safe='') + '.bin')
+
+    def _app(self, app_name):
+        app_history = self.apps.get(app_name)
+        if app_history is None:
+            with self.lock:
+                app_history = self.apps.setdefault(app_name, _AppHistory(self.history_file(app_name)))
+        return app_history
+
+    def append(self, app_name, cpu, replicas, desired, action=None, reason='steady', timestamp=None):
+        app_history = self._app(app_name)
+        timestamp = time.time() if timestamp is None else timestamp
+        try:
+            with app_history.lock, app_history.locked():
+                app_history.sync()
+                timestamp = max(timestamp, app_history.last_time)
+                record = RECORD.pack(timestamp, cpu, replicas, -1 if desired is None else desired, _ACTION_CODES[action], _REASON_CODES[reason])
+                os.write(app_history.fd, record)
+                app_history.last_time = timestamp
+                app_history.size += RECORD.size
+        except OSError as e:
+            if self.log:
+                self.log.error(f'Unable to record history in {app_history.history_file}, error - {e}')
+
+    def records(self, app_name, start=None, end=None):
+        try:
+            return read_records(self.history_file(app_name), start, end)
+        except FileNotFoundError:
+            return np.empty(0, dtype=RECORD_DTYPE)
+
+    def rollup(self, app_name, step_seconds, start=None, end=None):
+        return rollup(self.records(app_name, start, end), step_seconds)
+
+    def compact(self, app_name, now=None):
+        # Drops the records older than retention_seconds and returns how many. The flock keeps appends of every
+        # process out until the new file is in place, and they reopen it before their next write.
+        if not self.retention_seconds:
+            return 0
+        app_history = self._app(app_name)
+        now = time.time() if now is None else now
+        with app_history.lock, app_history.locked():
+            app_history.sync()
+            records = read_records(app_history.history_file)
+            cutoff = np.searchsorted(records['time'], now - self.retention_seconds, side='left')
+            if not cutoff:
+                return 0
+            tmp_file = f'{app_history.history_file}.{os.getpid()}.tmp'
+            with open(tmp_file, 'wb') as fh:
+                fh.write(HEADER.pack(MAGIC, 1, RECORD.size))
+                fh.write(records[cutoff:].tobytes())
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp_file, app_history.history_file)
+            app_history.close()
+            app_history.open()
+            return int(cutoff)
+
+    def start(self):
+        if self.compactor is None and self.retention_seconds:
+            self.compactor = threading.Thread(target=self._compact_periodically, name='history-compactor', daemon=True)
+            self.compactor.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _compact_periodically(self):
+        # The first run is one period after start-up, not on the first tick.
+        while not self.stopped.wait(self.compact_every_seconds):
+            for app_name in list(self.apps):
+                try:
+                    self.compact(app_name)
+                except (OSError, ValueError) as e:
+                    if self.log:
+                        self.log.error(f'Unable to compact history of app {app_name}, error - {e}')
+
+
+def get_history(settings):
+    # None unless history_dir is set.
+    history = settings.get('history')
+    if history is None and settings.get('history_dir'):
+        history = HistoryStore(settings.get('history_dir'), retention_seconds=settings.get('history_retention_seconds'),
+                               compact_every_seconds=settings.get('history_compact_every_seconds'), log=settings.get('log'))
+        history.start()
+        settings['history'] = history
+    return history
@@ -0,0 +1,158 @@
+import sys
+import json
+import time
+import pathlib
+import threading
+import socketserver
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Local imports
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+import metrics
+from scale_state import DEFAULT_APP_NAME
+
+
+class SampleInbox:
+    # Latest pushed (cpu, replicas) sample per app. Listener threads put samples in, the control loop waits
+    # for new ones and reads the latest sample of an app instead of polling its stats API.
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.samples = {}
+        self.new_samples = {}
+        self.last_triggered = {}
+
+    def put(self, app_name, cpu, replicas):
+        sample = (cpu, replicas, time.monotonic())
+        with self.condition:
+            self.samples[app_name] = sample
+            self.new_samples[app_name] = sample
+            self.condition.notify()
+
+    def fresh(self, app_name, stale_after_seconds):
+        sample = self.samples.get(app_name)
+        if sample is None or time.monotonic() - sample[2] > stale_after_seconds:
+            return None
+        return sample[0], sample[1]
+
+    def wait(self, timeout):
+        # Samples pushed since the last call, waits up to timeout seconds for the first one.
+        with self.condition:
+            if not self.new_samples:
+                self.condition.wait(timeout)
+            new_samples, self.new_samples = self.new_samples, {}
+        return new_samples
+
+    def debounce(self, app_name, debounce_seconds):
+        # At most one triggered decision per app per debounce_seconds.
+        now = time.monotonic()
+        last_triggered = self.last_triggered.get(app_name)
+        if last_triggered is not None and now - last_triggered < debounce_seconds:
+            return False
+        self.last_triggered[app_name] = now
+        return True
+
+
+def get_inbox(settings):
+    inbox = settings.get('sample_inbox')
+    if inbox is None:
+        inbox = SampleInbox()
+        settings['sample_inbox'] = inbox
+    return inbox
+
+def fresh_sample(settings):
+    # The pushed sample of this app, or None when push ingestion is off or the app has gone quiet (poll it).
+    inbox = settings.get('sample_inbox')
+    if inbox is None:
+        return None
+    return inbox.fresh(settings.get('app_name') or DEFAULT_APP_NAME, settings.get('push_stale_after_seconds'))
+
+def _crossed_threshold(cpu, settings):
+    return cpu > settings.get('target_avg_cpu_utilization_for_scale_out') or cpu < settings.get('target_avg_cpu_utilization_for_scale_in')
+
+def wait_for_triggers(inbox, apps, timeout):
+    # Names of the apps (app_name -> settings) whose new samples crossed a scale threshold and need a decision now.
+    triggered = []
+    for app_name, (cpu, replicas, _) in inbox.wait(timeout).items():
+        app_settings = apps.get(app_name)
+        if app_settings is None or not _crossed_threshold(cpu, app_settings):
+            continue
+        if inbox.debounce(app_name, app_settings.get('push_debounce_seconds')):
+            metrics.get_metrics(app_settings).push_triggered_ticks.inc((app_name,))
+            triggered.append(app_name)
+    return triggered
+
+def _parse_samples(payload):
+    # One {"app_name": ..., "cpu": ..., "replicas": ...} object or a list of them, app_name is optional outside fleet mode.
+    samples = json.loads(payload)
+    if isinstance(samples, dict):
+        samples = [samples]
+    if not isinstance(samples, list):
+        raise ValueError('Expected a JSON object or a list of objects.')
+    parsed = []
+    for sample in samples:
+        cpu = float(sample['cpu'])
+        replicas = int(sample['replicas'])
+        if cpu < 0 or replicas < 1:
+            raise ValueError(f'Invalid sample {sample}')
+        parsed.append((str(sample.get('app_name') or DEFAULT_APP_NAME), cpu, replicas))
+    return parsed
+
+def _accept(server, payload, transport):
+    scaler_metrics = server.metrics
+    try:
+        samples = _parse_samples(payload)
+    except (ValueError, TypeError, KeyError, AttributeError):
+        scaler_metrics.rejected_samples.inc((transport,))
+        return False
+    for app_name, cpu, replicas in samples:
+        server.inbox.put(app_name, cpu, replicas)
+        scaler_metrics.pushed_samples.inc((app_name, transport))
+    return True
+
+
+class _HttpSampleHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path.split('?')[0] != '/samples':
+            self.send_error(404)
+            return
+        payload = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if not _accept(self.server, payload, 'http'):
+            self.send_error(400)
+            return
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _UdpSampleHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        _accept(self.server, self.request[0], 'udp')
+
+
+def _serve(server, inbox, scaler_metrics, name):
+    server.inbox = inbox
+    server.metrics = scaler_metrics
+    threading.Thread(target=server.serve_forever, name=name, daemon=True).start()
+    return server
+
+def start_listeners(inbox, settings, log):
+    # HTTP POST /samples and UDP datagrams (one JSON payload each) on push_host, a port of 0 disables that listener.
+    push_host = settings.get('push_host')
+    push_http_port = settings.get('push_http_port')
+    push_udp_port = settings.get('push_udp_port')
+    scaler_metrics = metrics.get_metrics(settings)
+    servers = []
+    try:
+        if push_http_port:
+            http_server = ThreadingHTTPServer((push_host, push_http_port), _HttpSampleHandler)
+            http_server.daemon_threads = True
+            servers.append(_serve(http_server, inbox, scaler_metrics, 'push-http'))
+            log.info(f'Accepting pushed samples on http://{push_host}:{push_http_port}/samples')
+        if push_udp_port:
+            servers.append(_serve(socketserver.UDPServer((push_host, push_udp_port), _UdpSampleHandler), inbox, scaler_metrics, 'push-udp'))
+            log.info(f'Accepting pushed samples on udp://{push_host}:{push_udp_port}')
+    except OSError as e:
+        log.error(f'Unable to listen for pushed samples on {push_host}, error - {e}')
+    return servers
@@ -1,26 +1,91 @@
 import os
 import sys
+import json
+import queue
+import atexit
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 
 
 FORMATTER = logging.Formatter("%(asctime)s | %(levelname)-6.6s | %(funcName)30.30s:%(lineno)-4.4s |  %(message)s")
+# Handlers (and the background writer) are shared by every logger writing to the same log file.
+_OUTPUTS = {}
 
 
-def _get_stream_handler():
+class _JsonFormatter(logging.Formatter):
+   def format(self, record):
+      entry = {'ts': round(record.created, 3), 'level': record.levelname, 'logger': record.name,
+               'func': record.funcName, 'line': record.lineno, 'msg': record.getMessage()}
+      if record.exc_info and not record.exc_text:
+         record.exc_text = self.formatException(record.exc_info)
+      if record.exc_text:
+         entry['exc'] = record.exc_text
+      return json.dumps(entry, separators=(',', ':'))
+
+
+class _LazyQueueHandler(QueueHandler):
+   def prepare(self, record):
+      # The message is formatted by the background writer, only a traceback has to be rendered here while it is still alive.
+      if record.exc_info:
+         record.exc_text = FORMATTER.formatException(record.exc_info)
+         record.exc_info = None
+      return record
+
+
+def _get_formatter(log_format):
+   if log_format == 'json':
+      return _JsonFormatter()
+   return FORMATTER
+
+def _get_stream_handler(formatter):
    console_handler = logging.StreamHandler(sys.stdout)
-   console_handler.setFormatter(FORMATTER)
+   console_handler.setFormatter(formatter)
    return console_handler
 
-def _get_file_handler(log_file):
+def _get_file_handler(log_file, formatter):
    file_handler = TimedRotatingFileHandler(log_file, when='midnight')
-   file_handler.setFormatter(FORMATTER)
+   file_handler.setFormatter(formatter)
    return file_handler
 
+def _get_output_handlers(log_file_full_path, log_format, log_async):
+   key = (os.path.abspath(log_file_full_path), log_format, log_async)
+   if key not in _OUTPUTS:
+      formatter = _get_formatter(log_format)
+      handlers = [_get_stream_handler(formatter), _get_file_handler(log_file_full_path, formatter)]
+      listener = None
+      if log_async:
+         # Records are handed to a background writer through an unbounded queue, so a slow disk or stdout never blocks the caller.
+         log_queue = queue.SimpleQueue()
+         listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+         listener.start()
+         atexit.register(listener.stop)
+         handlers = [_LazyQueueHandler(log_queue)]
+      _OUTPUTS[key] = (handlers, listener)
+   return _OUTPUTS[key][0]
+
+def _release_unused_outputs():
+   # Outputs no logger writes to any more (after a reload changed the log file, format or async mode) are
+   # closed, their background writer drains its queue first.
+   in_use = set()
+   for logger in logging.Logger.manager.loggerDict.values():
+      in_use.update(getattr(logger, 'handlers', ()))
+   for key, (handlers, listener) in list(_OUTPUTS.items()):
+      if in_use.intersection(handlers):
+         continue
+      del _OUTPUTS[key]
+      if listener is not None:
+         atexit.unregister(listener.stop)
+         listener.stop()
+         handlers = listener.handlers
+      for handler in handlers:
+         handler.close()
+
 def get_logger(logger_name, settings):
    log_file = settings.get('log_file')
    log_dir = settings.get('log_dir')
    log_level = settings.get('debug_logs')
+   log_format = settings.get('log_format')
+   log_async = settings.get('log_async')
    log_file_full_path = f'{log_dir}/{log_file}'
    _create_log_dir(log_dir)
    logger = logging.getLogger(logger_name)
@@ -28,10 +93,27 @@ def get_logger(logger_name, settings):
       logger.setLevel(logging.DEBUG)
    else:
       logger.setLevel(logging.INFO)
-   logger.addHandler(_get_stream_handler())
-   logger.addHandler(_get_file_handler(log_file_full_path))
+   # Calling get_logger again for the same name must not add the handlers twice, and after a reload that
+   # changed the log output the previous handlers are swapped out, not kept next to the new ones.
+   output_handlers = _get_output_handlers(log_file_full_path, log_format, log_async)
+   owned_handlers = {handler for handlers, _ in _OUTPUTS.values() for handler in handlers}
+   for handler in list(logger.handlers):
+      if handler in owned_handlers and handler not in output_handlers:
+         logger.removeHandler(handler)
+   for handler in output_handlers:
+      if handler not in logger.handlers:
+         logger.addHandler(handler)
+   _release_unused_outputs()
    return logger
 
 def _create_log_dir(log_dir):
    if not os.path.exists(log_dir):
       os.makedirs(log_dir)
+
+class _AppLoggerAdapter(logging.LoggerAdapter):
+   def process(self, msg, kwargs):
+      return f'[{self.extra["app_name"]}] {msg}', kwargs
+
+def get_app_logger(logger, app_name):
+   # Fleet mode shares one set of handlers, every line is prefixed with the app it belongs to.
+   return _AppLoggerAdapter(logger, {'app_name': app_name})
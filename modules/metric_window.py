@@ -0,0 +1,93 @@
+import math
+from array import array
+from bisect import bisect_left, insort
+from collections import deque
+
+
+AGGREGATES = ('last', 'mean', 'ewma', 'max')
+
+
+class MetricWindow:
+    # Fixed-size ring buffer of the most recent samples, allocated once. An add is O(1) (amortised for the max):
+    # it updates the running sum, the EWMA and a monotonic deque of the window's maximum candidates. A sorted
+    # copy of the window is only kept when the window is read as a percentile, it costs O(log n) to search and
+    # an O(n) memmove per add; without it a percentile sorts the window when it is read.
+    def __init__(self, size, ewma_alpha=0.3, aggregate=None):
+        if size < 1:
+            raise ValueError(f'Metric window size must be at least 1, got {size}')
+        self.size = size
+        self.ewma_alpha = ewma_alpha
+        self.aggregate_name = aggregate
+        self.values = array('d', bytes(8 * size))
+        self.sorted_values = [] if aggregate is not None and aggregate not in AGGREGATES else None
+        self.max_candidates = deque()
+        self.added = 0
+        self.position = 0
+        self.count = 0
+        self.total = 0.0
+        self.ewma = None
+
+    def add(self, value):
+        if self.count == self.size:
+            evicted = self.values[self.position]
+            self.total -= evicted
+            if self.sorted_values is not None:
+                del self.sorted_values[bisect_left(self.sorted_values, evicted)]
+        else:
+            self.count += 1
+        self.values[self.position] = value
+        self.total += value
+        if self.sorted_values is not None:
+            insort(self.sorted_values, value)
+        # Candidates are (add number, value) with decreasing values, the front one is the max of the window.
+        while self.max_candidates and self.max_candidates[-1][1] <= value:
+            self.max_candidates.pop()
+        self.max_candidates.append((self.added, value))
+        if self.max_candidates[0][0] <= self.added - self.size:
+            self.max_candidates.popleft()
+        self.added += 1
+        self.ewma = value if self.ewma is None else self.ewma + self.ewma_alpha * (value - self.ewma)
+        self.position += 1
+        if self.position == self.size:
+            self.position = 0
+            # Re-summing once per wrap keeps float drift out of the running sum at O(1) amortised cost.
+            self.total = math.fsum(self.values)
+
+    def last(self):
+        return self.values[self.position - 1] if self.count else None
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def max(self):
+        return self.max_candidates[0][1] if self.count else None
+
+    def percentile(self, percent):
+        # Nearest-rank percentile.
+        if not self.count:
+            return None
+        rank = max(math.ceil(percent / 100 * self.count), 1)
+        sorted_values = self.sorted_values if self.sorted_values is not None else sorted(self.values[:self.count])
+        return sorted_values[rank - 1]
+
+    def aggregate(self, name):
+        if name == 'last':
+            return self.last()
+        if name == 'mean':
+            return self.mean()
+        if name == 'ewma':
+            return self.ewma
+        if name == 'max':
+            return self.max()
+        return self.percentile(_percentile_of(name))
+
+
+def _percentile_of(name):
+    if name.startswith('p') and name[1:].isdigit() and 0 < int(name[1:]) <= 100:
+        return int(name[1:])
+    raise ValueError(f'Unknown metric aggregate {name}, use any of {AGGREGATES} or a percentile like p90')
+
+def validate_aggregate(name):
+    if name not in AGGREGATES:
+        _percentile_of(name)
+    return name
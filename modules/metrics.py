@@ -0,0 +1,188 @@
+import math
+import json
+import threading
+from urllib.parse import urlsplit, parse_qs
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+DEFAULT_APP_LABEL = 'default'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _format_labels(labelnames, labels, extra=()):
+    pairs = list(zip(labelnames, labels)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    # One metric family, a value per label tuple. Updates take a short lock, they can come from fleet threads.
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for labels, value in self.values.items():
+                lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, labels, value):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        # Only the one matching bucket is counted here, the cumulative counts are built when rendering.
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for labels, (bucket_counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (math.inf,), bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, [("le", _format_value(bound))])} {cumulative}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}')
+                lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class ScalerMetrics:
+    # Every metric the auto-scaler exposes. One instance per process, shared by all apps of a fleet.
+    def __init__(self):
+        self.tick_duration = Histogram('autoscaler_tick_duration_seconds', 'Duration of one auto-scaler tick.', ('app',))
+        self.phase_duration = Histogram('autoscaler_phase_duration_seconds', 'Duration of the phases of a tick: read_metrics, decide, update_replicas.', ('app', 'phase'))
+        self.last_tick = Gauge('autoscaler_last_tick_timestamp_seconds', 'Unix time the last tick finished.', ('app',))
+        self.tick_overruns = Counter('autoscaler_tick_overruns_total', 'Ticks (fleet rounds for loop="fleet") that ended after the next tick deadline.', ('loop',))
+        self.missed_tick_deadlines = Counter('autoscaler_missed_tick_deadlines_total', 'Tick deadlines skipped because the tick before them overran.', ('loop',))
+        self.skipped_ticks = Counter('autoscaler_skipped_ticks_total', 'Ticks skipped because the stats API returned no usable values.', ('app',))
+        self.api_request_duration = Histogram('autoscaler_api_request_duration_seconds', 'Latency of ScaleIt API calls, one observation per attempt.', ('app', 'endpoint', 'status'))
+        self.api_retries = Counter('autoscaler_api_retries_total', 'Failed ScaleIt API attempts that were retried.', ('app', 'endpoint'))
+        self.api_retry_sleep = Counter('autoscaler_api_retry_sleep_seconds_total', 'Time spent sleeping between ScaleIt API retries.', ('app', 'endpoint'))
+        self.api_fast_failures = Counter('autoscaler_api_fast_failures_total', 'ScaleIt API calls not made because the circuit breaker was open or the tick deadline had passed.', ('app', 'endpoint', 'reason'))
+        self.circuit_breaker_state = Gauge('autoscaler_circuit_breaker_state', 'Circuit breaker state per endpoint URL: 0 closed, 1 half-open, 2 open.', ('url',))
+        self.cooldown_skips = Counter('autoscaler_cooldown_skips_total', 'Ticks that did not scale because of the cooldown.', ('app',))
+        self.emergency_scale_outs = Counter('autoscaler_emergency_scale_outs_total', 'Scale-outs decided during the cooldown because the reading was at or above emergency_scale_out_utilization.', ('app',))
+        self.step_limited_actions = Counter('autoscaler_step_limited_actions_total', 'Scale actions cut down to max_scale_step / max_scale_step_percent.', ('app',))
+        self.flap_avoided_scale_ins = Counter('autoscaler_flap_avoided_scale_ins_total', 'Scale-ins that were skipped or reduced to avoid flapping.', ('app',))
+        self.scale_actions = Counter('autoscaler_scale_actions_total', 'Scale actions applied through the ScaleIt API.', ('app', 'action'))
+        self.coalesced_updates = Counter('autoscaler_coalesced_updates_total', 'Replica updates not sent because the same target is pending, or queued behind the update in flight.', ('app',))
+        self.converging_ticks = Counter('autoscaler_converging_ticks_total', 'Ticks not decided on because replicas were still converging to the last target.', ('app',))
+        self.convergence_timeouts = Counter('autoscaler_convergence_timeouts_total', 'Acknowledged updates whose target was not reported within the convergence timeout.', ('app',))
+        self.convergence_duration = Histogram('autoscaler_replica_convergence_seconds', 'Time from an acknowledged update until the reported replicas reached (and settled at) the target.', ('app',))
+        self.pushed_samples = Counter('autoscaler_pushed_samples_total', 'Samples pushed to the scaler, by transport (http, udp).', ('app', 'transport'))
+        self.rejected_samples = Counter('autoscaler_rejected_samples_total', 'Pushed payloads that could not be parsed.', ('transport',))
+        self.push_triggered_ticks = Counter('autoscaler_push_triggered_ticks_total', 'Early ticks triggered by a pushed sample outside the scale-in/scale-out targets.', ('app',))
+        self.owned_apps = Gauge('autoscaler_owned_apps', 'Apps a worker holds the lease of in sharded mode.', ('worker',))
+        self.shard_takeovers = Counter('autoscaler_shard_takeovers_total', 'App leases a worker took over from another worker (or on start-up).', ('worker',))
+        self.desired_replicas = Gauge('autoscaler_desired_replicas', 'Replicas the current load asks for, before limits, cooldown and flap protection.', ('app',))
+        self.metric_desired_replicas = Gauge('autoscaler_metric_desired_replicas', 'Replicas each metric asks for when scaling policies are set (cpu and every policy metric).', ('app', 'metric'))
+        self.current_replicas = Gauge('autoscaler_current_replicas', 'Replicas reported by the stats API.', ('app',))
+        self.all = [metric for metric in vars(self).values() if isinstance(metric, _Metric)]
+
+    def render(self):
+        lines = []
+        for metric in self.all:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def get_metrics(settings):
+    metrics = settings.get('metrics')
+    if metrics is None:
+        metrics = ScalerMetrics()
+        settings['metrics'] = metrics
+    return metrics
+
+def app_label(settings):
+    return settings.get('app_name') or DEFAULT_APP_LABEL
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/metrics':
+            self._reply(self.server.metrics.render().encode(), 'text/plain; version=0.0.4; charset=utf-8')
+        elif url.path == '/samples' and self.server.sample_feed is not None:
+            # The dashboard's feed: ?app=<app_name>&since=<last seq seen>
+            query = parse_qs(url.query)
+            try:
+                since = int(query.get('since', ['0'])[0])
+            except ValueError:
+                self.send_error(400)
+                return
+            samples = self.server.sample_feed.to_json(query.get('app', [DEFAULT_APP_LABEL])[0], since)
+            self._reply(json.dumps(samples).encode(), 'application/json')
+        else:
+            self.send_error(404)
+
+    def _reply(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(metrics, host, port, log=None, sample_feed=None):
+    # Prometheus text format on http://host:port/metrics (and the dashboard feed on /samples), served from a
+    # daemon thread. Port 0 disables it.
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        if log:
+            log.error(f'Unable to serve metrics on {host}:{port}, error - {e}')
+        return None
+    server.daemon_threads = True
+    server.metrics = metrics
+    server.sample_feed = sample_feed
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    if log:
+        log.info(f'Serving metrics on http://{host}:{port}/metrics')
+    return server
@@ -0,0 +1,42 @@
+import time
+import threading
+from collections import deque
+
+
+FIELDS = ('seq', 'time', 'cpu', 'replicas', 'desired', 'scale_out_target', 'scale_in_target', 'state')
+
+
+class SampleFeed:
+    # The last `size` ticks of every app (what was read, what was decided), for the dashboard. Each app has its
+    # own fixed-size ring, so memory stays constant however long the scaler runs; a reader asks for everything
+    # after the last sequence number it has seen.
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.seq = 0
+
+    def add(self, app_name, cpu, replicas, desired, scale_out_target, scale_in_target, state):
+        with self.lock:
+            self.seq += 1
+            samples = self.samples.get(app_name)
+            if samples is None:
+                samples = self.samples[app_name] = deque(maxlen=self.size)
+            samples.append((self.seq, time.time(), cpu, replicas, desired, scale_out_target, scale_in_target, state))
+
+    def since(self, app_name, seq=0):
+        with self.lock:
+            samples = [sample for sample in self.samples.get(app_name, ()) if sample[0] > seq]
+            return self.seq, samples
+
+    def to_json(self, app_name, seq=0):
+        last_seq, samples = self.since(app_name, seq)
+        return {'seq': last_seq, 'fields': FIELDS, 'samples': samples}
+
+
+def get_feed(settings):
+    feed = settings.get('sample_feed')
+    if feed is None:
+        feed = SampleFeed(settings.get('sample_feed_size'))
+        settings['sample_feed'] = feed
+    return feed
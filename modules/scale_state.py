@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import signal
+import threading
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+DEFAULT_APP_NAME = 'default'
+
+
+class ScaleStateStore:
+    # Cooldown / last scale action per app, kept in memory. The file is only touched on start-up and when a
+    # scale action is recorded, and it is replaced atomically (temp file + fsync + rename), so a crash can
+    # never leave a torn file behind. A shared store (sharded mode) is written by several workers, each for the
+    # apps it holds the lease of: a write merges its changes into the file under an flock, and an app's state is
+    # read with refresh() when this worker takes its lease.
+    def __init__(self, state_file, log=None, shared=False):
+        self.state_file = state_file
+        self.log = log
+        self.shared = shared
+        self.lock = threading.RLock() # Re-entrant, the SIGUSR1 handler may interrupt a write in the same thread.
+        self.apps = {}
+        self.monotonic_times = {}
+        self.fallback_action_time = None
+        if not shared:
+            self._restore()
+
+    def last_action(self, app_name):
+        state = self.apps.get(app_name or DEFAULT_APP_NAME)
+        if state is None and self.fallback_action_time is not None:
+            return {'time': self.fallback_action_time, 'action': None, 'replicas': None}
+        return state
+
+    def last_action_time(self, app_name):
+        state = self.last_action(app_name)
+        return state['time'] if state else None
+
+    def seconds_since_last_action(self, app_name):
+        # Actions of this process are timed on the monotonic clock, so an NTP step can not shorten or stretch a
+        # cooldown. Only actions recorded before a restart (or by another worker) fall back to the wall clock.
+        app_name = app_name or DEFAULT_APP_NAME
+        with self.lock:
+            started = self.monotonic_times.get(app_name)
+            if started is not None:
+                return time.monotonic() - started
+            action_time = self.last_action_time(app_name)
+        return None if action_time is None else max(time.time() - action_time, 0)
+
+    def record_scale_action(self, app_name, action, replicas, action_time=None):
+        with self.lock:
+            app_name = app_name or DEFAULT_APP_NAME
+            if action_time is None:
+                self.monotonic_times[app_name] = time.monotonic()
+            else:
+                self.monotonic_times.pop(app_name, None)
+            self.apps[app_name] = {
+                'time': time.time() if action_time is None else action_time,
+                'action': action,
+                'replicas': replicas,
+            }
+            self._persist({app_name: self.apps[app_name]})
+
+    def clear_cooldown(self, app_name=None):
+        # Lets the next tick ignore the cooldown once, for one app or for all of them.
+        with self.lock:
+            if app_name is None:
+                changes = dict.fromkeys(self.apps)
+                self.apps.clear()
+                self.monotonic_times.clear()
+                self.fallback_action_time = None
+            else:
+                changes = {app_name: None}
+                self.apps.pop(app_name, None)
+                self.monotonic_times.pop(app_name, None)
+            self._persist(changes)
+
+    def refresh(self, app_name):
+        # Takes over what the previous owner of an app recorded, the file is the only state workers share.
+        with self.lock:
+            self.monotonic_times.pop(app_name, None)
+            state = self._read_shared().get(app_name)
+            if isinstance(state, dict) and 'time' in state:
+                self.apps[app_name] = state
+            else:
+                self.apps.pop(app_name, None)
+
+    def _persist(self, changes):
+        if not self.shared:
+            self._write(self.apps)
+            return
+        try:
+            with open(f'{self.state_file}.flock', 'w') as lock_fh:
+                fcntl.flock(lock_fh, fcntl.LOCK_EX)
+                apps = self._read_shared()
+                for app_name, state in changes.items():
+                    if state is None:
+                        apps.pop(app_name, None)
+                    else:
+                        apps[app_name] = state
+                self._write(apps)
+        except OSError as e:
+            if self.log:
+                self.log.error(f'Unable to record scale state in {self.state_file}, error - {e}')
+
+    def _read_shared(self):
+        try:
+            with open(self.state_file) as fh:
+                state = json.load(fh)
+        except (OSError, ValueError):
+            return {}
+        return state if isinstance(state, dict) else {}
+
+    def _write(self, apps):
+        tmp_file = f'{self.state_file}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_file, 'w') as fh:
+                json.dump(apps, fh)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp_file, self.state_file)
+            self._fsync_dir()
+        except Exception as e:
+            if self.log:
+                self.log.error(f'Unable to record scale state in {self.state_file}, error - {e}')
+
+    def _fsync_dir(self):
+        # The rename itself is only durable once the directory entry is on disk.
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        dir_fd = os.open(os.path.dirname(os.path.abspath(self.state_file)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _restore(self):
+        try:
+            with open(self.state_file) as fh:
+                content = fh.read().strip()
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            if self.log:
+                self.log.warning(f'Unable to read scale state file {self.state_file}, error - {e}')
+            return
+        try:
+            state = json.loads(content)
+        except ValueError:
+            state = None
+        if isinstance(state, dict):
+            self.apps = {app_name: app_state for app_name, app_state in state.items() if isinstance(app_state, dict) and 'time' in app_state}
+        elif isinstance(state, (int, float)):
+            # Older versions wrote a bare timestamp for a single app.
+            self.apps = {DEFAULT_APP_NAME: {'time': float(state), 'action': None, 'replicas': None}}
+        else:
+            # Unreadable state must not switch cooldown off, the file's mtime is the safest guess for the last action.
+            if self.log:
+                self.log.warning(f'Scale state file {self.state_file} is corrupt, assuming a scale action at its last modification time.')
+            self.fallback_action_time = os.path.getmtime(self.state_file)
+
+
+def get_store(settings):
+    store = settings.get('scale_state')
+    if store is None:
+        if settings.get('shard_dir'):
+            # Every worker of a sharded fleet reads and writes the one state file in the shared directory.
+            store = ScaleStateStore(os.path.join(settings.get('shard_dir'), 'scale_state.json'), log=settings.get('log'), shared=True)
+        else:
+            store = ScaleStateStore(settings.get('cooldown_lock_file'), log=settings.get('log'))
+        settings['scale_state'] = store
+    return store
+
+def clear_cooldown_on_signal(store, log):
+    # `kill -USR1 <pid>` makes the next tick ignore the cooldown once, for every app of this process.
+    signum = getattr(signal, 'SIGUSR1', None)
+    if signum is None:
+        return
+    def handler(signum, frame):
+        log.warning('Received SIGUSR1, auto-scaler will ignore the cooldown once.')
+        store.clear_cooldown()
+    signal.signal(signum, handler)
@@ -1,6 +1,15 @@
+import sys
+import math
 import time
 import random
+import pathlib
 import requests
+import requests.adapters
+
+# Local imports
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+import metrics
+import circuit_breaker
 
 
 def _add_randomness_multiplier_for_wait_time(retry_add_randomness):
@@ -17,138 +26,227 @@ def _waiting_time(attempt, retry_after_seconds, retry_exponentially, settings):
     waiting_time = ( retry_after_seconds ** attempt ) * _add_randomness_multiplier_for_wait_time(retry_add_randomness)
     return round(waiting_time, 2)
     
-def _get_app_status_read_url(settings):
+def _get_url(settings, url_path):
     app_status_port=settings.get('app_status_port')
     app_status_host=settings.get('app_status_host')
-    app_status_read_url=settings.get('app_status_read_url')
     app_status_secure=settings.get('app_status_secure')
-    app_status_host.rstrip('/')
+    app_status_host = app_status_host.rstrip('/')
     if app_status_host.startswith('http'):
-        return f'{app_status_host}:{app_status_port}{app_status_read_url}'
+        return f'{app_status_host}:{app_status_port}{url_path}'
     if app_status_secure:
-        return f'https://{app_status_host}:{app_status_port}{app_status_read_url}'
-    return f'http://{app_status_host}:{app_status_port}{app_status_read_url}'
+        return f'https://{app_status_host}:{app_status_port}{url_path}'
+    return f'http://{app_status_host}:{app_status_port}{url_path}'
 
-def find_current_cpu_stats(settings):
-    log = settings.get('log')
-    url = _get_app_status_read_url(settings)
-    read_metrics_key = settings.get('read_metrics_key')
-    read_replicas_key=settings.get('read_replicas_key')
-    app_connection_timeout=settings.get('app_connection_timeout')
-    attempts = settings.get('api_retries_count')
-    headers = {'Accept' : 'application/json'}
-    for n in range(1, attempts + 1):
+def _get_app_status_read_url(settings):
+    return _get_url(settings, settings.get('app_status_read_url'))
+
+def _get_replica_update_url(settings):
+    return _get_url(settings, settings.get('app_replica_update_url'))
+
+def make_session(settings, pool_connections=None, pool_maxsize=None):
+    # A session keeps connections alive, so a poll does not pay for a new TCP/TLS handshake every time.
+    app_connection_pool_size = settings.get('app_connection_pool_size')
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections or 1,
+                                            pool_maxsize=pool_maxsize or app_connection_pool_size)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class ScaleItClient:
+    # URLs and key paths are resolved once here instead of on every call.
+    def __init__(self, settings, session=None):
+        self.settings = settings
+        self.session = session or make_session(settings)
+        self.status_url = _get_app_status_read_url(settings)
+        self.replica_update_url = _get_replica_update_url(settings)
+        self.metrics_key_path = _compile_key_path(settings.get('read_metrics_key'))
+        self.replicas_key_path = _compile_key_path(settings.get('read_replicas_key'))
+        self.policy_key_paths = [(policy['name'], _compile_key_path(policy['key'])) for policy in settings.get('scaling_policies') or ()]
+        self.status_headers = {'Accept' : 'application/json'}
+        self.update_headers = {'Content-type' : 'application/json'}
+        self.metrics = metrics.get_metrics(settings)
+        self.app_label = metrics.app_label(settings)
+        self.breakers = {'status': circuit_breaker.get_breaker(settings, self.status_url),
+                         'replicas': circuit_breaker.get_breaker(settings, self.replica_update_url)}
+
+    def find_current_cpu_stats(self):
+        avg_cpu, replicas, _ = self.find_current_stats()
+        return avg_cpu, replicas
+
+    def find_current_stats(self):
+        # Avg CPU, replicas and the value of every scaling policy metric, all from one status response.
+        log = self.settings.get('log')
+        url = self.status_url
+        response = self._call(self.session.get, url, 'status', headers=self.status_headers)
+        if response is None:
+            return None, None, {}
         try:
-            response = requests.get(url=url, headers=headers, timeout=app_connection_timeout)
-            response.raise_for_status()
             data = response.json()
+            avg_cpu = _read_key_path(self.metrics_key_path, data)
+            replicas = _read_key_path(self.replicas_key_path, data)
+            # This is to make sure we always return a float, even if the API returns a numeric value as a string, e.g., '33.7'.
+            # The API currently returns an integer or float, but this block checks if the API returns something other than these data types.
+            # In the future version, if the response changes, it will handle any primitive data type change but will throw an error if the complete response structure changes.
+            avg_cpu = float(avg_cpu)
+            replicas = int(replicas)
+        except (ValueError, TypeError) as e:
+            # This will be executed if the API returns a non-supported value.
+            log.error('%s returned %s, Avg CPU/Replicas: Non-supported value returned', url, response.status_code)
+            log.debug('%s returned %s, Response: %s', url, response.status_code, response.text)
+            return None, None, {}
+        log.debug('%s returned %s, Avg CPU: %s, Replicas: %s', url, response.status_code, avg_cpu, replicas)
+        policy_values = {}
+        for name, key_path in self.policy_key_paths:
             try:
-                avg_cpu = _read_nested_key_value(read_metrics_key, data)
-                replicas= _read_nested_key_value(read_replicas_key, data) 
-                # This is to make sure we always return a float, even if the API returns a numeric value as a string, e.g., '33.7'.
-                # The API currently returns an integer or float, but this block checks if the API returns something other than these data types.
-                # In the future version, if the response changes, it will handle any primitive data type change but will throw an error if the complete response structure changes.
-                avg_cpu = float(avg_cpu)  
-                replicas = int(replicas)
-            except ValueError as e:
-                # This will be executed if the API returns a non-supported value.
-                log.error(f'{url} returned {response.status_code}, Avg CPU/Replicas: Non-supported value returned')
-                log.debug(f'{url} returned {response.status_code}, Response: {data}')
-                avg_cpu = None
-                replicas = None
-            finally:
-                log.debug(f'{url} returned {response.status_code}, Avg CPU: {avg_cpu}, Replicas: {replicas}')
-                return avg_cpu, replicas
-        except requests.exceptions.HTTPError as e:
-            http_status_prefix =  e.response.status_code // 100
-            retry_on_http_codes = settings.get('retry_on_http_codes')
-            if http_status_prefix in retry_on_http_codes:
-                _attempt_appropriate_wait_and_logging(total_attempts=attempts, current_attempt=n, url=url, error_string=e.response.status_code, settings=settings)
-                continue
-            log.error(f'{url} returned {e.response.status_code}. No retry configured, giving up.')
-            return None, None
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
-            retry_on_connection_error = settings.get('retry_on_connection_error') 
-            if retry_on_connection_error:
-                _attempt_appropriate_wait_and_logging(total_attempts=attempts, current_attempt=n, url=url, error_string='ConnectionError/TimeOut', settings=settings)
-                continue
-            log.error(f'Unable to connect to API {url}, check if API endpoint is correct. No retry configured, giving up. error {e}')
-            return None, None
-        except Exception as e:
-            log.error(f'Unable to call API {url}, error {e}')
-            return None, None
-    log.error(f'All re-tries were excusted for {url}, giving up.')
-    return None, None # When all attempts fail, this value will be returned.
+                policy_values[name] = float(_read_key_path(key_path, data))
+            except (ValueError, TypeError):
+                # A metric that can not be read has no say in this tick, and it blocks any scale-in.
+                log.error('%s returned %s, %s: Non-supported value returned', url, response.status_code, name)
+                policy_values[name] = None
+        if policy_values:
+            log.debug('%s returned %s, Policy metrics: %s', url, response.status_code, policy_values)
+        return avg_cpu, replicas, policy_values
 
-def _get_replica_update_url(settings):
-    app_status_port=settings.get('app_status_port')
-    app_status_host=settings.get('app_status_host')
-    app_replica_update_url=settings.get('app_replica_update_url')
-    app_status_secure=settings.get('app_status_secure')
-    app_status_host.rstrip('/')
-    if app_status_host.startswith('http'):
-        return f'{app_status_host}:{app_status_port}{app_replica_update_url}'
-    if app_status_secure:
-        return f'https://{app_status_host}:{app_status_port}{app_replica_update_url}'
-    return f'http://{app_status_host}:{app_status_port}{app_replica_update_url}'
+    def update_app_replicas(self, replicas):
+        log = self.settings.get('log')
+        url = self.replica_update_url
+        data = _make_key_path_value(self.replicas_key_path, replicas)
+        # A decided scale action is always sent once, even when reading the status used up the tick's budget.
+        response = self._call(self.session.put, url, 'replicas', always_attempt=True, headers=self.update_headers, json=data)
+        if response is None:
+            return None
+        log.info('%s returned %s, Scaled to replicas: %s', url, response.status_code, replicas)
+        return True
 
-def update_app_replicas(replicas, settings):
-    log = settings.get('log')
-    url = _get_replica_update_url(settings)
-    read_replicas_key = settings.get('read_replicas_key')
-    app_connection_timeout=settings.get('app_connection_timeout')
-    attempts = settings.get('api_retries_count')
-    headers = {'Content-type' : 'application/json'}
-    data = _make_nested_key_value(read_replicas_key, replicas)
-    for n in range(1, attempts + 1):
+    def _send(self, send, url, endpoint, **kwargs):
+        # In fleet mode a slot is held for the request only, not for the retry waits around it.
+        request_slots = self.settings.get('request_slots')
+        if request_slots is None:
+            return self._timed_send(send, url, endpoint, **kwargs)
+        with request_slots:
+            return self._timed_send(send, url, endpoint, **kwargs)
+
+    def _timed_send(self, send, url, endpoint, **kwargs):
+        started = time.perf_counter()
+        status = 'error'
         try:
-            response = requests.put(url=url, headers=headers, json=data, timeout=app_connection_timeout)
-            response.raise_for_status()
-            log.info(f'{url} returned {response.status_code}, Scaled to replicas: {replicas}')
-            return True
-        except requests.exceptions.HTTPError as e:
-            http_status_prefix =  e.response.status_code // 100
-            retry_on_http_codes = settings.get('retry_on_http_codes')
-            if http_status_prefix in retry_on_http_codes:
-                _attempt_appropriate_wait_and_logging(total_attempts=attempts, current_attempt=n, url=url, error_string=e.response.status_code, settings=settings)
-                continue
-            log.error(f'{url} returned {e.response.status_code}. No retry configured, giving up.')
-            return None
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
-            retry_on_connection_error = settings.get('retry_on_connection_error') 
-            if retry_on_connection_error:
-                _attempt_appropriate_wait_and_logging(total_attempts=attempts, current_attempt=n, url=url, error_string='ConnectionError/TimeOut', settings=settings)
-                continue
-            log.error(f'Unable to connect to API {url}, check if API endpoint is correct. No retry configured, giving up. error {e}')
-            return None
-        except Exception as e:
-            log.error(f'Unable to call API {url}, error {e}')
-            return None
-    log.error(f'All re-tries were excusted for {url}, giving up.')
-    return None # When all attempts fail, this value will be returned.
+            response = send(url=url, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            self.metrics.api_request_duration.observe((self.app_label, endpoint, status), time.perf_counter() - started)
+
+    def _retry(self, endpoint, waited_seconds):
+        if waited_seconds is None:
+            return False
+        self.metrics.api_retries.inc((self.app_label, endpoint))
+        self.metrics.api_retry_sleep.inc((self.app_label, endpoint), waited_seconds)
+        return True
+
+    def _fail_fast(self, endpoint, reason):
+        self.metrics.api_fast_failures.inc((self.app_label, endpoint, reason))
+        return None
+
+    def _call(self, send, url, endpoint, always_attempt=False, **kwargs):
+        settings = self.settings
+        log = settings.get('log')
+        app_connection_timeout = settings.get('app_connection_timeout')
+        attempts = settings.get('api_retries_count')
+        breaker = self.breakers[endpoint]
+        # Set by autoscale_tick, attempts and retry waits never run past the end of the tick's budget. With
+        # always_attempt the first attempt is made (with the full timeout) however much of the budget is left.
+        deadline = settings.get('tick_deadline') or math.inf
+        for n in range(1, attempts + 1):
+            first_attempt_guaranteed = always_attempt and n == 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and not first_attempt_guaranteed:
+                log.error('No time left in this tick to call %s, giving up.', url)
+                return self._fail_fast(endpoint, 'deadline')
+            if not breaker.allow():
+                log.warning('Circuit breaker for %s is open, call skipped.', url)
+                return self._fail_fast(endpoint, 'circuit_open')
+            try:
+                timeout = app_connection_timeout if first_attempt_guaranteed else min(app_connection_timeout, remaining)
+                response = self._send(send, url, endpoint, timeout=timeout, **kwargs)
+                response.raise_for_status()
+                breaker.record(True)
+                return response
+            except requests.exceptions.HTTPError as e:
+                # Only server-side errors say something about the endpoint's health.
+                breaker.record(e.response.status_code < 500)
+                http_status_prefix =  e.response.status_code // 100
+                retry_on_http_codes = settings.get('retry_on_http_codes')
+                if http_status_prefix in retry_on_http_codes:
+                    if not self._retry(endpoint, _attempt_appropriate_wait_and_logging(total_attempts=attempts, current_attempt=n, url=url, error_string=e.response.status_code, settings=settings, deadline=deadline)):
+                        break
+                    continue
+                log.error('%s returned %s. No retry configured, giving up.', url, e.response.status_code)
+                return None
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                breaker.record(False)
+                retry_on_connection_error = settings.get('retry_on_connection_error')
+                if retry_on_connection_error:
+                    if not self._retry(endpoint, _attempt_appropriate_wait_and_logging(total_attempts=attempts, current_attempt=n, url=url, error_string='ConnectionError/TimeOut', settings=settings, deadline=deadline)):
+                        break
+                    continue
+                log.error('Unable to connect to API %s, check if API endpoint is correct. No retry configured, giving up. error %s', url, e)
+                return None
+            except Exception as e:
+                breaker.record(False)
+                log.error('Unable to call API %s, error %s', url, e)
+                return None
+        log.error('All re-tries were excusted for %s, giving up.', url)
+        return None # When all attempts fail, this value will be returned.
+
 
-def _attempt_appropriate_wait_and_logging(total_attempts, current_attempt, url, error_string, settings):
+def get_client(settings):
+    client = settings.get('scaleit_client')
+    if client is None or client.settings is not settings:
+        # A client carried over from the settings of an older config is rebuilt, its pooled session is kept.
+        client = ScaleItClient(settings, session=client.session if client else None)
+        settings['scaleit_client'] = client
+    return client
+
+def find_current_cpu_stats(settings):
+    return get_client(settings).find_current_cpu_stats()
+
+def find_current_stats(settings):
+    return get_client(settings).find_current_stats()
+
+def update_app_replicas(replicas, settings):
+    return get_client(settings).update_app_replicas(replicas)
+
+def _attempt_appropriate_wait_and_logging(total_attempts, current_attempt, url, error_string, settings, deadline=math.inf):
     log = settings.get('log')
     retry_after_seconds = settings.get('retry_after_seconds') 
     retry_exponentially = settings.get('retry_exponentially')
     if total_attempts > 1:
+        if current_attempt >= total_attempts:
+            # No point in waiting after the last attempt.
+            log.warning('%s returned %s, Attept %s was the last one.', url, error_string, current_attempt)
+            return None
         time_to_sleep = _waiting_time(attempt=current_attempt, retry_after_seconds=retry_after_seconds, retry_exponentially=retry_exponentially, settings=settings )
-        log.warning(f'{url} returned {error_string}, Attept {current_attempt}, Retrying after {time_to_sleep}')
+        if time.monotonic() + time_to_sleep >= deadline:
+            log.warning('%s returned %s, Attept %s, a retry after %s would miss the tick deadline, giving up.', url, error_string, current_attempt, time_to_sleep)
+            return None
+        log.warning('%s returned %s, Attept %s, Retrying after %s', url, error_string, current_attempt, time_to_sleep)
         time.sleep(time_to_sleep)
-    else:
-        log.warning(f'{url} returned {error_string}, No retry configured.')
-    return
+        return time_to_sleep
+    log.warning('%s returned %s, No retry configured.', url, error_string)
+    return None
+
+def _compile_key_path(key_string):
+    return tuple(key_string.split('.'))
 
-def _read_nested_key_value(key_string, data):
-    keys = key_string.split('.')
-    for key in keys:
+def _read_key_path(key_path, data):
+    for key in key_path:
         data = data.get(key, {})
     return data
 
-def _make_nested_key_value(key_string, value):
-    data = {}
-    keys = key_string.split('.')
-    for key in keys:
-        data[key] = {}
-    data[key] = value
+def _make_key_path_value(key_path, value):
+    data = value
+    for key in reversed(key_path):
+        data = {key: data}
     return data
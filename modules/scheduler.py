@@ -0,0 +1,36 @@
+import math
+import time
+import hashlib
+
+
+class TickScheduler:
+    # Tick deadlines on the monotonic clock: tick n is due at start + phase + n * interval, however long the
+    # ticks themselves take, so the period does not drift with API latency or retry waits. A tick that ends
+    # past the next deadline is an overrun; the deadlines it missed are skipped, not run back to back.
+    def __init__(self, interval, phase=0, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self.deadline = clock() + phase
+
+    def remaining(self):
+        return max(self.deadline - self.clock(), 0)
+
+    def advance(self, interval=None):
+        # Moves to the next deadline after the tick that was due at the current one, returns how many deadlines
+        # were missed. A new interval (config reload) counts from the deadline of the tick that just ran.
+        if interval is not None:
+            self.interval = interval
+        self.deadline += self.interval
+        late = self.clock() - self.deadline
+        if late <= 0:
+            return 0
+        missed = math.floor(late / self.interval) + 1
+        self.deadline += missed * self.interval
+        return missed
+
+
+def phase_offset(key, interval, jitter_fraction):
+    # A stable offset in [0, jitter_fraction * interval) per app, the same in every process and after a restart,
+    # so a fleet's status calls are spread over the interval instead of all landing at once.
+    fraction = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big') / 2 ** 64
+    return fraction * jitter_fraction * interval
@@ -1,5 +1,15 @@
+import os
+import sys
 import json
-from functools import lru_cache 
+import pathlib
+from collections.abc import Mapping
+
+# Local imports
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+from metric_window import validate_aggregate
+
+
+_current_config = None # Last compiled Config, for get().
 
 
 def _read_config(file):
@@ -31,20 +41,25 @@ def _write_config(file, data):
         print(f'Unable to write config file - {file}, error - {e}')
     return 
                
-@lru_cache
+def write_effective_config(config, file='etc/configs.cfg'):
+    # Debug aid only, nothing reads this file back.
+    _write_config(file, {name: list(value) if isinstance(value, tuple) else value for name, value in config.items()})
+
 def get(name):
-    configs = _read_config('etc/configs.cfg')
-    return configs.get(name)
+    return _current_config.get(name) if _current_config else None
 
-def settings(sys_config, user_config=None):
+def compile_config(sys_config, user_config=None):
+    global _current_config
     configs = _read_config(sys_config)
     if user_config:
         user_config = _read_config(user_config)
         for key, value in user_config.items():
             configs[key] = value
-    configs = _polish_values(configs)
-    _write_config('etc/configs.cfg', configs)
-    return configs
+    _current_config = Config(_polish_values(configs))
+    return _current_config
+
+def settings(sys_config, user_config=None):
+    return compile_config(sys_config, user_config).as_settings()
 
 def _polish_values(data):
     result = {}
@@ -65,4 +80,239 @@ def _polish_values(data):
             if ( value.startswith('[') and value.endswith(']') ) or ( value.startswith('(') and value.endswith(')') ) or ( value.startswith('{') and value.endswith('}') ):
                 value = json.loads(value)
         result[key] = value
-    return result  
+    return result
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def _is_aggregate(value):
+    try:
+        validate_aggregate(value)
+    except ValueError:
+        return False
+    return True
+
+def _is_policy_list(value):
+    names = set()
+    for policy in value:
+        if not isinstance(policy, dict) or set(policy) != {'name', 'key', 'scale_out_target', 'scale_in_target'}:
+            return False
+        name, key, scale_out_target, scale_in_target = policy['name'], policy['key'], policy['scale_out_target'], policy['scale_in_target']
+        if not isinstance(name, str) or not name or name == 'cpu' or name in names or not isinstance(key, str) or not key:
+            return False
+        if any(isinstance(target, bool) or not isinstance(target, (int, float)) for target in (scale_out_target, scale_in_target)):
+            return False
+        if not 0 < scale_in_target <= scale_out_target:
+            return False
+        names.add(name)
+    return True
+
+# name: (type, check, what the check expects). Int values are accepted for float settings.
+_FRACTION = (float, lambda value: 0 < value <= 1, 'a number in (0, 1]')
+_WEIGHT = (float, lambda value: 0 <= value <= 1, 'a number in [0, 1]')
+_SECONDS = ((int, float), lambda value: value >= 0, 'a number of seconds >= 0')
+_INTERVAL = ((int, float), lambda value: value > 0, 'a number of seconds > 0')
+_COUNT = (int, lambda value: value >= 0, 'an integer >= 0')
+_POSITIVE_COUNT = (int, lambda value: value >= 1, 'an integer >= 1')
+_FLAG = (bool, None, 'True or False')
+_TEXT = (str, lambda value: bool(value), 'a non-empty string')
+_OPTIONAL_TEXT = (str, None, 'a string')
+_COOLDOWN = ((int, float), lambda value: value >= 0 or value == -1, 'a number of seconds >= 0, or -1 for cool_down_time_seconds')
+_AGGREGATE = (str, _is_aggregate, 'last, mean, ewma, max or a percentile like p90')
+SCHEMA = {
+    'target_avg_cpu_utilization_for_scale_out': _FRACTION,
+    'target_avg_cpu_utilization_for_scale_in': _FRACTION,
+    'autoscale_engine_runs_every': _INTERVAL,
+    'cool_down_time_seconds': _SECONDS,
+    'scale_out_cool_down_time_seconds': _COOLDOWN,
+    'scale_in_cool_down_time_seconds': _COOLDOWN,
+    'emergency_scale_out_utilization': _WEIGHT,
+    'max_scale_step': _COUNT,
+    'max_scale_step_percent': ((int, float), lambda value: value >= 0, 'a percentage >= 0'),
+    'tick_jitter_fraction': _WEIGHT,
+    'scale_out_metric_aggregate': _AGGREGATE,
+    'scale_out_metric_window': _POSITIVE_COUNT,
+    'scale_in_metric_aggregate': _AGGREGATE,
+    'scale_in_metric_window': _POSITIVE_COUNT,
+    'metric_ewma_alpha': _FRACTION,
+    'predictive_scaling': _FLAG,
+    'predictive_horizon_seconds': _SECONDS,
+    'forecast_alpha': _WEIGHT,
+    'forecast_beta': _WEIGHT,
+    'forecast_gamma': _WEIGHT,
+    'forecast_season_seconds': _SECONDS,
+    'forecast_warmup_samples': _COUNT,
+    'actuation_converge_timeout_seconds': _SECONDS,
+    'replica_startup_seconds': _SECONDS,
+    'cooldown_lock_file': _TEXT,
+    'max_replicas': _COUNT,
+    'min_replicas': _COUNT,
+    'log_dir': _TEXT,
+    'log_file': _TEXT,
+    'debug_logs': _FLAG,
+    'log_async': _FLAG,
+    'log_format': (str, lambda value: value in ('text', 'json'), 'text or json'),
+    'graph_kpi_period': _INTERVAL,
+    'graph_window_samples': _POSITIVE_COUNT,
+    'sample_feed_size': _POSITIVE_COUNT,
+    'history_dir': _OPTIONAL_TEXT,
+    'history_retention_seconds': _SECONDS,
+    'history_compact_every_seconds': _INTERVAL,
+    'metrics_host': _TEXT,
+    'metrics_port': (int, lambda value: 0 <= value < 65536, 'a port number, or 0 to disable'),
+    'app_status_port': (int, lambda value: 0 < value < 65536, 'a port number'),
+    'app_status_host': _TEXT,
+    'app_status_read_url': _TEXT,
+    'app_replica_update_url': _TEXT,
+    'read_metrics_key': _TEXT,
+    'read_replicas_key': _TEXT,
+    'scaling_policies': (tuple, _is_policy_list, 'a list of {"name", "key", "scale_out_target", "scale_in_target"} objects with unique names (not cpu) and 0 < scale_in_target <= scale_out_target'),
+    'app_status_secure': _FLAG,
+    'app_connection_timeout': _INTERVAL,
+    'app_connection_pool_size': _POSITIVE_COUNT,
+    'retry_on_http_codes': (tuple, lambda value: all(code in (1, 2, 3, 4, 5) for code in value), 'a list of HTTP status classes like [5, 4]'),
+    'retry_on_connection_error': _FLAG,
+    'retry_after_seconds': _SECONDS,
+    'retry_exponentially': _FLAG,
+    'retry_add_randomness': _FLAG,
+    'api_retries_count': _POSITIVE_COUNT,
+    'api_tick_budget_seconds': _SECONDS,
+    'circuit_breaker_failure_rate': _FRACTION,
+    'circuit_breaker_window': _POSITIVE_COUNT,
+    'circuit_breaker_min_calls': _POSITIVE_COUNT,
+    'circuit_breaker_open_seconds': _SECONDS,
+    'push_ingestion': _FLAG,
+    'push_host': _TEXT,
+    'push_http_port': (int, lambda value: 0 <= value < 65536, 'a port number, or 0 to disable'),
+    'push_udp_port': (int, lambda value: 0 <= value < 65536, 'a port number, or 0 to disable'),
+    'push_debounce_seconds': _SECONDS,
+    'push_stale_after_seconds': _SECONDS,
+    'fleet_apps_file': _TEXT,
+    'fleet_max_in_flight_requests': _POSITIVE_COUNT,
+    'fleet_max_threads': _POSITIVE_COUNT,
+    'shard_dir': _OPTIONAL_TEXT,
+    'shard_worker_id': _OPTIONAL_TEXT,
+    'shard_virtual_nodes': _POSITIVE_COUNT,
+}
+
+
+def _compile_value(name, value):
+    kind, check, expected = SCHEMA[name]
+    if kind is float and isinstance(value, int) and not isinstance(value, bool):
+        value = float(value)
+    elif kind is int and isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif kind is tuple and isinstance(value, list):
+        value = tuple(value)
+    if isinstance(value, bool) and kind is not bool or not isinstance(value, kind) or check and not check(value):
+        raise ConfigError(f'{name} must be {expected}, got {value!r}')
+    return value
+
+def _compile_values(values):
+    compiled = {}
+    errors = []
+    for name, value in values.items():
+        if name == 'config' or hasattr(Config, name):
+            errors.append(f'{name} is not a valid setting name')
+            continue
+        try:
+            compiled[name] = _compile_value(name, value) if name in SCHEMA else value
+        except ConfigError as e:
+            errors.append(str(e))
+    missing = [name for name in SCHEMA if name not in values]
+    if missing:
+        errors.append(f'missing settings {missing}')
+    elif not errors:
+        if compiled['min_replicas'] > compiled['max_replicas']:
+            errors.append(f'min_replicas ({compiled["min_replicas"]}) is greater than max_replicas ({compiled["max_replicas"]})')
+        if compiled['target_avg_cpu_utilization_for_scale_in'] > compiled['target_avg_cpu_utilization_for_scale_out']:
+            errors.append('target_avg_cpu_utilization_for_scale_in is greater than target_avg_cpu_utilization_for_scale_out')
+        if compiled['emergency_scale_out_utilization'] and compiled['emergency_scale_out_utilization'] <= compiled['target_avg_cpu_utilization_for_scale_out']:
+            errors.append('emergency_scale_out_utilization is not above target_avg_cpu_utilization_for_scale_out')
+        if compiled['circuit_breaker_min_calls'] > compiled['circuit_breaker_window']:
+            errors.append('circuit_breaker_min_calls is greater than circuit_breaker_window, the breaker could never open')
+    if errors:
+        raise ConfigError('Invalid configuration: ' + '; '.join(errors))
+    return compiled
+
+
+class Config(Mapping):
+    # The merged system + user settings, type-checked and validated once. Every setting is a plain attribute
+    # (config.max_replicas) and also readable as a mapping; a Config can not be changed, a config change
+    # compiles a new one.
+    def __init__(self, values):
+        self.__dict__.update(_compile_values(values))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Config is read-only, compile a new one instead.')
+
+    def __delattr__(self, name):
+        raise AttributeError('Config is read-only, compile a new one instead.')
+
+    def __getitem__(self, name):
+        return self.__dict__[name]
+
+    def __iter__(self):
+        return iter(self.__dict__)
+
+    def __len__(self):
+        return len(self.__dict__)
+
+    def __repr__(self):
+        return f'Config({self.__dict__})'
+
+    def merged(self, overrides):
+        return Config({**self.__dict__, **overrides})
+
+    def as_settings(self, previous=None):
+        # The mutable settings dict the tick functions work with: this config's values, the config itself
+        # under 'config', and the live objects (logger, state store, API client, metric windows, ...)
+        # carried over from the settings dict of the previous config.
+        settings = {}
+        if previous:
+            previous_config = previous.get('config') or {}
+            settings.update((name, value) for name, value in previous.items() if name not in previous_config)
+        settings.update(self.__dict__)
+        settings['config'] = self
+        return settings
+
+
+class ConfigWatcher:
+    # Polls the mtime of the config files, a stat per file per tick. A change is compiled into a new Config,
+    # the caller swaps it in between ticks. An invalid change is reported once and the current config is kept.
+    def __init__(self, sys_config, user_config=None):
+        self.sys_config = sys_config
+        self.user_config = user_config
+        self.mtimes = self._mtimes()
+        self.config = compile_config(sys_config, user_config)
+
+    def _mtimes(self):
+        mtimes = []
+        for file in (self.sys_config, self.user_config):
+            try:
+                mtimes.append(os.stat(file).st_mtime_ns if file else None)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def poll(self, log=None):
+        mtimes = self._mtimes()
+        if mtimes == self.mtimes:
+            return None
+        # Taken before reading, a write that is still going on shows up as another change on the next poll.
+        self.mtimes = mtimes
+        try:
+            config = compile_config(self.sys_config, self.user_config)
+        except ConfigError as e:
+            if log:
+                log.error(f'Configuration change rejected, keeping the current configuration. {e}')
+            return None
+        changed = sorted(name for name in set(config) | set(self.config) if config.get(name) != self.config.get(name))
+        if not changed:
+            return None
+        if log:
+            log.warning(f'Configuration reloaded, changed settings: {changed}')
+        self.config = config
+        return config
@@ -0,0 +1,180 @@
+import os
+import sys
+import bisect
+import socket
+import hashlib
+import pathlib
+from urllib.parse import quote, unquote
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Local imports
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+import scale_state
+import metrics
+
+
+WORKERS = 'workers'
+APPS = 'apps'
+
+
+def _hash(key):
+    # Stable across processes and hosts, unlike hash().
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    # Every worker is placed on the ring virtual_nodes times, an app belongs to the first worker point at or
+    # after its own hash. A worker joining or leaving only moves the apps next to its points, about 1/N of them.
+    def __init__(self, workers, virtual_nodes=64):
+        points = sorted((_hash(f'{worker}#{index}'), worker) for worker in workers for index in range(virtual_nodes))
+        self.hashes = [point for point, _ in points]
+        self.workers = [worker for _, worker in points]
+
+    def owner(self, key):
+        if not self.workers:
+            return None
+        return self.workers[bisect.bisect_left(self.hashes, _hash(key)) % len(self.workers)]
+
+
+class FileLeaseBackend:
+    # Leases are flock()s on files in a directory every worker shares. The kernel drops the locks of a process
+    # that dies, so its leases are free right away; a live worker keeps them however slow it is, so no lease is
+    # ever held twice. Any object with the same acquire/release/live methods can replace this backend.
+    def __init__(self, directory):
+        if fcntl is None:
+            raise RuntimeError('Sharded mode needs flock, it is not available on this platform.')
+        self.directory = directory
+        self.held = {}
+        for kind in (WORKERS, APPS):
+            os.makedirs(os.path.join(directory, kind), exist_ok=True)
+
+    def _path(self, kind, name):
+        return os.path.join(self.directory, kind, quote(name, safe=''))
+
+    def acquire(self, kind, name):
+        if (kind, name) in self.held:
+            return True
+        path = self._path(kind, name)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        try:
+            linked = os.stat(path).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            linked = False
+        if not linked:
+            # The file was removed (after its holder died) between the open and the flock, the lock is on nothing.
+            os.close(fd)
+            return False
+        self.held[(kind, name)] = fd
+        return True
+
+    def release(self, kind, name):
+        fd = self.held.pop((kind, name), None)
+        if fd is not None:
+            os.close(fd)
+
+    def is_held(self, kind, name):
+        if (kind, name) in self.held:
+            return True
+        try:
+            fd = os.open(self._path(kind, name), os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+        return False
+
+    def live(self, kind):
+        # The names whose lease is held right now. The file of a dead holder is removed, under its lease.
+        names = []
+        for file_name in os.listdir(os.path.join(self.directory, kind)):
+            name = unquote(file_name)
+            if self.is_held(kind, name):
+                names.append(name)
+            elif self.acquire(kind, name):
+                os.unlink(self._path(kind, name))
+                self.release(kind, name)
+        return names
+
+
+class ShardCoordinator:
+    # One per worker. A worker is live while it holds the lease on its own name under WORKERS, and the apps are
+    # split between the live workers with a HashRing. A worker only ticks the apps it holds the lease of under
+    # APPS: it lets go of the ones the ring gave to someone else, and takes the ones the ring gives to it once
+    # their previous owner has let go (or died). rebalance() runs before every tick, so a dead worker's apps
+    # are taken over within one interval.
+    def __init__(self, backend, worker_id, virtual_nodes=64, log=None, scaler_metrics=None):
+        self.backend = backend
+        self.worker_id = worker_id
+        self.virtual_nodes = virtual_nodes
+        self.log = log
+        self.metrics = scaler_metrics
+        self.owned = set()
+
+    def rebalance(self, app_names):
+        # Returns the apps this worker controls now, and the ones among them it has just taken the lease of.
+        if not self.backend.acquire(WORKERS, self.worker_id):
+            # Only possible with two workers started with the same shard_worker_id, the app leases still keep them apart.
+            self.log.error('Worker id %s is already in use by another worker.', self.worker_id)
+        workers = self.backend.live(WORKERS)
+        if self.worker_id not in workers:
+            workers.append(self.worker_id)
+        ring = HashRing(workers, self.virtual_nodes)
+        assigned = {app_name for app_name in app_names if ring.owner(app_name) == self.worker_id}
+        for app_name in self.owned - assigned:
+            self.backend.release(APPS, app_name)
+            self.log.info('Handing app %s over to worker %s', app_name, ring.owner(app_name))
+        self.owned &= assigned
+        taken_over = set()
+        for app_name in sorted(assigned - self.owned):
+            if self.backend.acquire(APPS, app_name):
+                self.owned.add(app_name)
+                taken_over.add(app_name)
+                self.log.info('Worker %s took over app %s', self.worker_id, app_name)
+            else:
+                self.log.info('App %s is assigned to worker %s, waiting for its previous owner to let go.', app_name, self.worker_id)
+        if self.metrics:
+            self.metrics.owned_apps.set((self.worker_id,), len(self.owned))
+            if taken_over:
+                self.metrics.shard_takeovers.inc((self.worker_id,), len(taken_over))
+        return set(self.owned), taken_over
+
+    def close(self):
+        for app_name in self.owned:
+            self.backend.release(APPS, app_name)
+        self.owned = set()
+        self.backend.release(WORKERS, self.worker_id)
+
+
+def get_coordinator(settings):
+    # None unless shard_dir is set.
+    coordinator = settings.get('shard_coordinator')
+    if coordinator is None and settings.get('shard_dir'):
+        worker_id = settings.get('shard_worker_id') or f'{socket.gethostname()}-{os.getpid()}'
+        coordinator = ShardCoordinator(FileLeaseBackend(settings.get('shard_dir')), worker_id, virtual_nodes=settings.get('shard_virtual_nodes'),
+                                       log=settings.get('log'), scaler_metrics=metrics.get_metrics(settings))
+        settings['shard_coordinator'] = coordinator
+    return coordinator
+
+def claim_apps(apps, settings):
+    # The app settings this worker may tick now, all of them without sharding. An app whose lease was just
+    # taken continues from the cooldown state its previous owner recorded.
+    coordinator = get_coordinator(settings)
+    if coordinator is None:
+        return apps
+    owned, taken_over = coordinator.rebalance([app_settings.get('app_name') or scale_state.DEFAULT_APP_NAME for app_settings in apps])
+    store = scale_state.get_store(settings)
+    for app_name in taken_over:
+        store.refresh(app_name)
+    return [app_settings for app_settings in apps if (app_settings.get('app_name') or scale_state.DEFAULT_APP_NAME) in owned]
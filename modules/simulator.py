@@ -0,0 +1,176 @@
+import sys
+import csv
+import json
+import math
+import logging
+import pathlib
+import itertools
+import numpy as np
+
+# Local imports
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+import app_autoscale
+import history
+
+
+# target_avg_cpu_utilization_for_scale_in is left out, the decision does not depend on it.
+SWEEP_SETTINGS = ('target_avg_cpu_utilization_for_scale_out', 'cool_down_time_seconds', 'autoscale_engine_runs_every', 'min_replicas', 'max_replicas')
+SCALE_OUT = 1
+SCALE_IN = -1
+
+
+def load_trace(trace_file):
+    # A trace is a list of samples with a timestamp (seconds), the avg cpu and the replica count seen at that time.
+    if str(trace_file).endswith('.bin'):
+        records = history.read_records(trace_file)
+        return {'timestamp': records['time'], 'cpu': records['cpu'].astype(float), 'replicas': records['replicas'].astype(int)}
+    if str(trace_file).endswith('.jsonl'):
+        with open(trace_file) as fh:
+            rows = [json.loads(line) for line in fh if line.strip()]
+    else:
+        with open(trace_file, newline='') as fh:
+            rows = list(csv.DictReader(fh))
+    timestamps = np.array([float(row['timestamp']) for row in rows])
+    order = np.argsort(timestamps, kind='stable')
+    return {
+        'timestamp': timestamps[order],
+        'cpu': np.array([float(row['cpu']) for row in rows])[order],
+        'replicas': np.array([int(row['replicas']) for row in rows])[order],
+    }
+
+def _sample_durations(timestamps):
+    # Each sample lasts until the next one, the last sample lasts as long as a typical sample.
+    if len(timestamps) < 2:
+        return np.ones(len(timestamps))
+    durations = np.diff(timestamps)
+    return np.append(durations, np.median(durations))
+
+def _silent_settings(settings):
+    replay_settings = dict(settings)
+    silent_log = logging.getLogger(f'{__name__}.silent')
+    silent_log.disabled = True
+    replay_settings['log'] = silent_log
+    # A replay starts with empty metric windows and a new forecast.
+    replay_settings['metric_windows'] = None
+    replay_settings['forecaster'] = None
+    return replay_settings
+
+def replay(trace, settings):
+    # Replays the trace through app_autoscale.decide_tick_replicas, so metric windows and the forecast apply as
+    # in the control loop. The recorded load (cpu * replicas) is treated as the demand, so the simulated cpu is
+    # that demand spread over the simulated replicas.
+    replay_settings = _silent_settings(settings)
+    target = replay_settings.get('target_avg_cpu_utilization_for_scale_out')
+    autoscale_engine_runs_every = replay_settings.get('autoscale_engine_runs_every')
+    timestamps = trace['timestamp']
+    demand = trace['cpu'] * trace['replicas']
+    durations = _sample_durations(timestamps)
+    replicas = int(trace['replicas'][0]) if len(timestamps) else 0
+    next_tick = timestamps[0] if len(timestamps) else 0
+    last_action_time = None
+    last_direction = 0
+    replica_seconds = 0.0
+    seconds_above_target = 0.0
+    scale_actions = 0
+    flaps = 0
+    ticks = []
+    for n, now in enumerate(timestamps):
+        if now >= next_tick:
+            next_tick = now + autoscale_engine_runs_every
+            current_cpu_utilization = demand[n] / replicas if replicas else 0.0
+            # Same guards as the control loop: no decision on empty stats or while the cooldown of the action
+            # (scale-out or scale-in) is running, unless the reading calls for an emergency scale-out.
+            if current_cpu_utilization and replicas:
+                target_replicas_count = app_autoscale.decide_tick_replicas(replicas, current_cpu_utilization, replay_settings)
+                action = 'scale-out' if target_replicas_count > replicas else 'scale-in'
+                cooling_down = (last_action_time is not None and math.floor(now - last_action_time) < app_autoscale.cool_down_time_seconds_for(action, replay_settings)
+                                and not app_autoscale.is_emergency_scale_out(action, current_cpu_utilization, replay_settings))
+                if target_replicas_count != replicas and not cooling_down:
+                    direction = SCALE_OUT if target_replicas_count > replicas else SCALE_IN
+                    if last_direction and direction != last_direction:
+                        flaps += 1
+                    ticks.append({'timestamp': float(now), 'cpu': float(current_cpu_utilization), 'replicas': replicas, 'desired': target_replicas_count})
+                    replicas = target_replicas_count
+                    last_action_time = now
+                    last_direction = direction
+                    scale_actions += 1
+            else:
+                app_autoscale.skip_forecast(replay_settings)
+        replica_seconds += replicas * durations[n]
+        if demand[n] > target * replicas:
+            seconds_above_target += durations[n]
+    return {
+        'replica_hours': replica_seconds / 3600,
+        'time_above_target_seconds': seconds_above_target,
+        'scale_actions': scale_actions,
+        'flaps': flaps,
+        'actions': ticks,
+    }
+
+def parameter_grid(grid, settings):
+    # Cartesian product of the swept settings, settings that are not swept keep their configured value.
+    unknown_settings = set(grid) - set(SWEEP_SETTINGS)
+    if unknown_settings:
+        raise ValueError(f'Settings {sorted(unknown_settings)} can not be swept, use any of {SWEEP_SETTINGS}')
+    values = [grid.get(name, [settings.get(name)]) for name in SWEEP_SETTINGS]
+    combinations = np.array(list(itertools.product(*values)), dtype=float)
+    return {name: combinations[:, n] for n, name in enumerate(SWEEP_SETTINGS)}
+
+def sweep(trace, grid, settings):
+    params = parameter_grid(grid, settings)
+    target = params['target_avg_cpu_utilization_for_scale_out']
+    cool_down_time_seconds = params['cool_down_time_seconds']
+    autoscale_engine_runs_every = params['autoscale_engine_runs_every']
+    min_replicas = params['min_replicas']
+    max_replicas = params['max_replicas']
+    combinations = len(target)
+    timestamps = trace['timestamp']
+    demand = trace['cpu'] * trace['replicas']
+    durations = _sample_durations(timestamps)
+    replicas = np.full(combinations, trace['replicas'][0] if len(timestamps) else 0, dtype=float)
+    next_tick = np.full(combinations, timestamps[0] if len(timestamps) else 0, dtype=float)
+    last_action_time = np.full(combinations, -np.inf)
+    last_direction = np.zeros(combinations)
+    # Replica-seconds are settled only when the replica count changes, and the demand above which a
+    # combination runs hot only changes with it, so samples without a due tick stay cheap.
+    replicas_since = np.full(combinations, timestamps[0] if len(timestamps) else 0, dtype=float)
+    replica_seconds = np.zeros(combinations)
+    hot_demand = target * replicas
+    seconds_above_target = np.zeros(combinations)
+    scale_actions = np.zeros(combinations, dtype=int)
+    flaps = np.zeros(combinations, dtype=int)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for n, now in enumerate(timestamps):
+            if now >= next_tick.min():
+                # Full width masked arithmetic is cheaper than gathering the due combinations for every sample.
+                due = now >= next_tick
+                next_tick = np.where(due, now + autoscale_engine_runs_every, next_tick)
+                current_cpu_utilization = demand[n] / replicas
+                active = due & (replicas > 0) & (current_cpu_utilization > 0) & (np.floor(now - last_action_time) >= cool_down_time_seconds)
+                active = np.flatnonzero(active)
+                desired = app_autoscale.decide_replicas_batch(replicas[active], current_cpu_utilization[active], min_replicas[active], max_replicas[active], target[active])
+                changed = desired != replicas[active]
+                if changed.any():
+                    acted = active[changed]
+                    current, desired = replicas[acted], desired[changed]
+                    direction = np.sign(desired - current)
+                    flapped = (last_direction[acted] != 0) & (direction != last_direction[acted])
+                    flaps[acted[flapped]] += 1
+                    scale_actions[acted] += 1
+                    replica_seconds[acted] += current * (now - replicas_since[acted])
+                    replicas_since[acted] = now
+                    replicas[acted] = desired
+                    hot_demand[acted] = target[acted] * desired
+                    last_action_time[acted] = now
+                    last_direction[acted] = direction
+            seconds_above_target[demand[n] > hot_demand] += durations[n]
+    end_of_trace = timestamps[-1] + durations[-1] if len(timestamps) else 0
+    replica_seconds += replicas * (end_of_trace - replicas_since)
+    results = dict(params)
+    results.update({
+        'replica_hours': replica_seconds / 3600,
+        'time_above_target_seconds': seconds_above_target,
+        'scale_actions': scale_actions,
+        'flaps': flaps,
+    })
+    return results
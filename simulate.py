@@ -0,0 +1,44 @@
+import json
+import argparse
+import numpy as np
+
+# Local imports
+import modules.simulator as simulator
+import modules.settings as settings
+import modules.history as history
+
+
+configs =  settings.settings(sys_config='etc/system_settings.cfg', user_config='etc/user_settings.cfg')
+REPORT_COLUMNS = ('replica_hours', 'time_above_target_seconds', 'scale_actions', 'flaps')
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded CPU/replica trace through the auto-scaler decision logic.')
+    parser.add_argument('trace_file', help='CSV or JSONL file with timestamp, cpu and replicas columns, or a history .bin file.')
+    parser.add_argument('--sweep', dest='grid_file', help='JSON file mapping settings to lists of values to sweep.')
+    parser.add_argument('--sort-by', default='replica_hours', choices=REPORT_COLUMNS)
+    parser.add_argument('--top', type=int, default=20, help='Number of sweep results to print.')
+    parser.add_argument('--export', dest='csv_file', help='Write the records of a history .bin file to this CSV file and exit.')
+    args = parser.parse_args()
+    if args.csv_file:
+        history.export_csv(history.read_records(args.trace_file), args.csv_file)
+        return
+    trace = simulator.load_trace(args.trace_file)
+    if not args.grid_file:
+        result = simulator.replay(trace, configs)
+        for name in REPORT_COLUMNS:
+            print(f'{name}: {round(float(result[name]), 2)}')
+        return
+    with open(args.grid_file) as fh:
+        grid = json.load(fh)
+    results = simulator.sweep(trace, grid, configs)
+    swept_settings = [name for name in simulator.SWEEP_SETTINGS if name in grid]
+    columns = swept_settings + list(REPORT_COLUMNS)
+    print('\t'.join(columns))
+    for n in np.argsort(results[args.sort_by], kind='stable')[:args.top]:
+        print('\t'.join(str(round(float(results[name][n]), 2)) for name in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import time
+import threading
+import unittest
+import tempfile
+import logging
+import sys
+import pathlib
+from unittest.mock import patch, Mock
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+import modules.app_autoscale as app_autoscale
+import modules.actuator as actuator
+import modules.settings as settings
+
+configs =  settings.settings(sys_config=parent_dir + '/etc/system_settings.cfg', user_config=parent_dir + '/etc/user_settings.cfg')
+log = logging.getLogger(__name__)
+log.disabled = True
+configs['log'] = log
+
+
+class TestActuator(unittest.TestCase):
+
+    def test_identical_and_superseded_targets_are_coalesced(self):
+        app_actuator = actuator.Actuator()
+        release = threading.Event()
+        sent = []
+        def slow_send(replicas):
+            sent.append(replicas)
+            release.wait(2)
+            return True
+        first = threading.Thread(target=app_actuator.submit, args=(12, slow_send))
+        first.start()
+        while not sent:
+            time.sleep(0.001)
+        self.assertEqual(app_actuator.submit(14, slow_send), actuator.QUEUED)
+        self.assertEqual(app_actuator.submit(16, slow_send), actuator.QUEUED)
+        release.set()
+        first.join()
+        self.assertEqual(sent, [12, 16])
+        self.assertEqual(app_actuator.submit(16, slow_send), actuator.COALESCED)
+        self.assertEqual(sent, [12, 16])
+
+    def test_check_waits_for_target_and_start_up(self):
+        app_actuator = actuator.Actuator()
+        self.assertIsNone(app_actuator.check(10, 60))
+        app_actuator.submit(12, lambda replicas: True, settle_seconds=0.05)
+        self.assertEqual(app_actuator.check(10, 60), actuator.CONVERGING)
+        self.assertEqual(app_actuator.check(12, 60), actuator.CONVERGING)
+        time.sleep(0.06)
+        self.assertEqual(app_actuator.check(12, 60), actuator.CONVERGED)
+        app_actuator.submit(14, lambda replicas: True)
+        self.assertEqual(app_actuator.check(12, 0), actuator.TIMED_OUT)
+        self.assertIsNone(app_actuator.check(12, 0))
+
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
+    def test_tick_does_not_decide_on_stale_replicas(self, mocked_get, mocked_put):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tick_configs = dict(configs)
+            tick_configs['cooldown_lock_file'] = tmp_dir + '/cooldown.lock'
+            tick_configs['cool_down_time_seconds'] = 0
+            mocked_put.return_value = Mock(status_code=204)
+            mocked_get.return_value = Mock(status_code=200, json=Mock(return_value={ "cpu": { "highPriority": 0.90 }, "replicas": 10 }))
+            self.assertEqual(app_autoscale.autoscale_tick(tick_configs), 12)
+            # The platform still reports 10 replicas, without the actuator this would scale out again.
+            self.assertEqual(app_autoscale.autoscale_tick(tick_configs), 10)
+            mocked_put.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
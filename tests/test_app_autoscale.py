@@ -1,6 +1,11 @@
+import math
+import logging
+import random
 import unittest
+import tempfile
 import sys
 import pathlib
+from unittest.mock import patch, Mock
 parent_dir = str(pathlib.Path(__file__).parent.parent)
 sys.path.insert(0, parent_dir)
 import modules.app_autoscale as app_autoscale
@@ -10,6 +15,27 @@ from modules.logger import get_logger
 configs =  settings.settings(sys_config=parent_dir + '/etc/system_settings.cfg', user_config=parent_dir + '/etc/user_settings.cfg')
 log =  get_logger(logger_name=__name__, settings=configs)
 configs['log'] = log
+silent_log = logging.getLogger(f'{__name__}.silent')
+silent_log.disabled = True
+
+
+def _walk_scale_in(desired_replicas_count, current_replica_count, current_cpu_utilization, target):
+    # The original one replica at a time anti-flapping walk, kept as the reference.
+    current_cpu_utilization_total = current_cpu_utilization * current_replica_count
+    while desired_replicas_count < current_replica_count:
+        if round(current_cpu_utilization_total / desired_replicas_count, 2) >= target:
+            desired_replicas_count = desired_replicas_count + 1
+        else:
+            return desired_replicas_count
+    return None
+
+def _random_cases(count, seed=3):
+    rng = random.Random(seed)
+    for _ in range(count):
+        current = rng.randint(1, 1000)
+        cpu = round(rng.uniform(0.01, 1.0), rng.choice([2, 3, 6]))
+        target = rng.choice([0.3, 0.5, 0.55, 0.7, 0.75, 0.8, 0.95, 0.5922, 0.821, 0.855, 0.333])
+        yield current, cpu, target
 
 
 class TestAppAutoScale(unittest.TestCase):
@@ -23,6 +49,78 @@ class TestAppAutoScale(unittest.TestCase):
         max_replicas = configs.get('max_replicas')
         replicas = app_autoscale.scale_app_replicas(current_replica_count=max_replicas, current_cpu_utilization=0.80, settings=configs, dry_run=False)
         self.assertEqual(replicas, max_replicas)
+
+    def test_flap_safe_scale_in_count_matches_walk(self):
+        for current, cpu, target in _random_cases(3000):
+            for desired in (1, max(1, math.ceil(current * (cpu / target))), max(1, current // 2)):
+                self.assertEqual(app_autoscale.flap_safe_scale_in_count(desired, current, cpu, target), _walk_scale_in(desired, current, cpu, target))
+        # Targets with more than 2 decimals, the projection is still compared rounded to 2.
+        for desired, current, cpu, target in ((3231, 3864, 0.5005, 0.5922), (2090, 4403, 0.5735, 0.821)):
+            self.assertEqual(app_autoscale.flap_safe_scale_in_count(desired, current, cpu, target), _walk_scale_in(desired, current, cpu, target))
+            self.assertEqual(app_autoscale.decide_replicas_batch([current], [cpu], 1, 10000, [target])[0], _walk_scale_in(math.ceil(current * (cpu / target)), current, cpu, target))
+
+    def test_decide_replicas_batch_matches_scalar(self):
+        cases = list(_random_cases(5000, seed=5))
+        min_replicas = [1 + n % 3 for n in range(len(cases))]
+        max_replicas = [1000 - n % 7 for n in range(len(cases))]
+        batch = app_autoscale.decide_replicas_batch([c[0] for c in cases], [c[1] for c in cases], min_replicas, max_replicas, [c[2] for c in cases])
+        for n, (current, cpu, target) in enumerate(cases):
+            app_configs = dict(configs)
+            app_configs['log'] = silent_log
+            app_configs.update({'min_replicas': min_replicas[n], 'max_replicas': max_replicas[n], 'target_avg_cpu_utilization_for_scale_out': target})
+            self.assertEqual(batch[n], app_autoscale.decide_replicas(current, cpu, app_configs))
+
+    def test_decide_replicas_with_scaling_policies(self):
+        policy_configs = dict(configs)
+        policy_configs['log'] = silent_log
+        policy_configs['scaling_policies'] = ({ "name": "memory", "key": "memory.utilization", "scale_out_target": 0.85, "scale_in_target": 0.6 },)
+        # Scale-out follows the metric that needs the most replicas.
+        self.assertEqual(app_autoscale.decide_replicas(10, 0.40, policy_configs, policy_values={ "memory": 0.95 }), 12)
+        # Scale-in only as far as every metric stays below its scale-out target.
+        self.assertEqual(app_autoscale.decide_replicas(10, 0.40, policy_configs, policy_values={ "memory": 0.50 }), 6)
+        # A metric above its scale-in target, or one that could not be read, blocks the scale-in.
+        self.assertEqual(app_autoscale.decide_replicas(10, 0.40, policy_configs, policy_values={ "memory": 0.70 }), 10)
+        self.assertEqual(app_autoscale.decide_replicas(10, 0.40, policy_configs, policy_values={ "memory": None }), 10)
+
+    @patch('requests.Session.put', return_value=Mock(status_code=204))
+    def test_policy_metrics_are_smoothed(self, mocked_put):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            policy_configs = dict(configs, scale_state=None, actuator=None, metric_windows=None, log=silent_log,
+                                  cooldown_lock_file=tmp_dir + '/cooldown.lock', cool_down_time_seconds=0,
+                                  scale_out_metric_aggregate='mean', scale_out_metric_window=4)
+            policy_configs['scaling_policies'] = ({ "name": "memory", "key": "memory.utilization", "scale_out_target": 0.85, "scale_in_target": 0.6 },)
+            for memory in (0.7, 0.7, 0.7):
+                self.assertEqual(app_autoscale.scale_app_replicas(10, 0.60, policy_configs, dry_run=False, policy_values={ "memory": memory }), 10)
+            # A single 1.0 reading would ask for 12 replicas, the mean of the memory window is 0.775.
+            self.assertEqual(app_autoscale.scale_app_replicas(10, 0.60, policy_configs, dry_run=False, policy_values={ "memory": 1.0 }), 10)
+            mocked_put.assert_not_called()
+
+    def test_decide_replicas_limits_the_step(self):
+        step_configs = dict(configs)
+        step_configs['log'] = silent_log
+        step_configs.update({ "max_scale_step": 3, "max_scale_step_percent": 0 })
+        self.assertEqual(app_autoscale.decide_replicas(10, 1.60, step_configs), 13)
+        self.assertEqual(app_autoscale.decide_replicas(20, 0.20, step_configs), 17)
+        step_configs.update({ "max_scale_step_percent": 10 })
+        self.assertEqual(app_autoscale.decide_replicas(10, 1.60, step_configs), 11)
+        # The min/max limits win over the step size.
+        self.assertEqual(app_autoscale.decide_replicas(1, 0.50, step_configs), configs.get('min_replicas'))
+
+    @patch('requests.Session.put', return_value=Mock(status_code=204))
+    def test_asymmetric_cooldowns_and_emergency_scale_out(self, mocked_put):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cooldown_configs = dict(configs)
+            # Own state store and actuator, not the ones other tests left in the shared configs.
+            cooldown_configs.update({ "scale_state": None, "actuator": None, "metric_windows": None })
+            cooldown_configs.update({ "log": silent_log, "cooldown_lock_file": tmp_dir + '/cooldown.lock', "cool_down_time_seconds": 600,
+                                      "scale_out_cool_down_time_seconds": 0, "scale_in_cool_down_time_seconds": -1, "emergency_scale_out_utilization": 0 })
+            self.assertEqual(app_autoscale.scale_app_replicas(10, 0.20, cooldown_configs, dry_run=False), 5)
+            # Right after a scale-in, another scale-in waits for its cooldown but a scale-out does not.
+            self.assertEqual(app_autoscale.scale_app_replicas(5, 0.10, cooldown_configs, dry_run=False), 5)
+            self.assertEqual(app_autoscale.scale_app_replicas(5, 0.90, cooldown_configs, dry_run=False), 6)
+            cooldown_configs.update({ "scale_out_cool_down_time_seconds": -1, "emergency_scale_out_utilization": 0.95 })
+            self.assertEqual(app_autoscale.scale_app_replicas(6, 0.90, cooldown_configs, dry_run=False), 6)
+            self.assertEqual(app_autoscale.scale_app_replicas(6, 0.97, cooldown_configs, dry_run=False), 8)
         
         
         
@@ -0,0 +1,84 @@
+import time
+import tempfile
+import unittest
+import logging
+import requests
+import sys
+import pathlib
+from unittest.mock import patch, Mock
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+import modules.app_autoscale as app_autoscale
+import modules.circuit_breaker as circuit_breaker
+import modules.settings as settings
+
+configs =  settings.settings(sys_config=parent_dir + '/etc/system_settings.cfg', user_config=parent_dir + '/etc/user_settings.cfg')
+log = logging.getLogger(__name__)
+log.disabled = True
+configs['log'] = log
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_on_failure_rate_and_recovers_through_half_open(self):
+        breaker = circuit_breaker.CircuitBreaker(failure_rate=0.5, window_size=4, min_calls=4, open_seconds=0.05)
+        for success in (True, False, True):
+            breaker.record(success)
+        self.assertEqual(breaker.state, circuit_breaker.CLOSED)
+        breaker.record(False)
+        self.assertEqual(breaker.snapshot()['state'], circuit_breaker.OPEN)
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, circuit_breaker.HALF_OPEN)
+        self.assertFalse(breaker.allow()) # Only one trial call at a time.
+        breaker.record(False)
+        self.assertEqual(breaker.state, circuit_breaker.OPEN)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record(True)
+        self.assertEqual(breaker.snapshot(), {'state': circuit_breaker.CLOSED, 'calls': 0, 'failure_rate': 0.0, 'open_for_seconds': 0})
+
+    @patch('requests.Session.get', side_effect=requests.exceptions.ConnectionError)
+    def test_degraded_api_is_bounded_by_deadline_and_breaker(self, mocked_get):
+        tick_configs = dict(configs)
+        tick_configs.update({'api_retries_count': 5, 'retry_after_seconds': 0.2, 'retry_exponentially': False,
+                             'retry_add_randomness': False, 'api_tick_budget_seconds': 0.5, 'circuit_breaker_min_calls': 3})
+        started = time.monotonic()
+        self.assertIsNone(app_autoscale.autoscale_tick(tick_configs))
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(mocked_get.call_count, 3)
+        status_url = tick_configs['scaleit_client'].status_url
+        self.assertEqual(circuit_breaker.breaker_states(tick_configs)[status_url]['state'], circuit_breaker.OPEN)
+        # While the breaker is open the endpoint is not called at all.
+        self.assertIsNone(app_autoscale.autoscale_tick(tick_configs))
+        self.assertEqual(mocked_get.call_count, 3)
+
+    @patch('requests.Session.put', return_value=Mock(status_code=204))
+    @patch('requests.Session.get')
+    def test_decided_update_is_sent_after_a_slow_status_read(self, mocked_get, mocked_put):
+        def slow_status(*args, **kwargs):
+            time.sleep(0.3)
+            return Mock(status_code=200, json=Mock(return_value={ "cpu": { "highPriority": 0.90 }, "replicas": 10 }))
+        mocked_get.side_effect = slow_status
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tick_configs = dict(configs, scale_state=None, actuator=None, metric_windows=None, scaleit_client=None, circuit_breakers={},
+                                cooldown_lock_file=tmp_dir + '/cooldown.lock', api_tick_budget_seconds=0.2)
+            # The status read used up the whole budget, the scale-out it decided on is still sent.
+            self.assertEqual(app_autoscale.autoscale_tick(tick_configs), 12)
+        mocked_put.assert_called_once()
+
+    def test_reload_with_new_settings_rebuilds_the_breaker(self):
+        breaker_configs = dict(configs, circuit_breakers={})
+        breaker = circuit_breaker.get_breaker(breaker_configs, 'http://app/status')
+        breaker.record(False)
+        self.assertIs(circuit_breaker.get_breaker(dict(breaker_configs), 'http://app/status'), breaker)
+        reloaded = dict(breaker_configs, circuit_breaker_failure_rate=0.9, circuit_breaker_min_calls=2)
+        rebuilt = circuit_breaker.get_breaker(reloaded, 'http://app/status')
+        self.assertIsNot(rebuilt, breaker)
+        self.assertEqual((rebuilt.failure_rate, rebuilt.min_calls), (0.9, 2))
+        self.assertEqual(rebuilt.snapshot()['calls'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
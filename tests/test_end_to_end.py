@@ -0,0 +1,25 @@
+import unittest
+import tempfile
+import sys
+import pathlib
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+import modules.app_autoscale as app_autoscale
+from benchmarks.scaleit_server import ScaleItStandIn, constant_load
+from benchmarks.convergence import benchmark_settings
+
+
+class TestEndToEnd(unittest.TestCase):
+
+    def test_autoscale_tick_against_stand_in(self):
+        with tempfile.TemporaryDirectory() as lock_dir, ScaleItStandIn(constant_load(9), replicas=10) as stand_in:
+            configs = benchmark_settings(stand_in, lock_dir, {'cool_down_time_seconds': 60})
+            self.assertEqual(app_autoscale.autoscale_tick(settings=configs), 12)
+            self.assertEqual(stand_in.replicas(), 12)
+            # The second tick is inside the cooldown period.
+            self.assertEqual(app_autoscale.autoscale_tick(settings=configs), 12)
+            self.assertEqual(stand_in.calls, {'status': 2, 'replicas': 1, 'errors': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
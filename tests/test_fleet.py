@@ -0,0 +1,105 @@
+import time
+import asyncio
+import threading
+import unittest
+import tempfile
+import sys
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, Mock
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+import modules.fleet as fleet
+import modules.settings as settings
+from modules.logger import get_logger
+
+configs =  settings.settings(sys_config=parent_dir + '/etc/system_settings.cfg', user_config=parent_dir + '/etc/user_settings.cfg')
+log =  get_logger(logger_name=__name__, settings=configs)
+configs['log'] = log
+
+
+def _slow_status_response(*args, **kwargs):
+    time.sleep(0.3)
+    mocked_response = Mock()
+    mocked_response.status_code = 200
+    mocked_response.json.return_value = { "cpu": { "highPriority": 0.80 }, "replicas": 10 }
+    return mocked_response
+
+
+class TestFleet(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fleet_configs = dict(configs)
+        self.fleet_configs['cooldown_lock_file'] = self.tmp_dir.name + '/cooldown.lock'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_build_apps_rejects_duplicates(self):
+        with self.assertRaises(ValueError):
+            fleet.build_apps([{ "app_name": "a" }, { "app_name": "a" }], self.fleet_configs)
+        # The cooldown state of every app is in the fleet's one store, an app can not have its own lock file.
+        with self.assertRaises(ValueError):
+            fleet.build_apps([{ "app_name": "a", "cooldown_lock_file": self.tmp_dir.name + '/a.lock' }], self.fleet_configs)
+
+    def test_build_apps_overrides_and_cooldown_per_app(self):
+        apps = fleet.build_apps([{ "app_name": "a", "max_replicas": 7 }, { "app_name": "b" }], self.fleet_configs)
+        self.assertEqual(apps[0].get('max_replicas'), 7)
+        self.assertEqual(apps[1].get('max_replicas'), configs.get('max_replicas'))
+        self.assertIs(apps[0].get('scale_state'), apps[1].get('scale_state'))
+        apps[0].get('scale_state').record_scale_action('a', 'scale-out', 7)
+        self.assertIsNone(apps[1].get('scale_state').last_action_time('b'))
+
+    def test_reload_apps_keeps_overrides_and_state(self):
+        apps = fleet.build_apps([{ "app_name": "a", "max_replicas": 7 }, { "app_name": "b" }], self.fleet_configs)
+        reloaded_config = self.fleet_configs['config'].merged({ "max_replicas": 30, "cool_down_time_seconds": 5 })
+        reloaded = fleet.reload_apps(apps, reloaded_config.as_settings(self.fleet_configs))
+        self.assertEqual(reloaded[0].get('max_replicas'), 7)
+        self.assertEqual(reloaded[1].get('max_replicas'), 30)
+        self.assertEqual(reloaded[0].get('cool_down_time_seconds'), 5)
+        self.assertIs(reloaded[0].get('scale_state'), apps[0].get('scale_state'))
+        self.assertIs(reloaded[1].get('log'), apps[1].get('log'))
+
+    @patch('requests.Session.get', side_effect=_slow_status_response)
+    def test_run_fleet_tick_polls_apps_concurrently(self, mocked_get):
+        apps = fleet.build_apps([{ "app_name": f"app-{n}" } for n in range(20)], self.fleet_configs)
+
+        async def tick():
+            with ThreadPoolExecutor(max_workers=20) as executor:
+                return await fleet.run_fleet_tick(apps, executor, self.fleet_configs)
+
+        started = time.monotonic()
+        results = asyncio.run(tick())
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(mocked_get.call_count, 20)
+        self.assertEqual(results, {f"app-{n}": 10 for n in range(20)})
+
+    def test_request_slots_cap_the_calls_not_the_app_ticks(self):
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+        def status_response(*args, **kwargs):
+            with lock:
+                in_flight.append(1)
+                peak.append(len(in_flight))
+            time.sleep(0.1)
+            with lock:
+                in_flight.pop()
+            return Mock(status_code=200, json=Mock(return_value={ "cpu": { "highPriority": 0.80 }, "replicas": 10 }))
+        self.fleet_configs['fleet_max_in_flight_requests'] = 5
+        apps = fleet.build_apps([{ "app_name": f"app-{n}" } for n in range(20)], self.fleet_configs)
+
+        async def tick():
+            with ThreadPoolExecutor(max_workers=20) as executor:
+                return await fleet.run_fleet_tick(apps, executor, self.fleet_configs)
+
+        with patch('requests.Session.get', side_effect=status_response):
+            results = asyncio.run(tick())
+        self.assertEqual(max(peak), 5)
+        self.assertEqual(len(peak), 20)
+        self.assertEqual(results, {f"app-{n}": 10 for n in range(20)})
+
+
+if __name__ == '__main__':
+    unittest.main()
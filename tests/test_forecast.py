@@ -0,0 +1,76 @@
+import logging
+import unittest
+import tempfile
+import sys
+import pathlib
+from unittest.mock import patch, Mock
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+import modules.app_autoscale as app_autoscale
+import modules.settings as settings
+from modules.forecast import HoltWintersForecaster
+
+configs =  settings.settings(sys_config=parent_dir + '/etc/system_settings.cfg', user_config=parent_dir + '/etc/user_settings.cfg')
+log = logging.getLogger(__name__)
+log.disabled = True
+configs['log'] = log
+
+
+class TestHoltWintersForecaster(unittest.TestCase):
+
+    def test_trend_is_extrapolated(self):
+        forecaster = HoltWintersForecaster(alpha=0.5, beta=0.3)
+        for n in range(200):
+            forecaster.update(10 + 0.5 * n)
+        self.assertAlmostEqual(forecaster.forecast(10), 10 + 0.5 * 209, places=3)
+
+    def test_season_is_learned(self):
+        pattern = [4, 8, 12, 8]
+        forecaster = HoltWintersForecaster(alpha=0.3, beta=0.01, gamma=0.5, season_length=4)
+        for n in range(400):
+            forecaster.update(pattern[n % 4])
+        for steps in range(1, 5):
+            self.assertAlmostEqual(forecaster.forecast(steps), pattern[(400 + steps - 1) % 4], places=1)
+
+
+class TestPredictiveScaling(unittest.TestCase):
+
+    @patch('requests.Session.put', return_value=Mock(status_code=204))
+    def test_scales_out_ahead_of_ramp(self, mocked_put):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            app_configs = dict(configs)
+            app_configs.update({'cooldown_lock_file': tmp_dir + '/cooldown.lock', 'cool_down_time_seconds': 3600, 'min_replicas': 10,
+                                'max_replicas': 100, 'predictive_scaling': True, 'predictive_horizon_seconds': 60,
+                                'autoscale_engine_runs_every': 10, 'forecast_alpha': 0.8, 'forecast_beta': 0.8})
+            # Load grows by 0.5 replicas per tick, the reactive formula alone keeps 10 replicas until 0.8 avg cpu.
+            replicas = None
+            for load in [5.0, 5.5, 6.0, 6.5, 7.0]:
+                replicas = app_autoscale.scale_app_replicas(10, load / 10, app_configs, dry_run=False)
+            self.assertEqual(replicas, 13)
+            self.assertEqual(mocked_put.call_args.kwargs['json'], { "replicas": 13 })
+
+    @patch('requests.Session.put', return_value=Mock(status_code=204))
+    @patch('requests.Session.get')
+    def test_every_scheduled_tick_is_one_forecast_step(self, mocked_get, mocked_put):
+        mocked_get.return_value = Mock(status_code=200)
+        mocked_get.return_value.json.return_value = { "cpu": { "highPriority": 0.50 }, "replicas": 10 }
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            app_configs = dict(configs, scale_state=None, actuator=None, metric_windows=None, forecaster=None,
+                               cooldown_lock_file=tmp_dir + '/cooldown.lock', predictive_scaling=True,
+                               autoscale_engine_runs_every=10, forecast_season_seconds=40)
+            app_autoscale.autoscale_tick(app_configs)
+            # An early tick for a pushed sample is not a step of the season.
+            app_autoscale.autoscale_tick(app_configs, scheduled=False)
+            forecaster = app_configs['forecaster']
+            self.assertEqual((forecaster.count, forecaster.position), (1, 1))
+            # Neither a converging tick nor a tick without a reading is left out.
+            with patch('modules.app_autoscale._converging', return_value=True):
+                app_autoscale.autoscale_tick(app_configs)
+            mocked_get.return_value.json.return_value = {}
+            app_autoscale.autoscale_tick(app_configs)
+            app_autoscale.skip_forecast(app_configs, 2)
+            self.assertEqual((forecaster.count, forecaster.position), (2, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import unittest
+import tempfile
+import logging
+import sys
+import pathlib
+from unittest.mock import patch, Mock
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+import modules.app_autoscale as app_autoscale
+import modules.history as history
+import modules.simulator as simulator
+import modules.settings as settings
+
+configs =  settings.settings(sys_config=parent_dir + '/etc/system_settings.cfg', user_config=parent_dir + '/etc/user_settings.cfg')
+log = logging.getLogger(__name__)
+log.disabled = True
+configs['log'] = log
+
+
+class TestHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = history.HistoryStore(self.tmp_dir.name + '/history', retention_seconds=100, compact_every_seconds=50, log=log)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_range_queries_and_rollups(self):
+        for second in range(60):
+            self.store.append('web', 0.5 + second / 100, 2 + second // 30, 3, 'scale-out' if second == 29 else None, 'steady', timestamp=1000 + second)
+        # A wall clock step back does not break the time order of the file.
+        self.store.append('web', 0.1, 3, 3, timestamp=900)
+        records = self.store.records('web', 1010, 1020)
+        self.assertEqual(list(records['time']), list(range(1010, 1020)))
+        self.assertAlmostEqual(float(records['cpu'][0]), 0.6, places=6)
+        self.assertEqual(len(self.store.records('web', 1059)), 2)
+        self.assertEqual(len(self.store.records('other')), 0)
+        rollup = self.store.rollup('web', 30, 1000, 1060)
+        self.assertEqual(list(rollup['time']), [990, 1020, 1050])
+        self.assertEqual(list(rollup['samples']), [20, 30, 11])
+        self.assertEqual(list(rollup['replicas_max']), [2, 3, 3])
+        self.assertEqual(list(rollup['scale_outs']), [0, 1, 0])
+
+    def test_torn_record_is_dropped_and_old_records_compacted(self):
+        for second in range(10):
+            self.store.append('web', 0.5, 2, 2, timestamp=1000 + second)
+        with open(self.store.history_file('web'), 'ab') as fh:
+            fh.write(b'\x00' * 5)
+        # Another process reopens the file after a crash.
+        store = history.HistoryStore(self.tmp_dir.name + '/history', retention_seconds=100, compact_every_seconds=50, log=log)
+        store.append('web', 0.5, 2, 2, timestamp=1010)
+        self.assertEqual(len(store.records('web')), 11)
+        store.compact('web', now=1105)
+        self.assertEqual(list(store.records('web')['time']), [1005, 1006, 1007, 1008, 1009, 1010])
+        # The first store sees the compacted file is no longer linked and appends to the new one.
+        self.store.append('web', 0.5, 2, 2, timestamp=1011)
+        self.assertEqual(len(store.records('web')), 7)
+        self.assertEqual(os.path.getsize(store.history_file('web')), history.HEADER.size + 7 * history.RECORD.size)
+        # The time order holds across writers: a record from a process with a clock behind comes after the last one.
+        store.append('web', 0.5, 2, 2, timestamp=1000)
+        self.assertEqual(list(self.store.records('web')['time'][-2:]), [1011, 1011])
+
+    def test_appends_do_not_compact(self):
+        for second in range(10):
+            self.store.append('web', 0.5, 2, 2, timestamp=1000 + second * 100)
+        self.assertEqual(len(self.store.records('web')), 10)
+        self.store.compact('web', now=1900)
+        self.assertEqual(len(self.store.records('web')), 2)
+
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
+    def test_ticks_are_recorded_and_replayed(self, mocked_get, mocked_put):
+        mocked_get.return_value = Mock(status_code=200)
+        mocked_get.return_value.json.return_value = { "cpu": { "highPriority": 0.90 }, "replicas": 10 }
+        mocked_put.return_value = Mock(status_code=204)
+        tick_configs = dict(configs, scale_state=None, actuator=None, metric_windows=None, history=None,
+                            cooldown_lock_file=self.tmp_dir.name + '/cooldown.lock', history_dir=self.tmp_dir.name + '/history')
+        app_autoscale.autoscale_tick(tick_configs)
+        records = history.get_history(tick_configs).records('default')
+        self.assertEqual(len(records), 1)
+        self.assertEqual(history.ACTIONS[records['action'][0]], 'scale-out')
+        self.assertEqual(history.REASONS[records['reason'][0]], 'scale-out')
+        self.assertEqual((int(records['replicas'][0]), int(records['desired'][0])), (10, 12))
+        trace = simulator.load_trace(tick_configs['history_dir'] + '/default.bin')
+        self.assertEqual(list(trace['replicas']), [10])
+        csv_file = self.tmp_dir.name + '/trace.csv'
+        history.export_csv(records, csv_file)
+        self.assertEqual(list(simulator.load_trace(csv_file)['replicas']), [10])
+
+
+if __name__ == '__main__':
+    unittest.main()
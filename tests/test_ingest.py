@@ -0,0 +1,86 @@
+import json
+import time
+import socket
+import unittest
+import tempfile
+import logging
+import urllib.request
+import sys
+import pathlib
+from unittest.mock import patch, Mock
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+import modules.app_autoscale as app_autoscale
+import modules.ingest as ingest
+import modules.settings as settings
+
+configs =  settings.settings(sys_config=parent_dir + '/etc/system_settings.cfg', user_config=parent_dir + '/etc/user_settings.cfg')
+log = logging.getLogger(__name__)
+log.disabled = True
+configs['log'] = log
+
+
+def _free_port(kind=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class TestIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.configs = dict(configs)
+        self.configs['cooldown_lock_file'] = self.tmp_dir.name + '/cooldown.lock'
+        self.configs['push_http_port'] = _free_port()
+        self.configs['push_udp_port'] = _free_port(socket.SOCK_DGRAM)
+        self.inbox = ingest.get_inbox(self.configs)
+        self.servers = ingest.start_listeners(self.inbox, self.configs, log)
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.tmp_dir.cleanup()
+
+    def _push_http(self, payload):
+        request = urllib.request.Request(f'http://127.0.0.1:{self.configs["push_http_port"]}/samples', data=json.dumps(payload).encode(), method='POST')
+        with urllib.request.urlopen(request) as response:
+            return response.status
+
+    def test_http_and_udp_samples_reach_the_inbox(self):
+        self.assertEqual(self._push_http({ "cpu": 0.5, "replicas": 8 }), 204)
+        self.assertEqual(self.inbox.fresh('default', 30), (0.5, 8))
+        self.assertEqual(list(self.inbox.wait(0)), ['default'])
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(json.dumps({ "app_name": "search", "cpu": 0.95, "replicas": 4 }).encode(), ('127.0.0.1', self.configs['push_udp_port']))
+        self.assertEqual(ingest.wait_for_triggers(self.inbox, {'search': self.configs}, 2), ['search'])
+        self.assertEqual(self.inbox.fresh('search', 30), (0.95, 4))
+        with self.assertRaises(urllib.error.HTTPError):
+            self._push_http({ "cpu": "high" })
+
+    def test_only_crossed_targets_trigger_and_triggers_are_debounced(self):
+        apps = {'default': self.configs}
+        self.inbox.put('default', 0.5, 10)
+        self.assertEqual(ingest.wait_for_triggers(self.inbox, apps, 0), [])
+        self.inbox.put('default', 0.9, 10)
+        self.assertEqual(ingest.wait_for_triggers(self.inbox, apps, 0), ['default'])
+        self.inbox.put('default', 0.95, 10)
+        self.assertEqual(ingest.wait_for_triggers(self.inbox, apps, 0), [])
+
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
+    def test_tick_uses_fresh_pushed_sample_and_polls_quiet_apps(self, mocked_get, mocked_put):
+        mocked_put.return_value = Mock(status_code=204)
+        self.inbox.put('default', 0.9, 10)
+        self.assertEqual(app_autoscale.autoscale_tick(self.configs), 12)
+        mocked_get.assert_not_called()
+        mocked_get.return_value = Mock(status_code=200, json=Mock(return_value={ "cpu": { "highPriority": 0.80 }, "replicas": 12 }))
+        self.configs['push_stale_after_seconds'] = 0
+        time.sleep(0.01)
+        self.assertEqual(app_autoscale.autoscale_tick(self.configs), 12)
+        mocked_get.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
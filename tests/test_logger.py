@@ -0,0 +1,71 @@
+import json
+import logging
+import unittest
+import tempfile
+import sys
+import pathlib
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+import modules.settings as settings
+from modules.logger import get_logger, get_app_logger, _JsonFormatter, _LazyQueueHandler
+
+configs =  settings.settings(sys_config=parent_dir + '/etc/system_settings.cfg', user_config=parent_dir + '/etc/user_settings.cfg')
+
+
+class TestLogger(unittest.TestCase):
+
+    def test_get_logger_is_idempotent(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            logger_configs = dict(configs)
+            logger_configs['log_dir'] = log_dir
+            log = get_logger(logger_name=f'{__name__}.idempotent', settings=logger_configs)
+            handlers = list(log.handlers)
+            self.assertIs(get_logger(logger_name=f'{__name__}.idempotent', settings=logger_configs), log)
+            self.assertEqual(log.handlers, handlers)
+
+    def test_reload_swaps_the_handlers(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            logger_configs = dict(configs, log_dir=log_dir, log_format='text', log_async=True)
+            log = get_logger(logger_name=f'{__name__}.reload', settings=logger_configs)
+            log.propagate = False
+            log.info('Before reload')
+            logger_configs.update({'log_format': 'json', 'log_async': False})
+            self.assertIs(get_logger(logger_name=f'{__name__}.reload', settings=logger_configs), log)
+            self.assertEqual(len(log.handlers), 2)
+            log.info('After reload')
+            for handler in log.handlers:
+                handler.flush()
+            with open(f'{log_dir}/{logger_configs["log_file"]}') as fh:
+                lines = fh.read().splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertIn('Before reload', lines[0])
+            self.assertEqual(json.loads(lines[1])['msg'], 'After reload')
+            for handler in log.handlers:
+                handler.close()
+
+    def test_queue_handler_formats_lazily(self):
+        queued = []
+        handler = _LazyQueueHandler(type('Queue', (), {'put_nowait': lambda self, record: queued.append(record)})())
+        log = logging.getLogger(f'{__name__}.lazy')
+        log.addHandler(handler)
+        log.propagate = False
+        log.setLevel(logging.INFO)
+        log.info('Scaled to replicas: %s', 7)
+        log.debug('Suppressed: %s', 8)
+        self.assertEqual(len(queued), 1)
+        self.assertEqual((queued[0].msg, queued[0].args), ('Scaled to replicas: %s', (7,)))
+
+    def test_json_format_with_app_prefix(self):
+        records = []
+        log = logging.getLogger(f'{__name__}.json')
+        log.addHandler(type('Handler', (logging.Handler,), {'emit': lambda self, record: records.append(record)})())
+        log.propagate = False
+        log.setLevel(logging.INFO)
+        get_app_logger(log, 'checkout').info('Desired replicas: %s', 12)
+        entry = json.loads(_JsonFormatter().format(records[0]))
+        self.assertEqual(entry['msg'], '[checkout] Desired replicas: 12')
+        self.assertEqual(entry['level'], 'INFO')
+
+
+if __name__ == '__main__':
+    unittest.main()
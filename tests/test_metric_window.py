@@ -0,0 +1,76 @@
+import math
+import random
+import logging
+import unittest
+import tempfile
+import sys
+import pathlib
+from unittest.mock import patch, Mock
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+import modules.app_autoscale as app_autoscale
+import modules.settings as settings
+from modules.metric_window import MetricWindow
+
+configs =  settings.settings(sys_config=parent_dir + '/etc/system_settings.cfg', user_config=parent_dir + '/etc/user_settings.cfg')
+log = logging.getLogger(__name__)
+log.disabled = True
+configs['log'] = log
+
+
+class TestMetricWindow(unittest.TestCase):
+
+    def test_aggregates_match_brute_force(self):
+        rng = random.Random(11)
+        # Without an aggregate a percentile sorts on read, with a percentile aggregate the sorted copy is kept.
+        for window in (MetricWindow(size=7, ewma_alpha=0.5), MetricWindow(size=7, ewma_alpha=0.5, aggregate='p90')):
+            samples = []
+            ewma = None
+            for _ in range(50):
+                value = rng.choice([rng.uniform(0, 10), 5.0])
+                window.add(value)
+                samples.append(value)
+                ewma = value if ewma is None else ewma + 0.5 * (value - ewma)
+                recent = sorted(samples[-7:])
+                self.assertEqual(window.last(), value)
+                self.assertAlmostEqual(window.mean(), sum(recent) / len(recent))
+                self.assertEqual(window.max(), recent[-1])
+                self.assertEqual(window.percentile(90), recent[math.ceil(0.9 * len(recent)) - 1])
+                self.assertAlmostEqual(window.aggregate('ewma'), ewma)
+
+    def test_unknown_aggregate(self):
+        with self.assertRaises(ValueError):
+            MetricWindow(size=3).aggregate('median')
+
+
+class TestWindowedDecisions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.configs = dict(configs)
+        self.configs.update({'cooldown_lock_file': self.tmp_dir.name + '/cooldown.lock', 'cool_down_time_seconds': 0,
+                             'min_replicas': 1, 'max_replicas': 1000})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @patch('requests.Session.put', return_value=Mock(status_code=204))
+    def test_single_spike_is_smoothed(self, mocked_put):
+        self.configs.update({'scale_out_metric_aggregate': 'mean', 'scale_out_metric_window': 4})
+        for cpu in [0.76, 0.76, 0.76]:
+            self.assertEqual(app_autoscale.scale_app_replicas(10, cpu, self.configs, dry_run=False), 10)
+        # A single 0.9 reading would scale out to 12, the mean of the window is 0.795.
+        self.assertEqual(app_autoscale.scale_app_replicas(10, 0.9, self.configs, dry_run=False), 10)
+        mocked_put.assert_not_called()
+
+    @patch('requests.Session.put', return_value=Mock(status_code=204))
+    def test_scale_in_needs_both_windows(self, mocked_put):
+        self.configs.update({'scale_in_metric_aggregate': 'max', 'scale_in_metric_window': 3})
+        self.assertEqual(app_autoscale.scale_app_replicas(10, 0.8, self.configs, dry_run=False), 10)
+        # The last reading alone would scale in to 3 replicas, the max of the scale-in window keeps 10.
+        self.assertEqual(app_autoscale.scale_app_replicas(10, 0.2, self.configs, dry_run=False), 10)
+        mocked_put.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import socket
+import unittest
+import tempfile
+import logging
+import urllib.request
+import sys
+import pathlib
+from unittest.mock import patch, Mock
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+import modules.app_autoscale as app_autoscale
+import modules.metrics as metrics
+import modules.settings as settings
+
+configs =  settings.settings(sys_config=parent_dir + '/etc/system_settings.cfg', user_config=parent_dir + '/etc/user_settings.cfg')
+log = logging.getLogger(__name__)
+log.disabled = True
+configs['log'] = log
+
+
+def _status_response(replicas):
+    mocked_response = Mock()
+    mocked_response.status_code = 200
+    mocked_response.json.return_value = { "cpu": { "highPriority": 0.90 }, "replicas": replicas }
+    return mocked_response
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.configs = dict(configs)
+        self.configs['cooldown_lock_file'] = self.tmp_dir.name + '/cooldown.lock'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = metrics.Histogram('latency_seconds', 'Latency.', ('endpoint',), buckets=(0.1, 1))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(('status',), value)
+        self.assertEqual(histogram.render()[2:], [
+            'latency_seconds_bucket{endpoint="status",le="0.1"} 1',
+            'latency_seconds_bucket{endpoint="status",le="1"} 2',
+            'latency_seconds_bucket{endpoint="status",le="+Inf"} 3',
+            'latency_seconds_sum{endpoint="status"} 5.55',
+            'latency_seconds_count{endpoint="status"} 3',
+        ])
+
+    @patch('requests.Session.put')
+    @patch('requests.Session.get', side_effect=[_status_response(10), _status_response(12)])
+    def test_tick_is_instrumented_and_served(self, mocked_get, mocked_put):
+        mocked_put.return_value = Mock(status_code=204)
+        self.assertEqual(app_autoscale.autoscale_tick(self.configs), 12)
+        self.assertEqual(app_autoscale.autoscale_tick(self.configs), 12)
+        scaler_metrics = metrics.get_metrics(self.configs)
+        self.assertEqual(scaler_metrics.scale_actions.values, {('default', 'scale-out'): 1})
+        self.assertEqual(scaler_metrics.cooldown_skips.values, {('default',): 1})
+        self.assertEqual(scaler_metrics.tick_duration.values[('default',)][2], 2)
+
+        server = metrics.serve_metrics(scaler_metrics, '127.0.0.1', _free_port(), log)
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.server_port}/metrics') as response:
+                body = response.read().decode()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertIn('autoscaler_api_request_duration_seconds_count{app="default",endpoint="replicas",status="204"} 1', body)
+        self.assertIn('autoscaler_desired_replicas{app="default"} 14', body)
+        self.assertIn('autoscaler_phase_duration_seconds_count{app="default",phase="read_metrics"} 2', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import json
+import socket
+import unittest
+import tempfile
+import logging
+import urllib.request
+import sys
+import pathlib
+from unittest.mock import patch, Mock
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+import modules.app_autoscale as app_autoscale
+import modules.metrics as metrics
+import modules.sample_feed as sample_feed
+import modules.settings as settings
+
+configs =  settings.settings(sys_config=parent_dir + '/etc/system_settings.cfg', user_config=parent_dir + '/etc/user_settings.cfg')
+log = logging.getLogger(__name__)
+log.disabled = True
+configs['log'] = log
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class TestSampleFeed(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.configs = dict(configs)
+        self.configs['cooldown_lock_file'] = self.tmp_dir.name + '/cooldown.lock'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_feed_keeps_the_last_samples_per_app(self):
+        feed = sample_feed.SampleFeed(3)
+        for cpu in (0.1, 0.2, 0.3, 0.4):
+            feed.add('web', cpu, 2, 2, 0.8, 0.5, 'steady')
+        feed.add('worker', 0.9, 4, 5, 0.8, 0.5, 'scale-out')
+        seq, samples = feed.since('web')
+        self.assertEqual(seq, 5)
+        self.assertEqual([sample[2] for sample in samples], [0.2, 0.3, 0.4])
+        self.assertEqual([sample[0] for sample in feed.since('web', 3)[1]], [4])
+        self.assertEqual(feed.since('worker', 5), (5, []))
+
+    @patch('requests.Session.put')
+    @patch('requests.Session.get')
+    def test_ticks_are_served_on_samples(self, mocked_get, mocked_put):
+        mocked_get.return_value = Mock(status_code=200)
+        mocked_get.return_value.json.return_value = { "cpu": { "highPriority": 0.90 }, "replicas": 10 }
+        mocked_put.return_value = Mock(status_code=204)
+        app_autoscale.autoscale_tick(self.configs)
+        server = metrics.serve_metrics(metrics.get_metrics(self.configs), '127.0.0.1', _free_port(), log, sample_feed=sample_feed.get_feed(self.configs))
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.server_port}/samples?app=default&since=0') as response:
+                body = json.loads(response.read())
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.server_port}/samples?app=default&since={body["seq"]}') as response:
+                later = json.loads(response.read())
+        finally:
+            server.shutdown()
+            server.server_close()
+        sample = dict(zip(body['fields'], body['samples'][0]))
+        self.assertEqual((sample['cpu'], sample['replicas'], sample['state']), (0.9, 10, 'scale-out'))
+        self.assertEqual(later['samples'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import json
+import unittest
+import tempfile
+import builtins
+import sys
+import pathlib
+from unittest.mock import patch
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+from modules.scale_state import ScaleStateStore
+
+
+class TestScaleStateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.state_file = self.tmp_dir.name + '/cooldown.lock'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_record_and_restore(self):
+        store = ScaleStateStore(self.state_file)
+        store.record_scale_action('checkout', 'scale-out', 12, action_time=100.0)
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['cooldown.lock'])
+        restored = ScaleStateStore(self.state_file)
+        self.assertEqual(restored.last_action('checkout'), {'time': 100.0, 'action': 'scale-out', 'replicas': 12})
+        self.assertIsNone(restored.last_action_time('search'))
+
+    def test_hot_path_does_no_file_io(self):
+        store = ScaleStateStore(self.state_file)
+        store.record_scale_action(None, 'scale-in', 3, action_time=50.0)
+        with patch.object(builtins, 'open', side_effect=AssertionError('file I/O on the hot path')):
+            self.assertEqual(store.last_action_time(None), 50.0)
+
+    def test_cooldown_ignores_wall_clock_jumps(self):
+        store = ScaleStateStore(self.state_file)
+        store.record_scale_action('checkout', 'scale-out', 12)
+        with patch('time.time', return_value=store.last_action_time('checkout') + 3600):
+            self.assertLess(store.seconds_since_last_action('checkout'), 60)
+        # Restored actions only have their wall-clock time.
+        self.assertGreaterEqual(ScaleStateStore(self.state_file).seconds_since_last_action('checkout'), 0)
+        self.assertIsNone(store.seconds_since_last_action('search'))
+
+    def test_restore_legacy_timestamp(self):
+        with open(self.state_file, 'w') as fh:
+            fh.write('1700000000.5')
+        self.assertEqual(ScaleStateStore(self.state_file).last_action_time(None), 1700000000.5)
+
+    def test_corrupt_file_keeps_cooldown(self):
+        with open(self.state_file, 'w') as fh:
+            fh.write('{"default": {"ti')
+        store = ScaleStateStore(self.state_file)
+        self.assertAlmostEqual(store.last_action_time('any-app'), os.path.getmtime(self.state_file))
+        store.clear_cooldown()
+        self.assertIsNone(store.last_action_time('any-app'))
+        with open(self.state_file) as fh:
+            self.assertEqual(json.load(fh), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,7 +15,7 @@ configs['log'] = log
 
 class TestScaleitClient(unittest.TestCase):
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_find_current_cpu_stats(self, mocked_get):
         mocked_response = Mock()
         mocked_response.status_code = 200
@@ -26,7 +26,21 @@ class TestScaleitClient(unittest.TestCase):
         self.assertEqual(cpu, 0.74)
         self.assertEqual(replicas, 10)
         
-    @patch('requests.put')
+    @patch('requests.Session.get')
+    def test_find_current_stats_reads_policy_metrics(self, mocked_get):
+        mocked_response = Mock()
+        mocked_response.status_code = 200
+        mocked_response.json.return_value = { "cpu": { "highPriority": 0.74 }, "memory": { "utilization": "0.61" }, "replicas": 10 }
+        mocked_get.return_value = mocked_response
+        policy_configs = dict(configs)
+        policy_configs['scaling_policies'] = ({ "name": "memory", "key": "memory.utilization", "scale_out_target": 0.85, "scale_in_target": 0.6 },
+                                              { "name": "queue", "key": "queue.depth", "scale_out_target": 100, "scale_in_target": 20 })
+        cpu, replicas, policy_values = scaleit_client.find_current_stats(policy_configs)
+        self.assertEqual((cpu, replicas), (0.74, 10))
+        self.assertEqual(policy_values, { "memory": 0.61, "queue": None })
+        self.assertEqual(mocked_get.call_count, 1)
+
+    @patch('requests.Session.put')
     def test_update_app_replicas(self, mocked_put):
         mocked_response = Mock()
         mocked_response.status_code = 204
@@ -35,6 +49,13 @@ class TestScaleitClient(unittest.TestCase):
         done = scaleit_client.update_app_replicas(replicas=2, settings=configs)
         self.assertEqual(done, True)
         
+    def test_client_precompiles_urls_and_key_paths(self):
+        client = scaleit_client.get_client(configs)
+        self.assertIs(client, scaleit_client.get_client(configs))
+        self.assertEqual(client.status_url, 'http://localhost:8123/app/status')
+        self.assertEqual(client.metrics_key_path, ('cpu', 'highPriority'))
+        self.assertEqual(scaleit_client._make_key_path_value(('spec', 'replicas'), 3), { "spec": { "replicas": 3 } })
+        
         
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import sys
+import pathlib
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+from modules.scheduler import TickScheduler, phase_offset
+
+
+class FakeClock:
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestTickScheduler(unittest.TestCase):
+
+    def test_deadlines_do_not_drift_with_tick_duration(self):
+        clock = FakeClock()
+        tick_scheduler = TickScheduler(10, phase=2, clock=clock)
+        self.assertEqual(tick_scheduler.remaining(), 2)
+        clock.now = 1002 + 3.5 # The tick took 3.5 secs.
+        self.assertEqual(tick_scheduler.advance(), 0)
+        self.assertEqual(tick_scheduler.remaining(), 6.5)
+        clock.now = 1012 + 0.2
+        self.assertEqual(tick_scheduler.advance(), 0)
+        self.assertEqual(tick_scheduler.deadline, 1022)
+
+    def test_overrun_skips_missed_deadlines(self):
+        clock = FakeClock()
+        tick_scheduler = TickScheduler(10, clock=clock)
+        clock.now = 1025 # The tick due at 1000 ran past the deadlines at 1010 and 1020.
+        self.assertEqual(tick_scheduler.advance(), 2)
+        self.assertEqual(tick_scheduler.deadline, 1030)
+        clock.now = 1031
+        self.assertEqual(tick_scheduler.advance(interval=5), 0)
+        self.assertEqual(tick_scheduler.deadline, 1035)
+
+    def test_phase_offset_is_stable_and_bounded(self):
+        offsets = [phase_offset(f'app-{index}', 60, 0.5) for index in range(200)]
+        self.assertTrue(all(0 <= offset < 30 for offset in offsets))
+        self.assertGreater(max(offsets) - min(offsets), 20)
+        self.assertEqual(phase_offset('app-1', 60, 0.5), offsets[1])
+        self.assertEqual(phase_offset('app-1', 60, 0), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
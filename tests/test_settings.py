@@ -0,0 +1,82 @@
+import os
+import shutil
+import unittest
+import tempfile
+import logging
+import sys
+import pathlib
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+import modules.settings as settings
+import modules.app_autoscale as app_autoscale
+import modules.scaleit_client as scaleit_client
+
+log = logging.getLogger(__name__)
+log.disabled = True
+
+
+class TestConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.sys_config = self.tmp_dir.name + '/system_settings.cfg'
+        self.user_config = self.tmp_dir.name + '/user_settings.cfg'
+        shutil.copy(parent_dir + '/etc/system_settings.cfg', self.sys_config)
+        self._write_user_config('max_replicas=40\nmin_replicas=5\n')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write_user_config(self, content):
+        with open(self.user_config, 'w') as fh:
+            fh.write(content)
+        # Make the change visible even on file systems with a coarse mtime.
+        stat = os.stat(self.user_config)
+        os.utime(self.user_config, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9 * (1 + len(content))))
+
+    def test_compiled_config_is_typed_and_read_only(self):
+        config = settings.compile_config(self.sys_config, self.user_config)
+        self.assertEqual(config.max_replicas, 40)
+        self.assertEqual(config['min_replicas'], 5)
+        self.assertIsInstance(config.target_avg_cpu_utilization_for_scale_out, float)
+        self.assertEqual(config.retry_on_http_codes, (5,))
+        with self.assertRaises(AttributeError):
+            config.max_replicas = 1
+        self.assertEqual(settings.get('max_replicas'), 40)
+        self.assertFalse(os.path.exists(self.tmp_dir.name + '/configs.cfg'))
+
+    def test_invalid_config_is_rejected(self):
+        for content, setting in (('log_format=xml\n', 'log_format'), ('max_replicas=4\nmin_replicas=5\n', 'min_replicas')):
+            self._write_user_config(content)
+            with self.assertRaises(settings.ConfigError) as raised:
+                settings.compile_config(self.sys_config, self.user_config)
+            self.assertIn(setting, str(raised.exception))
+
+    def test_watcher_reloads_and_keeps_live_state(self):
+        watcher = settings.ConfigWatcher(self.sys_config, self.user_config)
+        configs = watcher.config.as_settings()
+        configs['log'] = log
+        configs['scale_state'] = object()
+        client = scaleit_client.get_client(configs)
+        windows = app_autoscale._metric_windows(configs)
+        self.assertIsNone(watcher.poll(log))
+
+        self._write_user_config('max_replicas=20\nmin_replicas=5\n')
+        config = watcher.poll(log)
+        self.assertEqual(config.max_replicas, 20)
+        reloaded = config.as_settings(configs)
+        self.assertEqual(reloaded.get('max_replicas'), 20)
+        self.assertIs(reloaded.get('scale_state'), configs.get('scale_state'))
+        self.assertIs(app_autoscale._metric_windows(reloaded), windows)
+        reloaded_client = scaleit_client.get_client(reloaded)
+        self.assertIsNot(reloaded_client, client)
+        self.assertIs(reloaded_client.session, client.session)
+
+        # An invalid change is reported and the current config stays in use.
+        self._write_user_config('max_replicas=two\n')
+        self.assertIsNone(watcher.poll(log))
+        self.assertIs(watcher.config, config)
+
+
+if __name__ == '__main__':
+    unittest.main()
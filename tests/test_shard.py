@@ -0,0 +1,74 @@
+import unittest
+import tempfile
+import logging
+import sys
+import pathlib
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+import modules.shard as shard
+import modules.scale_state as scale_state
+
+log = logging.getLogger(__name__)
+log.disabled = True
+
+APP_NAMES = [f'app-{index}' for index in range(40)]
+
+
+class TestShard(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _worker(self, worker_id):
+        return shard.ShardCoordinator(shard.FileLeaseBackend(self.tmp_dir.name), worker_id, log=log)
+
+    def test_ring_only_moves_the_apps_of_a_leaving_worker(self):
+        three = shard.HashRing(['a', 'b', 'c'])
+        two = shard.HashRing(['a', 'b'])
+        owners = {app_name: three.owner(app_name) for app_name in APP_NAMES}
+        self.assertEqual(set(owners.values()), {'a', 'b', 'c'})
+        for app_name, owner in owners.items():
+            if owner != 'c':
+                self.assertEqual(two.owner(app_name), owner)
+
+    def test_apps_are_split_and_taken_over(self):
+        first, second = self._worker('first'), self._worker('second')
+        first_owned, _ = first.rebalance(APP_NAMES)
+        self.assertEqual(first_owned, set(APP_NAMES))
+        # The second worker joins, it gets its share only once the first one has let go.
+        second_owned, _ = second.rebalance(APP_NAMES)
+        self.assertEqual(second_owned, set())
+        first_owned, _ = first.rebalance(APP_NAMES)
+        second_owned, taken_over = second.rebalance(APP_NAMES)
+        self.assertTrue(first_owned and second_owned)
+        self.assertEqual(taken_over, second_owned)
+        self.assertFalse(first_owned & second_owned)
+        self.assertEqual(first_owned | second_owned, set(APP_NAMES))
+        # The first worker dies (its locks are dropped), the second takes everything on its next rebalance.
+        for kind, name in list(first.backend.held):
+            first.backend.release(kind, name)
+        second_owned, taken_over = second.rebalance(APP_NAMES)
+        self.assertEqual(second_owned, set(APP_NAMES))
+        self.assertEqual(taken_over, first_owned)
+        self.assertEqual(second.backend.live(shard.WORKERS), ['second'])
+
+    def test_shared_store_merges_workers_and_refreshes_taken_over_apps(self):
+        state_file = self.tmp_dir.name + '/scale_state.json'
+        first = scale_state.ScaleStateStore(state_file, log=log, shared=True)
+        second = scale_state.ScaleStateStore(state_file, log=log, shared=True)
+        first.record_scale_action('a', 'scale-out', 5, action_time=100)
+        second.record_scale_action('b', 'scale-in', 2, action_time=200)
+        self.assertIsNone(second.last_action_time('a'))
+        second.refresh('a')
+        self.assertEqual(second.last_action_time('a'), 100)
+        first.clear_cooldown()
+        second.refresh('a')
+        self.assertIsNone(second.last_action_time('a'))
+        self.assertEqual(scale_state.ScaleStateStore(state_file, log=log).last_action_time('b'), 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
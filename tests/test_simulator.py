@@ -0,0 +1,73 @@
+import json
+import unittest
+import tempfile
+import sys
+import pathlib
+import numpy as np
+parent_dir = str(pathlib.Path(__file__).parent.parent)
+sys.path.insert(0, parent_dir)
+import modules.simulator as simulator
+import modules.settings as settings
+
+configs =  settings.settings(sys_config=parent_dir + '/etc/system_settings.cfg', user_config=parent_dir + '/etc/user_settings.cfg')
+
+
+def _make_trace(samples=2000):
+    timestamps = np.arange(samples) * 10.0
+    random = np.random.default_rng(7)
+    demand = 12 + 8 * np.sin(timestamps / 3600) + random.normal(0, 1.5, samples)
+    replicas = np.full(samples, 15)
+    return {'timestamp': timestamps, 'cpu': np.clip(demand / replicas, 0.01, None), 'replicas': replicas}
+
+
+class TestSimulator(unittest.TestCase):
+
+    def test_load_trace_csv_and_jsonl(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(tmp_dir + '/trace.csv', 'w') as fh:
+                fh.write('timestamp,cpu,replicas\n20,0.5,4\n10,0.9,3\n')
+            with open(tmp_dir + '/trace.jsonl', 'w') as fh:
+                fh.write(json.dumps({ "timestamp": 10, "cpu": 0.9, "replicas": 3 }) + '\n')
+                fh.write(json.dumps({ "timestamp": 20, "cpu": 0.5, "replicas": 4 }) + '\n')
+            for trace_file in ['trace.csv', 'trace.jsonl']:
+                trace = simulator.load_trace(tmp_dir + '/' + trace_file)
+                self.assertEqual(list(trace['timestamp']), [10, 20])
+                self.assertEqual(list(trace['replicas']), [3, 4])
+
+    def test_sweep_matches_replay(self):
+        trace = _make_trace()
+        grid = {'target_avg_cpu_utilization_for_scale_out': [0.6, 0.8], 'cool_down_time_seconds': [0, 60], 'autoscale_engine_runs_every': [10, 30]}
+        results = simulator.sweep(trace, grid, configs)
+        self.assertEqual(len(results['replica_hours']), 8)
+        for n in range(8):
+            combination_configs = dict(configs)
+            for name in grid:
+                combination_configs[name] = results[name][n]
+            replayed = simulator.replay(trace, combination_configs)
+            self.assertAlmostEqual(results['replica_hours'][n], replayed['replica_hours'])
+            self.assertEqual(results['time_above_target_seconds'][n], replayed['time_above_target_seconds'])
+            self.assertEqual(results['scale_actions'][n], replayed['scale_actions'])
+            self.assertEqual(results['flaps'][n], replayed['flaps'])
+
+    def test_replay_uses_metric_windows_and_forecast(self):
+        # After a one tick spike, the max over a scale-in window of 3 holds the scale-in back for two more ticks.
+        trace = {'timestamp': np.arange(12) * 10.0, 'cpu': np.array([0.7] * 5 + [0.9] + [0.3] * 6), 'replicas': np.full(12, 10)}
+        replay_configs = dict(configs, autoscale_engine_runs_every=10, cool_down_time_seconds=0)
+        replayed = simulator.replay(trace, replay_configs)
+        self.assertEqual([action['timestamp'] for action in replayed['actions']], [0, 50, 60])
+        replayed = simulator.replay(trace, dict(replay_configs, scale_in_metric_aggregate='max', scale_in_metric_window=3))
+        self.assertEqual([action['timestamp'] for action in replayed['actions']], [0, 50, 80])
+        # A steady ramp is scaled out ahead of the reactive formula once the forecast has warmed up.
+        ramp = {'timestamp': np.arange(10) * 10.0, 'cpu': 0.5 + np.arange(10) * 0.03, 'replicas': np.full(10, 10)}
+        predictive_configs = dict(replay_configs, min_replicas=10, predictive_scaling=True, predictive_horizon_seconds=60,
+                                  forecast_alpha=0.8, forecast_beta=0.8)
+        self.assertEqual(simulator.replay(ramp, dict(predictive_configs, predictive_scaling=False))['scale_actions'], 0)
+        self.assertGreater(simulator.replay(ramp, predictive_configs)['scale_actions'], 0)
+
+    def test_sweep_rejects_unknown_settings(self):
+        with self.assertRaises(ValueError):
+            simulator.sweep(_make_trace(10), {'log_dir': ['/tmp']}, configs)
+
+
+if __name__ == '__main__':
+    unittest.main()